@@ -30,6 +30,9 @@ class TLAnnotation(FlowSpec):
         'pandas': '1.4.1',
         'google-cloud-bigquery': '2.34.0',
         'google-cloud-bigquery-storage': '2.11.0',
+        # the arrow record batches of the streamed tracking locations (to_arrow_iterable)
+        # and the parquet files of the query cache, bigquery 2.34.0 supports pyarrow < 7
+        'pyarrow': '6.0.1',
         'tqdm': '4.64.0',
         'python-dotenv': '0.19.2',
         'pandas-stubs' : '1.2.0.57',
@@ -40,10 +43,14 @@ class TLAnnotation(FlowSpec):
     def run_batch(self):
         import numpy as np
 
-        from tracking_location_annotation.app import run
+        from tracking_location_annotation.app import run, run_incremental
+        from tracking_location_annotation.checkpoint import Checkpointer
         from tracking_location_annotation.sink.csv_sink import CSVSink
         from tracking_location_annotation.google_cloud_storage import upload_filename
         from tracking_location_annotation.data.bigquery_consumer import BqConsumer
+        from tracking_location_annotation.data.query_cache import QueryCache
+        from tracking_location_annotation.sharded import run_sharded
+        from tracking_location_annotation.vectorized import run_vectorized
         
         self.batch_start_date = self.input
         run_batch_size_in_days = self.batch_size_in_days
@@ -52,15 +59,42 @@ class TLAnnotation(FlowSpec):
 
         print(f'running task with start_date={self.batch_start_date} and batch_size={run_batch_size_in_days} day(s)')
         
-        # initilizing sink and consumer
-        bq_consumer = BqConsumer(start_date=self.batch_start_date, batch_size_in_days=run_batch_size_in_days)
-        sink = CSVSink(filename=f'{self.batch_start_date}.csv').connect()
+        # initilizing sink and consumer, tracking locations are streamed instead of downloaded at once
+        # query results are cached only when QUERY_CACHE_DIR points to a volume that outlives the pod
+        cache = QueryCache() if os.getenv('QUERY_CACHE_DIR') else None
+        # with INCREMENTAL_STATE_DIR on a volume that outlives the pods, a batch only reads its own days and starts
+        # from the state left by the previous days, the batches must then run one after the other (e.g. daily runs)
+        state_dir = os.getenv('INCREMENTAL_STATE_DIR')
+        bq_consumer = BqConsumer(start_date=self.batch_start_date, batch_size_in_days=run_batch_size_in_days,
+                                 streaming=True, cache=cache, incremental=bool(state_dir))
+        # with CHECKPOINT_DIR on a volume that outlives the pod, a retry resumes after the last processed day
+        checkpoint_dir = os.getenv('CHECKPOINT_DIR')
+        if checkpoint_dir:
+            batch_name = f'{current.run_id}_{self.batch_start_date}_{run_batch_size_in_days}'
+            checkpointer = Checkpointer(f'{checkpoint_dir}/{batch_name}.checkpoint')
+            sink = checkpointer.connect(CSVSink(filename=f'{checkpoint_dir}/{batch_name}.csv'))
+        else:
+            checkpointer = None
+            sink = CSVSink(filename=f'{self.batch_start_date}.csv').connect()
         
-        # running algorithm
-        run(bq_consumer, sink)
+        # running algorithm, with ANNOTATION_WORKERS > 1 the shards of the batch are annotated in parallel
+        # and with ANNOTATION_ENGINE=vectorized the whole batch is annotated at once
+        workers = int(os.getenv('ANNOTATION_WORKERS', '1'))
+        if state_dir:
+            run_incremental(bq_consumer, sink, state_dir)
+        elif os.getenv('ANNOTATION_ENGINE', 'streaming') == 'vectorized' and not checkpointer:
+            run_vectorized(bq_consumer, sink)
+        elif workers > 1 and not checkpointer:
+            run_sharded(bq_consumer, sink, workers)
+        else:
+            run(bq_consumer, sink, checkpointer=checkpointer)
+        sink.close()
         
         # uploading result to google cloud storage
-        upload_filename(local_filename=sink.filename, remote_dir=f'{current.run_id}')
+        upload_filename(local_filename=sink.filename, remote_dir=f'{current.run_id}',
+                        remote_name=f'{self.batch_start_date}.csv')
+        if checkpointer:
+            checkpointer.remove()
 
         self.next(self.join)
     
@@ -3,13 +3,24 @@ main module that runs the program
 """
 import numpy as np
 
-from tracking_location_annotation import app
+from tracking_location_annotation import app, sharded, vectorized
 from tracking_location_annotation.common import benchmark
+from tracking_location_annotation.common.constants import (
+    ANNOTATION_ENGINE,
+    ANNOTATION_WORKERS,
+    INCREMENTAL_STATE_DIR,
+    LOCAL_DATA_FORMAT,
+    STATE_SPILL_DIR,
+)
 from tracking_location_annotation.common.log import get_logger
 
 # from tracking_location_annotation.data.bigquery_consumer import BqConsumer
 from tracking_location_annotation.data.csv_consumer import CSVConsumer
+from tracking_location_annotation.data.data_provider import DataProvider
+from tracking_location_annotation.data.parquet_consumer import ParquetConsumer
+from tracking_location_annotation.db import StateStore
 from tracking_location_annotation.sink.csv_sink import CSVSink
+from tracking_location_annotation.spill_store import SpillStateStore
 
 logger = get_logger(__name__)
 
@@ -20,14 +31,40 @@ if __name__ == "__main__":
         "running main function with start date: %s and batch size= %d day(s)", str(start_date), batch_size_in_days
     )
     # consumer = BqConsumer(start_date=start_date, batch_size_in_days=batch_size_in_days)
-    consumer = CSVConsumer(
-        start_date=start_date, batch_size_in_days=batch_size_in_days, data_path="tracking_location_annotation/resources"
-    )
+    consumer: DataProvider
+    if LOCAL_DATA_FORMAT == "csv":
+        consumer = CSVConsumer(
+            start_date=start_date,
+            batch_size_in_days=batch_size_in_days,
+            data_path="tracking_location_annotation/resources",
+            incremental=bool(INCREMENTAL_STATE_DIR),
+        )
+    else:
+        consumer = ParquetConsumer(
+            start_date=start_date,
+            batch_size_in_days=batch_size_in_days,
+            data_path="tracking_location_annotation/resources",
+            file_format=LOCAL_DATA_FORMAT,
+            incremental=bool(INCREMENTAL_STATE_DIR),
+        )
     sink = CSVSink(str(start_date) + ".csv").connect()
+    # long batches can keep the cold missions and jobs on disk
+    store = SpillStateStore() if STATE_SPILL_DIR else StateStore()
 
     with benchmark.memory_usage():
-        app.run(data_provider=consumer, data_sink=sink)
+        if INCREMENTAL_STATE_DIR:
+            app.run_incremental(data_provider=consumer, data_sink=sink, state_dir=INCREMENTAL_STATE_DIR, store=store)
+        elif ANNOTATION_ENGINE == "vectorized":
+            vectorized.run_vectorized(data_provider=consumer, data_sink=sink)
+        elif ANNOTATION_WORKERS > 1:
+            if STATE_SPILL_DIR:
+                # every shard keeps its own state in memory, the spill store is not used
+                logger.warning("STATE_SPILL_DIR is ignored with ANNOTATION_WORKERS > 1")
+            sharded.run_sharded(data_provider=consumer, data_sink=sink, workers=ANNOTATION_WORKERS)
+        else:
+            app.run(data_provider=consumer, data_sink=sink, store=store)
 
     sink.close()
+    store.close()
 
     benchmark.print_stats()
@@ -1,11 +1,15 @@
 """
 module to define annotator class
 """
-from tracking_location_annotation.common.log import get_logger
+from typing import Optional
+
+from tracking_location_annotation.common.log import get_logger, get_tracer
+from tracking_location_annotation.db import StateStore, get_store
 from tracking_location_annotation.models import Waypoint
 from tracking_location_annotation.sink.sink import Sink
 
 logger = get_logger(__name__)
+tracer = get_tracer(__name__)
 TIME_LIMIT_MINUTES = 10
 
 
@@ -15,8 +19,9 @@ class Annotator:
     before annotating tracking location records
     """
 
-    def __init__(self, sink: Sink) -> None:
+    def __init__(self, sink: Sink, store: Optional[StateStore] = None) -> None:
         self.sink = sink
+        self.store = get_store(store)
 
     def annotate(self, *, new_waypoint: Waypoint, old_waypoint: Waypoint) -> None:
         """
@@ -33,9 +38,10 @@ class Annotator:
         # waypoint arrived
         # mission cancelled or finished
         # timedetlta <= 10 mins or not
-        if mission := new_waypoint.mission():
+        if mission := new_waypoint.mission(self.store):
             if mission.is_done:
-                time_diff = abs(new_waypoint.timestamp - mission.timestamp).total_seconds()  # type: ignore
+                # timestamps are int64 nanoseconds
+                time_diff = abs(new_waypoint.timestamp - mission.timestamp) / 1e9
                 waypoint_arrived_and_misison_done_within_10_mins = (
                     time_diff / 60 <= TIME_LIMIT_MINUTES and new_waypoint.state in "arrived"
                 )
@@ -43,7 +49,8 @@ class Annotator:
                     self.write_annotation(new_waypoint)
                 else:
                     mission.tls_bucket.clear()
-                    logger.debug("Tracking locations bucket cleared for mission#%d", mission.id)
+                    if tracer.enabled and tracer.sample(mission.id):
+                        logger.debug("Tracking locations bucket cleared for mission#%d", mission.id)
                 return
 
         # pending -> arrived
@@ -58,16 +65,14 @@ class Annotator:
         """
         annotates tl record based on business scenarios
         """
-        mission = waypoint.mission()
+        mission = waypoint.mission(self.store)
         if not mission:
             logger.warning(
                 "annotation skipped for waypoint #%d, mission not found, (job_id = %d)", waypoint.id, waypoint.job_id
             )
             return
 
-        for tl in mission.tls_bucket:
-            tl.waypoint_id = waypoint.id  # type: ignore
-            logger.debug("tracking location %d => waypoint %d", tl.user_id, tl.waypoint_id)
-            self.sink.append(tl)
-
-        mission.tls_bucket.clear()
+        # the sink takes the row positions of the bucket, the records are built when it writes them
+        if tracer.enabled and tracer.sample(mission.id):
+            logger.debug("%d tracking locations => waypoint %d", len(mission.tls_bucket), waypoint.id)
+        self.sink.append_many(mission.tls_bucket, waypoint.id)
@@ -1,108 +1,133 @@
 """
 main module defining application algorithm
 """
-from numpy import datetime64
+from typing import Optional
+
+import numpy as np
 
 from tracking_location_annotation.annotator import Annotator
+from tracking_location_annotation.checkpoint import Checkpoint, Checkpointer
 from tracking_location_annotation.common.benchmark import measure
-from tracking_location_annotation.common.log import get_logger
-from tracking_location_annotation.common.utils import add_if_not_on_top, maybe_int
+from tracking_location_annotation.common.log import get_logger, get_tracer, update_tracers
+from tracking_location_annotation.common.utils import add_if_not_on_top
 from tracking_location_annotation.data.data_provider import DataProvider
-from tracking_location_annotation.data.get_data_util import get_data
+from tracking_location_annotation.data.get_data_util import Entry, TLEvent, TLStep, get_data, to_nanoseconds_scalar
 
-# global dicts
-from tracking_location_annotation.db import (
-    JOBS,
-    MISSIONS,
-    courier_id_to_mission_id,
-    unmapped_jobs,
-    unmapped_waypoints,
-)
+# missions, jobs and waypoints state
+from tracking_location_annotation.db import StateStore, get_store
 
 # models
-from tracking_location_annotation.models import Job, Mission, TrackingLocation, Waypoint
+from tracking_location_annotation.models import Job, Mission, Waypoint
 from tracking_location_annotation.sink.sink import Sink
+from tracking_location_annotation.tl_assignment import assign_missions
 
 # initilizing logger
 logger = get_logger(__name__)
+# the debug logs of the process functions, see Tracer
+tracer = get_tracer(__name__)
 
 
 @measure("process_mission")
-def process_mission(mission: Mission, datetime_upper_limit: datetime64) -> None:
+def process_mission(mission: Mission, datetime_upper_limit: int, store: Optional[StateStore] = None) -> None:
     """function that processes missions, maps jobs to missions
     and calls for annotating tl if there is mission state change"""
-    logger.debug(mission)
+    store = get_store(store)
+    traced = tracer.enabled and tracer.sample(mission.id)
+    if traced:
+        logger.debug(mission)
     if mission.created_at > datetime_upper_limit:
-        logger.debug("mission#%d will not be processed, created at %s", mission.id, str(mission.created_at))
+        if traced:
+            logger.debug("mission#%d will not be processed, created at %s", mission.id, str(mission.created_at))
         return
     # add to/update global missions dict
-    if old_mission_record := MISSIONS.get(mission.id):
+    if old_mission_record := store.missions.get(mission.id):
         mission.jobs = old_mission_record.jobs
         mission.tls_bucket = old_mission_record.tls_bucket
         mission.waypoints_processing_order = old_mission_record.waypoints_processing_order
 
     # match unmatched jobs if any
-    for job in unmapped_jobs.get(mission.id, {}).values():
-        logger.debug("job#{job.id} mapped to mission #{mission.id}")
+    for job in store.unmapped_jobs.take(mission.id):
+        if traced:
+            logger.debug("job#%d mapped to mission #%d", job.id, mission.id)
         mission.add_job(job)
-    unmapped_jobs.pop(mission.id, None)
 
     # remove mission if it's done and the tls are annotated
     if mission.courier_id:
         if not mission.is_done:
             # add to the lookup table
-            courier_id_to_mission_id[mission.courier_id] = mission.id
-    MISSIONS[mission.id] = mission
+            store.courier_id_to_mission_id[mission.courier_id] = mission.id
+    store.store_mission(mission)
 
 
 @measure("process_job")
-def process_job(job: Job, datetime_upper_limit: datetime64) -> None:
+def process_job(job: Job, datetime_upper_limit: int, store: Optional[StateStore] = None) -> None:
     """function to fill that processes jobs to map waypoints to missions"""
-    logger.debug(job)
+    store = get_store(store)
+    traced = tracer.enabled and tracer.sample(job.mission_id)
+    if traced:
+        logger.debug(job)
     if job.created_at > datetime_upper_limit:
-        logger.debug("job#%d will not be processed, created at %s", job.id, str(job.created_at))
+        if traced:
+            logger.debug("job#%d will not be processed, created at %s", job.id, str(job.created_at))
         return
 
-    if old_job_record := JOBS.get(job.id):
+    if old_job_record := store.jobs.get(job.id):
         job.waypoints = old_job_record.waypoints
         # if there is mission_id change
         if job.mission_id != old_job_record.mission_id:
             # umap job from old mission
-            if old_mission := old_job_record.mission():
+            if old_mission := old_job_record.mission(store):
+                store.pending_tls.sync(old_mission)
                 old_mission.remove_job(old_job_record)
                 # clear both tl buckets in case of mission change
                 old_mission.tls_bucket.clear()
-                logger.debug("unmapping job#%d from mission#%d", job.id, old_mission.id)
-            if new_mission := job.mission():
+                if traced:
+                    logger.debug("unmapping job#%d from mission#%d", job.id, old_mission.id)
+            if new_mission := job.mission(store):
+                store.pending_tls.sync(new_mission)
                 new_mission.jobs_from_other_missions.add(job.id)
                 new_mission.intermediate_tls_bucket = new_mission.tls_bucket
                 new_mission.tls_bucket.clear()
 
-    if mission := job.mission():
+    if mission := job.mission(store):
         mission.add_job(job)
     else:
-        logger.debug("job#%d added to unmapped_jobs, mission not found", job.id)
+        if traced:
+            logger.debug("job#%d added to unmapped_jobs, mission not found", job.id)
         if job.mission_id:
-            unmapped_jobs[job.mission_id][job.id] = job
+            store.unmapped_jobs.add(job.mission_id, job)
 
-    for waypoint in unmapped_waypoints.get(job.id, {}).values():
-        logger.debug("waypoint#%d mapped to job #%d", waypoint.id, job.id)
+    for waypoint in store.unmapped_waypoints.take(job.id):
+        if traced:
+            logger.debug("waypoint#%d mapped to job #%d", waypoint.id, job.id)
         job.add_waypoint(waypoint)
-    unmapped_waypoints.pop(job.id, None)
 
-    JOBS[job.id] = job
+    store.store_job(job)
+
+
+def _mission_id(waypoint: Waypoint, store: StateStore) -> Optional[int]:
+    "returns the id of the mission of the waypoint, to trace its events"
+    job = waypoint.job(store)
+    return job.mission_id if job else None
 
 
 @measure("process_waypoint")
-def process_waypoint(waypoint: Waypoint, annotator: Annotator, datetime_upper_limit: datetime64) -> None:
+def process_waypoint(
+    waypoint: Waypoint, annotator: Annotator, datetime_upper_limit: int, store: Optional[StateStore] = None
+) -> None:
     """function to fill processes waypoints and calls for
     annotating tl in case there is waypoint state change"""
-    logger.debug(waypoint)
+    store = get_store(store)
+    traced = tracer.enabled and tracer.sample(_mission_id(waypoint, store))
+    if traced:
+        logger.debug(waypoint)
     if waypoint.created_at > datetime_upper_limit:
-        logger.debug("waypoint#%d will not be processed, created at %s", waypoint.id, str(waypoint.created_at))
+        if traced:
+            logger.debug("waypoint#%d will not be processed, created at %s", waypoint.id, str(waypoint.created_at))
         return
     # check if waypoint are out of order
-    if mission := waypoint.mission():
+    if mission := waypoint.mission(store):
+        store.pending_tls.sync(mission)
         out_of_order_waypoints = False
         if len(mission.waypoints_processing_order) > 1:
             if (
@@ -111,7 +136,7 @@ def process_waypoint(waypoint: Waypoint, annotator: Annotator, datetime_upper_li
                 and waypoint.id in mission.waypoints_processing_order
             ):
                 # order not istablished
-                if mission.tls_bucket:
+                if traced and mission.tls_bucket:
                     logger.debug(
                         "waypoints out of order for mission#%d, clearing bucket of size %d",
                         mission.id,
@@ -122,10 +147,10 @@ def process_waypoint(waypoint: Waypoint, annotator: Annotator, datetime_upper_li
         if waypoint.state != "pending" and not out_of_order_waypoints:
             add_if_not_on_top(mission.waypoints_processing_order, waypoint.id)
 
-    if job := waypoint.job():
+    if job := waypoint.job(store):
         if old_waypoint := job.waypoints.get(waypoint.id):
             if not old_waypoint.state == waypoint.state:
-                if mission := waypoint.mission():
+                if mission := waypoint.mission(store):
                     if waypoint.job_id in mission.jobs_from_other_missions:
                         mission.intermediate_tls_bucket.clear()
                         mission.jobs_from_other_missions.discard(waypoint.job_id)
@@ -137,50 +162,131 @@ def process_waypoint(waypoint: Waypoint, annotator: Annotator, datetime_upper_li
                 annotator.annotate(old_waypoint=old_waypoint, new_waypoint=waypoint)
         job.add_waypoint(waypoint)
     else:
-        logger.debug("waypoint added to unmapped_waypoints, job not found: %s", waypoint)
+        if traced:
+            logger.debug("waypoint added to unmapped_waypoints, job not found: %s", waypoint)
         if waypoint.job_id:
-            unmapped_waypoints[waypoint.job_id][waypoint.id] = waypoint
+            store.unmapped_waypoints.add(waypoint.job_id, waypoint)
+
+
+@measure("process_tls")
+def process_tls(tl_step: TLStep, datetime_upper_limit: int, store: Optional[StateStore] = None) -> None:
+    """function to assign the TLs of a step to their missions at once (see tl_assignment),
+    they are added to the mission bucket when the mission is next used by a job or a waypoint"""
+    store = get_store(store)
+    mission_ids, states = assign_missions(tl_step, store, datetime_upper_limit)
+    if tracer.enabled:
+        logger.debug("%d TLs of the step assigned to missions", np.count_nonzero(mission_ids))
+        # one line per traced mission, like the TLs of process_tl
+        for mission_id, count in zip(*np.unique(mission_ids[mission_ids != 0], return_counts=True)):
+            if tracer.sample(int(mission_id)):
+                logger.debug("%d TLs of the step assigned to mission#%d", count, mission_id)
+    store.pending_tls.add(tl_step.chunks, mission_ids, tl_step.positions, tl_step.chunk_indexes, tl_step.rows, states)
 
 
 @measure("process_tl")
-def process_tl(tl: TrackingLocation) -> None:
-    """function to add TLs to mission bucket"""
-    logger.debug(tl)
+def process_tl(tl: TLEvent, store: Optional[StateStore] = None) -> None:
+    """function to add TLs to mission bucket, the tl is an event (see get_data_util.tl_events)
+    pointing to its row in a chunk of the cleaned tracking locations"""
+    store = get_store(store)
+    mission_id = store.courier_id_to_mission_id.get(tl.user_id)
+    traced = tracer.enabled and tracer.sample(mission_id)
+    if traced:
+        logger.debug("TL at row %d, courier_id:%s, mission#%s", tl.row, tl.user_id, mission_id)
     # if courier is in misison, add tls to mission bucket
-    if mission_id := courier_id_to_mission_id.get(tl.user_id):
-        if mission := MISSIONS.get(mission_id):
-            tl.mission_state = mission.state  # type: ignore
-            mission.tls_bucket.append(tl)
+    if mission_id:
+        if mission := store.missions.get(mission_id):
+            mission.tls_bucket.append(tl.chunk, tl.row, mission.state)
             return
 
-        logger.debug("courier's mission#%d not found", mission_id)
+        if traced:
+            logger.debug("courier's mission#%d not found", mission_id)
     # else
-    logger.debug("courier %d not assigned to any missions", tl.user_id)
+    if traced:
+        logger.debug("courier %d not assigned to any missions", tl.user_id)
+
+
+def get_datetime_upper_limit(data_provider: DataProvider) -> int:
+    "returns the end date of the data provider, records created after it are not processed"
+    # timestamps are int64 nanoseconds once cleaned
+    return int(data_provider.end_date.astype("datetime64[ns]").astype(np.int64))
 
 
-def run(data_provider: DataProvider, data_sink: Sink) -> None:
-    """itrate over dataframe records partitioned by minute and process them"""
+def process_entry(entry: Entry, annotator: Annotator, datetime_upper_limit: int, store: StateStore) -> None:
+    """function to dispatch a record yielded by get_data to its process function"""
+    if entry.record_type == "mission":
+        process_mission(Mission(*entry), datetime_upper_limit, store)
+    elif entry.record_type == "waypoint":
+        process_waypoint(
+            Waypoint(*entry),
+            annotator=annotator,
+            datetime_upper_limit=datetime_upper_limit,
+            store=store,
+        )
+    elif entry.record_type == "job":
+        process_job(Job(*entry), datetime_upper_limit, store)
+    elif entry.record_type == "tl":
+        process_tl(entry, store)
+    elif entry.record_type == "tls":
+        process_tls(entry, datetime_upper_limit, store)
+
+
+def run(
+    data_provider: DataProvider,
+    data_sink: Sink,
+    store: Optional[StateStore] = None,
+    checkpointer: Optional[Checkpointer] = None,
+    start_from: Optional[Checkpoint] = None,
+) -> None:
+    """itrate over dataframe records partitioned by minute and process them,
+    keeping the state in the store (the default store if none).
+    with a checkpointer the state is saved at every step end, and a run with a checkpoint
+    starts from it (the sink must be connected with checkpointer.connect),
+    otherwise the run starts from start_from if given (see run_incremental)"""
+    state: StateStore = get_store(store)
+    update_tracers()
+    if checkpointer and checkpointer.checkpoint:
+        start_from = checkpointer.checkpoint
+    resume_step = None
+    if start_from:
+        state.restore(start_from.store)
+        resume_step = start_from.step
 
     @measure("app.sink.flush")
     def flush_sink():
         if data_sink.name != "memory_sink":
             data_sink.flush()
 
-    annotator = Annotator(data_sink)
+    def end_step(step: int):
+        flush_sink()
+        if checkpointer:
+            checkpointer.save(step, state.snapshot(), data_sink.offset())
+
+    annotator = Annotator(data_sink, state)
+    datetime_upper_limit = get_datetime_upper_limit(data_provider)
     with measure("app.run.for_loop"):
-        for entry in get_data(data_provider=data_provider, on_batch_end=flush_sink):
-            if hasattr(entry, "id") and not maybe_int(entry.id):
-                continue
-
-            if entry.record_type == "mission":
-                process_mission(Mission(*entry), data_provider.end_date.astype("datetime64[h]"))
-            elif entry.record_type == "waypoint":
-                process_waypoint(
-                    Waypoint(*entry),
-                    annotator=annotator,
-                    datetime_upper_limit=data_provider.end_date.astype("datetime64[h]"),
-                )
-            elif entry.record_type == "job":
-                process_job(Job(*entry), data_provider.end_date.astype("datetime64[h]"))
-            elif entry.record_type == "tl":
-                process_tl(TrackingLocation(entry))
+        for entry in get_data(data_provider=data_provider, on_batch_end=end_step, store=state, resume_step=resume_step):
+            process_entry(entry, annotator, datetime_upper_limit, state)
+
+
+def run_incremental(
+    data_provider: DataProvider, data_sink: Sink, state_dir: str, store: Optional[StateStore] = None
+) -> None:
+    """runs the days of an incremental data provider (only reading its own days) starting
+    from the state left by the run of the previous days, and saves the state left by these days
+    for the next run, as {state_dir}/{first day}.state, so missions crossing days are annotated.
+    without a state for the first day the run starts empty, the steps always start at midnight"""
+    if not data_provider.incremental:
+        raise ValueError(f"{data_provider} reads an extra day, it must be created with incremental=True")
+    store = get_store(store)
+    start = Checkpointer(f"{state_dir}/{data_provider.start_date}.state")
+    start_step = to_nanoseconds_scalar(data_provider.start_date)
+    if start.checkpoint is None:
+        logger.warning("no state found for %s, starting empty", data_provider.start_date)
+        start.checkpoint = Checkpoint(start_step, StateStore().snapshot(), sink_offset=None)
+    elif start.checkpoint.step != start_step:
+        raise ValueError(f"the state of {start.path} ends at {start.checkpoint.step}, not at {start_step}")
+
+    run(data_provider, data_sink, store, start_from=start.checkpoint)
+
+    end = Checkpointer(f"{state_dir}/{data_provider.end_date}.state")
+    end.save(to_nanoseconds_scalar(data_provider.end_date), store.snapshot(), sink_offset=None)
@@ -0,0 +1,60 @@
+"""
+benchmark of the handoff of the mission buckets to the sink in Annotator.write_annotation,
+compares the copies of every bucket segment with append_rows to the bulk append_many,
+for buckets of a few tracking locations (short waypoints) up to a few thousands
+
+    python -m tracking_location_annotation.benchmarks.annotator
+"""
+import time
+from typing import Callable, List
+
+import numpy as np
+import pandas as pd
+
+from tracking_location_annotation.models import TLBucket
+from tracking_location_annotation.sink.memory_sink import MemorySink
+from tracking_location_annotation.sink.sink import Sink
+
+
+def legacy_handoff(sink: Sink, bucket: TLBucket, waypoint_id: int) -> None:
+    """the previous implementation, a copy of every segment then a clear"""
+    for chunk, rows, states in bucket.segments():
+        sink.append_rows(chunk, rows, states, waypoint_id)
+    bucket.clear()
+
+
+def fill_buckets(chunks: List[pd.DataFrame], buckets: int, tls_per_bucket: int) -> List[TLBucket]:
+    "returns buckets of tracking locations taken from the chunks in turns, one segment per chunk"
+    filled = []
+    for _ in range(buckets):
+        bucket = TLBucket()
+        for row in range(tls_per_bucket):
+            bucket.append(chunks[row * len(chunks) // tls_per_bucket], row, "in_progress")
+        filled.append(bucket)
+    return filled
+
+
+def seconds(handoff: Callable[[Sink, TLBucket, int], None], buckets: List[TLBucket]) -> float:
+    "returns the time spent handing the buckets over to a memory sink"
+    sink = MemorySink().connect()
+    start = time.perf_counter()
+    for waypoint_id, bucket in enumerate(buckets):
+        handoff(sink, bucket, waypoint_id)
+    return time.perf_counter() - start
+
+
+def main(buckets: int = 20000, chunks: int = 4) -> None:
+    "prints the handoff time per bucket for every bucket size"
+    frames = [pd.DataFrame({"uuid": np.arange(5000)}) for _ in range(chunks)]
+    for tls_per_bucket in (4, 64, 1024):
+        count = buckets * 4 // tls_per_bucket
+        before = seconds(legacy_handoff, fill_buckets(frames, count, tls_per_bucket))
+        after = seconds(Sink.append_many, fill_buckets(frames, count, tls_per_bucket))
+        print(
+            f"{tls_per_bucket:>5} tls per bucket: append_rows {before / count * 1e6:6.2f}us,"
+            f" append_many {after / count * 1e6:6.2f}us per bucket ({before / after:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+benchmark of the local data providers, writes a synthetic day as csv,
+parquet and arrow files and times fetching and cleaning it with
+CSVConsumer and ParquetConsumer
+
+    python -m tracking_location_annotation.benchmarks.consumers
+"""
+import tempfile
+import time
+
+import numpy as np
+
+from tracking_location_annotation.benchmarks.synthetic import make_frames
+from tracking_location_annotation.data.csv_consumer import CSVConsumer
+from tracking_location_annotation.data.get_data_util import clean_data
+from tracking_location_annotation.data.parquet_consumer import COLUMNS, ParquetConsumer, write_tables
+
+START_DATE = np.datetime64("2022-02-01")
+
+
+def main(days: int = 1, couriers: int = 500, tls_per_courier_per_day: int = 2000) -> None:
+    "prints the time each provider takes to fetch and clean the same data"
+    frames = make_frames(START_DATE, days=days, couriers=couriers, tls_per_courier_per_day=tls_per_courier_per_day)
+    print(f"{sum(map(len, frames)):,} records")
+    with tempfile.TemporaryDirectory() as data_path:
+        for name, dataframe in zip(COLUMNS, frames):
+            dataframe.to_csv(f"{data_path}/{name}.csv", index=False, date_format="%Y-%m-%d %H:%M:%S.%f%z")
+        write_tables(frames, data_path, "parquet")
+        write_tables(frames, data_path, "arrow")
+
+        providers = {
+            "csv": CSVConsumer(START_DATE, days, data_path),
+            "parquet": ParquetConsumer(START_DATE, days, data_path, file_format="parquet"),
+            "arrow": ParquetConsumer(START_DATE, days, data_path, file_format="arrow"),
+        }
+        for name, provider in providers.items():
+            timer = time.perf_counter()
+            *_, tl_chunks = clean_data(provider)
+            list(tl_chunks)
+            print(f"{name:<8} fetch + clean in {time.perf_counter() - timer:6.2f}s")
+
+
+if __name__ == "__main__":
+    main()
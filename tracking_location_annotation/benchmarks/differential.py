@@ -0,0 +1,63 @@
+"""
+differential check and benchmark of the vectorized engine, annotates noisy synthetic days
+with app.run and with run_vectorized for every seed, counting the annotations that differ:
+
+    python -m tracking_location_annotation.benchmarks.differential 10 0.2    # seeds 0 to 9, 20% of noise
+    python -m tracking_location_annotation.benchmarks.differential 1 0 7 500 2000    # throughput on clean days
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from tracking_location_annotation import app, vectorized
+from tracking_location_annotation.benchmarks.synthetic import SyntheticProvider
+from tracking_location_annotation.db import StateStore
+from tracking_location_annotation.sink.memory_sink import MemorySink
+
+ENGINES = {
+    "app.run": lambda data_provider, data_sink: app.run(data_provider, data_sink, StateStore()),
+    "vectorized": vectorized.run_vectorized,
+}
+
+
+def mismatches(expected: pd.DataFrame, actual: pd.DataFrame) -> int:
+    "returns the number of annotations of one engine that the other doesn't write, or writes differently"
+    merged = expected.astype(str).merge(actual.astype(str), how="outer", indicator=True)
+    return int((merged["_merge"] != "both").sum())
+
+
+def main(
+    seeds: int = 10, noise: float = 0.2, days: int = 3, couriers: int = 50, tls_per_courier_per_day: int = 500
+) -> None:
+    "prints the wall time and the throughput of both engines and the mismatches of every seed"
+    failures = 0
+    for seed in range(seeds):
+        provider = SyntheticProvider(
+            np.datetime64("2022-02-01"),
+            days,
+            couriers=couriers,
+            tls_per_courier_per_day=tls_per_courier_per_day,
+            noise=noise,
+            seed=seed,
+        )
+        tls = days * couriers * tls_per_courier_per_day
+        results = {}
+        for name, engine in ENGINES.items():
+            sink = MemorySink().connect()
+            start = time.perf_counter()
+            engine(provider, sink)
+            elapsed = time.perf_counter() - start
+            results[name] = sink.get_dataframe()
+            print(f"seed {seed}, {name}: {elapsed:.2f}s, {tls / elapsed:,.0f} tracking locations/s")
+        expected, actual = results["app.run"], results["vectorized"]
+        count = 0 if actual.equals(expected) else max(mismatches(expected, actual), 1)
+        failures += bool(count)
+        print(f"seed {seed}: {len(expected)} annotations, {count} mismatches")
+    print(f"{failures} seeds out of {seeds} with mismatches")
+
+
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    main(*map(int, arguments[:1]), *map(float, arguments[1:2]), *map(int, arguments[2:]))
@@ -0,0 +1,69 @@
+"""
+benchmark of the eviction at the step boundaries, sweeping the whole MISSIONS dict
+against popping the expired entries of the timestamp index, and memory held by
+waypoints whose job never arrives with and without the orphans ttl
+
+    python -m tracking_location_annotation.benchmarks.eviction
+"""
+import time
+import tracemalloc
+
+from tracking_location_annotation import db
+from tracking_location_annotation.data.get_data_util import STEP
+from tracking_location_annotation.models import Mission, Waypoint
+
+STEPS_PER_DAY = 24
+
+
+def sweep(store: db.StateStore, limit: int) -> None:
+    "the eviction before the timestamp index, walking every mission"
+    for k in list(store.missions.keys()):
+        if store.missions[k].timestamp < limit:
+            store.missions[k].tls_bucket.clear()
+            if (mission := store.missions.pop(k, None)) and mission.courier_id is not None:
+                store.courier_id_to_mission_id.pop(mission.courier_id, None)
+
+
+def run(evict, days: int, missions_per_day: int, retention_days: int) -> float:
+    "stores the missions of every hour and evicts the ones older than the retention, returns the eviction time"
+    store = db.StateStore()
+    hour = STEP // STEPS_PER_DAY
+    missions_per_step = missions_per_day // STEPS_PER_DAY
+    elapsed = 0.0
+    for step in range(days * STEPS_PER_DAY):
+        for i in range(missions_per_step):
+            mission_id = step * missions_per_step + i
+            store.store_mission(Mission(mission_id, i, "in_progress", 0, 0, step * hour, "mission"))
+            store.courier_id_to_mission_id[i] = mission_id
+        timer = time.perf_counter()
+        evict(store, step * hour - retention_days * STEP)
+        elapsed += time.perf_counter() - timer
+    return elapsed
+
+
+def orphans(ttl: int, days: int, orphans_per_day: int) -> float:
+    "buffers waypoints that are never matched and returns the memory held at the end in MB"
+    buffer: db.OrphanBuffer[Waypoint] = db.OrphanBuffer("benchmark_orphans", ttl=ttl, max_size=10**9)
+    tracemalloc.start()
+    for day in range(days):
+        for i in range(orphans_per_day):
+            waypoint_id = day * orphans_per_day + i
+            buffer.add(waypoint_id, Waypoint(waypoint_id, waypoint_id, None, "pending", 0, 0, day * STEP, "waypoint"))
+        buffer.evict(day * STEP)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current / 10**6
+
+
+def main(days: int = 14, missions_per_day: int = 48_000) -> None:
+    "prints the time spent evicting with both implementations, the more missions are kept the more the sweep costs"
+    for retention_days in (1, 7):
+        for name, evict in (("sweep", sweep), ("index", db.StateStore.evict)):
+            elapsed = run(evict, days, missions_per_day, retention_days)
+            print(f"retention {retention_days}d, {name}: {elapsed:.2f}s")
+    for name, ttl in (("no ttl", days * STEP), ("ttl 1d", STEP)):
+        print(f"orphans over {days}d, {name}: {orphans(ttl, days, missions_per_day // 4):.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+benchmark of the merged event stream produced by get_data,
+compares the per-day filter_df + sorted() + clear_df implementation
+with the presorted k-way merge over cursors on the same synthetic input.
+every implementation runs in its own process so the peak RSS is its own
+
+    python -m tracking_location_annotation.benchmarks.get_data
+"""
+import multiprocessing
+import time
+from functools import partial
+from typing import Callable, Dict, Iterator
+
+import numpy as np
+import pandas as pd
+
+from tracking_location_annotation.benchmarks.synthetic import SyntheticProvider
+from tracking_location_annotation.common.benchmark import resource_usage
+from tracking_location_annotation.data.data_provider import DataProvider
+from tracking_location_annotation.data.get_data_util import STEP, clean_data, get_data
+
+
+def legacy_get_data(data_provider: DataProvider) -> Iterator:
+    """the previous implementation, boolean masks, a python sort and in-place drops per day"""
+    df_missions, df_waypoints, df_jobs, tl_chunks = clean_data(data_provider)
+    df_tl = pd.concat(list(tl_chunks))
+    min_ts = min(df.timestamp.min() for df in (df_missions, df_waypoints, df_jobs, df_tl))
+    max_ts = max(df.timestamp.max() for df in (df_missions, df_waypoints, df_jobs, df_tl))
+    steps = list(range(min_ts, max_ts + 1, STEP))
+    steps.append(steps[-1] + STEP)
+    for prev_step, step in zip(steps[:-1], steps[1:]):
+        entries = []
+        for dataframe in (df_missions, df_waypoints, df_jobs, df_tl):
+            step_df = dataframe[dataframe.timestamp.between(prev_step, step, inclusive="left")]
+            entries += list(step_df.itertuples(index=False))
+        for dataframe in (df_missions, df_waypoints, df_jobs, df_tl):
+            dataframe.drop(dataframe[dataframe.timestamp < prev_step].index, axis=0, inplace=True)
+        yield from sorted(entries, key=lambda element: element.timestamp)
+
+
+def events_per_second(name: str, events: Callable[[], Iterator]) -> float:
+    "consumes the event stream and prints its throughput"
+    timer = time.perf_counter()
+    count = sum(1 for _ in events())
+    duration = time.perf_counter() - timer
+    print(f"{name:<12} {count:>10} events in {duration:7.2f}s -> {count / duration:>12,.0f} events/sec")
+    return count / duration
+
+
+IMPLEMENTATIONS: Dict[str, Callable[[DataProvider], Iterator]] = {
+    "before": legacy_get_data,
+    "after": partial(get_data, bulk_tls=False),
+    # the tracking locations of a step are one event
+    "bulk_tls": get_data,
+}
+
+
+def _run(name: str, days: int, couriers: int, tls_per_courier_per_day: int) -> None:
+    provider = SyntheticProvider(
+        np.datetime64("2022-02-01"), days, couriers=couriers, tls_per_courier_per_day=tls_per_courier_per_day
+    )
+    with resource_usage(name):
+        events_per_second(name, lambda: IMPLEMENTATIONS[name](provider))
+
+
+def main(days: int = 3, couriers: int = 200, tls_per_courier_per_day: int = 2000) -> None:
+    "runs the implementations on the same synthetic data, each in a fresh process"
+    context = multiprocessing.get_context("spawn")
+    for name in IMPLEMENTATIONS:
+        process = context.Process(target=_run, args=(name, days, couriers, tls_per_courier_per_day))
+        process.start()
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+micro-benchmark of the id validation, compares checking and converting
+the ids with maybe_int for every record (and again in the model constructors)
+with validating them once per frame with validate_ids
+
+    python -m tracking_location_annotation.benchmarks.ids
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+from tracking_location_annotation.common.utils import maybe_int
+from tracking_location_annotation.data.get_data_util import validate_ids
+from tracking_location_annotation.models import Waypoint
+
+START_DATE = np.datetime64("2022-02-01")
+
+
+class LegacyWaypoint(Waypoint):
+    "waypoint converting its ids in the constructor, as the models did before"
+
+    def __init__(self, id, job_id, courier_id, *args) -> None:  # pylint: disable=redefined-builtin
+        super().__init__(int(id), maybe_int(job_id), maybe_int(courier_id), *args)
+
+
+def make_waypoints(rows: int, seed: int = 0) -> pd.DataFrame:
+    "waypoints with float ids, some of them missing or 0 as they come from csv files"
+    rng = np.random.default_rng(seed)
+    # int64 nanoseconds like the other cleaned columns, only the ids differ between the implementations
+    timestamps = np.datetime64(START_DATE, "ns").astype(np.int64) + np.sort(rng.integers(0, 86_400 * 10**9, rows))
+    ids = rng.integers(1, rows, rows).astype(float)
+    ids[rng.random(rows) < 0.01] = np.nan
+    ids[rng.random(rows) < 0.01] = 0
+    courier_ids = rng.integers(1, 1000, rows).astype(float)
+    courier_ids[rng.random(rows) < 0.3] = np.nan
+    return pd.DataFrame(
+        {
+            "id": ids,
+            "job_id": rng.integers(1, rows, rows).astype(float),
+            "courier_id": courier_ids,
+            "state": rng.choice(["pending", "arrived", "finished"], rows),
+            "created_at": timestamps,
+            "updated_at": timestamps,
+            "timestamp": timestamps,
+            "record_type": "waypoint",
+        }
+    )
+
+
+def before(df_waypoints: pd.DataFrame) -> int:
+    "per record filtering and conversion"
+    count = 0
+    for entry in df_waypoints.itertuples(index=False):
+        if hasattr(entry, "id") and not maybe_int(entry.id):
+            continue
+        LegacyWaypoint(*entry)
+        count += 1
+    return count
+
+
+def after(df_waypoints: pd.DataFrame) -> int:
+    "ids validated once for the frame"
+    df_waypoints = validate_ids(df_waypoints)
+    count = 0
+    for entry in df_waypoints.itertuples(index=False):
+        Waypoint(*entry)
+        count += 1
+    return count
+
+
+def main(rows: int = 1_000_000) -> None:
+    "prints the records per second of both implementations"
+    df_waypoints = make_waypoints(rows)
+    for implementation in (before, after):
+        timer = time.perf_counter()
+        count = implementation(df_waypoints.copy())
+        duration = time.perf_counter() - timer
+        print(
+            f"{implementation.__name__:<8} {count:>10} records in {duration:6.2f}s"
+            f" -> {count / duration:>12,.0f} records/sec"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+memory benchmark of the models, prints the bytes used by every tracking location
+and mission object, the record values are shared with the cleaned rows so they are not counted,
+and the bytes used by every tracking location waiting in a mission bucket
+
+    python -m tracking_location_annotation.benchmarks.models
+"""
+import tracemalloc
+from typing import Callable, List
+
+import numpy as np
+
+from tracking_location_annotation.benchmarks.synthetic import SyntheticProvider
+from tracking_location_annotation.data.get_data_util import clean_data
+from tracking_location_annotation.models import Mission, TLBucket, TrackingLocation
+
+
+def bytes_per_object(rows: List, model: Callable) -> float:
+    "returns the memory allocated per object while building one object per row"
+    tracemalloc.start()
+    objects = [model(row) for row in rows]
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return allocated / len(objects)
+
+
+def bytes_per_bucket_entry(tl_chunks: List) -> float:
+    "returns the memory allocated per row position kept in a bucket"
+    tracemalloc.start()
+    bucket = TLBucket()
+    rows = 0
+    for df_tl in tl_chunks:
+        for row in range(len(df_tl)):
+            bucket.append(df_tl, row, "in_progress")
+        rows += len(df_tl)
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return allocated / rows
+
+
+def main(couriers: int = 100, tls_per_courier_per_day: int = 1000) -> None:
+    "prints the bytes per tracking location, per mission and per bucket entry"
+    provider = SyntheticProvider(
+        np.datetime64("2022-02-01"), 1, couriers=couriers, tls_per_courier_per_day=tls_per_courier_per_day
+    )
+    df_missions, _, _, tl_stream = clean_data(provider)
+    tl_chunks = list(tl_stream)
+    tl_rows = [row for df_tl in tl_chunks for row in df_tl.itertuples(index=False)]
+    mission_rows = list(df_missions.itertuples(index=False))
+
+    print(f"tracking location: {bytes_per_object(tl_rows, TrackingLocation):7.1f} bytes")
+    print(f"mission:           {bytes_per_object(mission_rows, lambda row: Mission(*row)):7.1f} bytes")
+    print(f"bucket entry:      {bytes_per_bucket_entry(tl_chunks):7.1f} bytes")
+
+
+if __name__ == "__main__":
+    main()
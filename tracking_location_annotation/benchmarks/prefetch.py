@@ -0,0 +1,77 @@
+"""
+benchmark of the steps prefetching of get_data, annotates synthetic days with app.run
+for every number of prefetched steps, the tracking locations are streamed one hour at a time
+with a download latency per chunk like the bigquery storage api:
+
+    python -m tracking_location_annotation.benchmarks.prefetch 0.05    # 50ms per chunk
+"""
+import sys
+import time
+from typing import Iterator, Tuple
+
+import numpy as np
+import pandas as pd
+
+from tracking_location_annotation import app
+from tracking_location_annotation.benchmarks.synthetic import SyntheticProvider
+from tracking_location_annotation.common import benchmark
+from tracking_location_annotation.data import get_data_util
+from tracking_location_annotation.db import StateStore
+from tracking_location_annotation.sink.memory_sink import MemorySink
+
+
+class StreamingProvider(SyntheticProvider):
+    "synthetic provider streaming the tracking locations by hour, waiting latency seconds for every chunk"
+
+    def __init__(self, *args, latency: float = 0.0, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.latency = latency
+
+    def stream_data(self) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, Iterator[pd.DataFrame]]:
+        df_missions, df_waypoints, df_jobs, df_tl = self.fetch_data()
+        df_tl = df_tl.sort_values("timestamp", kind="mergesort", ignore_index=True)  # stable
+        hours = pd.to_datetime(df_tl["timestamp"], utc=True).dt.floor("h")
+
+        def chunks() -> Iterator[pd.DataFrame]:
+            for _, chunk in df_tl.groupby(hours, sort=True):
+                time.sleep(self.latency)
+                yield chunk.reset_index(drop=True)
+
+        return df_missions, df_waypoints, df_jobs, chunks()
+
+
+def main(latency: float = 0.05, days: int = 3, couriers: int = 200, tls_per_courier_per_day: int = 2000) -> None:
+    "prints the wall time of app.run and the prefetch instrumentation for 0 to 2 prefetched steps"
+    benchmark.BENCHMARK = True
+    provider = StreamingProvider(
+        np.datetime64("2022-02-01"),
+        days,
+        couriers=couriers,
+        tls_per_courier_per_day=tls_per_courier_per_day,
+        latency=latency,
+    )
+    expected = None
+    for prefetch_steps in range(3):
+        get_data_util.PREFETCH_STEPS = prefetch_steps
+        benchmark.reset()
+        sink = MemorySink().connect()
+        start = time.perf_counter()
+        app.run(provider, sink, StateStore())
+        elapsed = time.perf_counter() - start
+        if expected is None:
+            expected = sink.get_dataframe()
+        assert sink.get_dataframe().equals(expected)
+        stats = ""
+        if prefetch_steps:
+            depths = benchmark.gauges["data.prefetch.queue_depth"]
+            stats = (
+                f", stall {sum(benchmark.traces['data.prefetch.stall']) / 1e9:.2f}s,"
+                f" backpressure {sum(benchmark.traces['data.prefetch.backpressure']) / 1e9:.2f}s,"
+                f" mean queue depth {np.mean(depths):.1f}"
+            )
+        print(f"{prefetch_steps} prefetched steps: {elapsed:.2f}s{stats}")
+
+
+if __name__ == "__main__":
+    latency, *sizes = sys.argv[1:] or ["0.05"]
+    main(float(latency), *map(int, sizes))
@@ -0,0 +1,44 @@
+"""
+benchmark of the sharded engine, annotates synthetic days with app.run
+and with run_sharded for every number of workers, writing to a memory sink:
+
+    python -m tracking_location_annotation.benchmarks.sharded 4    # 1 to 4 workers
+"""
+import sys
+import time
+
+import numpy as np
+
+from tracking_location_annotation import app, sharded
+from tracking_location_annotation.benchmarks.synthetic import SyntheticProvider
+from tracking_location_annotation.common import benchmark
+from tracking_location_annotation.db import StateStore
+from tracking_location_annotation.sink.memory_sink import MemorySink
+
+
+def main(max_workers: int = 4, days: int = 2, couriers: int = 200, tls_per_courier_per_day: int = 2000) -> None:
+    "prints the wall time of every engine and checks they annotate the same records"
+    provider = SyntheticProvider(
+        np.datetime64("2022-02-01"), days, couriers=couriers, tls_per_courier_per_day=tls_per_courier_per_day
+    )
+    sink = MemorySink().connect()
+    start = time.perf_counter()
+    app.run(provider, sink, StateStore())
+    print(f"app.run: {time.perf_counter() - start:.2f}s, {len(sink.annotated)} annotations")
+    expected = sink.get_dataframe()
+
+    for workers in range(1, max_workers + 1):
+        sink = MemorySink().connect()
+        benchmark.reset()
+        start = time.perf_counter()
+        sharded.run_sharded(provider, sink, workers)
+        stages = ", ".join(
+            f"{label.split('.')[-1]} {sum(benchmark.traces[label]) / 1e9:.2f}s"
+            for label in ("sharded.partition", "sharded.pool", "sharded.merge")
+        )
+        assert sink.get_dataframe().equals(expected)
+        print(f"run_sharded with {workers} workers: {time.perf_counter() - start:.2f}s ({stages})")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,41 @@
+"""
+benchmark of the spill state store, runs the app on synthetic days writing
+to a csv sink with the state in memory or spilled to sqlite. the peak RSS is
+process wide so run one store per process:
+
+    python -m tracking_location_annotation.benchmarks.spill          # in memory
+    python -m tracking_location_annotation.benchmarks.spill 1000     # at most 1000 missions and jobs in memory
+"""
+import sys
+import tempfile
+
+import numpy as np
+
+from tracking_location_annotation import app
+from tracking_location_annotation.benchmarks.synthetic import SyntheticProvider
+from tracking_location_annotation.common import benchmark
+from tracking_location_annotation.db import StateStore
+from tracking_location_annotation.sink.csv_sink import CSVSink
+from tracking_location_annotation.spill_store import SpillStateStore
+
+
+def main(max_hot: int = 0, days: int = 4, couriers: int = 500, tls_per_courier_per_day: int = 1000) -> None:
+    "prints the wall time, peak RSS and spill counters of one run"
+    benchmark.BENCHMARK = True
+    provider = SyntheticProvider(
+        np.datetime64("2022-02-01"), days, couriers=couriers, tls_per_courier_per_day=tls_per_courier_per_day
+    )
+    with tempfile.TemporaryDirectory() as path:
+        store = SpillStateStore(path, max_hot=max_hot) if max_hot else StateStore()
+        sink = CSVSink(f"{path}/output.csv").connect()
+        with benchmark.resource_usage(f"max hot {max_hot or 'unlimited'}"):
+            app.run(data_provider=provider, data_sink=sink, store=store)
+        sink.close()
+        store.close()
+    for label, value in sorted(benchmark.counters.items()):
+        if label.startswith("state."):
+            print(f"{label}: {value}")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
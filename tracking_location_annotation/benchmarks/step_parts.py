@@ -0,0 +1,55 @@
+"""
+benchmark of the steps split in parts of at most max_step_events records, annotates synthetic days
+with app.run for every limit (0 for whole steps), each in a fresh process so the peak RSS is its own.
+the annotations are written to a csv file, kept in memory they would be most of the peak.
+the prefetched steps are materialized, so their size is what the limit bounds, most of all
+without bulk_tls where every tracking location is a tuple
+
+    python -m tracking_location_annotation.benchmarks.step_parts 0 1000000 100000
+"""
+import multiprocessing
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+from tracking_location_annotation import app
+from tracking_location_annotation.benchmarks.synthetic import SyntheticProvider
+from tracking_location_annotation.common import benchmark
+from tracking_location_annotation.common.benchmark import resource_usage
+from tracking_location_annotation.data import get_data_util
+from tracking_location_annotation.db import StateStore
+from tracking_location_annotation.sink.csv_sink import CSVSink
+
+
+def _run(max_step_events: int, bulk_tls: bool, days: int, couriers: int, tls_per_courier_per_day: int) -> None:
+    provider = SyntheticProvider(
+        np.datetime64("2022-02-01"), days, couriers=couriers, tls_per_courier_per_day=tls_per_courier_per_day
+    )
+    get_data_util.STEP_MAX_EVENTS = max_step_events
+    get_data_util.BULK_TLS = bulk_tls
+    benchmark.BENCHMARK = True
+    benchmark.reset()
+    with resource_usage(f"max_step_events={max_step_events} bulk_tls={bulk_tls}"):
+        with tempfile.TemporaryDirectory() as directory:
+            app.run(provider, CSVSink(os.path.join(directory, "output.csv")).connect(), StateStore())
+    sizes = benchmark.gauges["data.step_records"]
+    if sizes:
+        print(f"  {len(sizes)} parts, largest {max(sizes):,} records")
+
+
+def main(*limits: int, days: int = 3, couriers: int = 500, tls_per_courier_per_day: int = 2000) -> None:
+    "prints the wall time and the peak RSS of app.run for every limit, with and without bulk_tls"
+    context = multiprocessing.get_context("spawn")
+    for bulk_tls in (True, False):
+        for max_step_events in limits or (0, 1_000_000, 100_000):
+            process = context.Process(
+                target=_run, args=(max_step_events, bulk_tls, days, couriers, tls_per_courier_per_day)
+            )
+            process.start()
+            process.join()
+
+
+if __name__ == "__main__":
+    main(*(int(limit) for limit in sys.argv[1:]))
@@ -0,0 +1,41 @@
+"""
+benchmark of the streaming mode, replays a synthetic day in real time (speed times faster)
+through run_streaming and prints the latency percentiles, then the throughput without pacing:
+
+    python -m tracking_location_annotation.benchmarks.streaming 3600 1    # an hour per second, 1s lag
+"""
+import sys
+import time
+
+import numpy as np
+
+from tracking_location_annotation import streaming
+from tracking_location_annotation.benchmarks.synthetic import SyntheticProvider
+from tracking_location_annotation.db import StateStore
+from tracking_location_annotation.sink.memory_sink import MemorySink
+
+
+def main(speed: float = 3600, lag_seconds: float = 1, couriers: int = 20, tls_per_courier_per_day: int = 2000) -> None:
+    "prints the latencies of a paced replay and the records per second of an unpaced one"
+    provider = SyntheticProvider(
+        np.datetime64("2022-02-01"), 1, couriers=couriers, tls_per_courier_per_day=tls_per_courier_per_day
+    )
+    records = list(streaming.replay(provider))
+    print(f"{len(records):,} records")
+
+    # the lag is in event time and in wall time, so the paced replay waits at most lag_seconds
+    latencies = streaming.run_streaming(
+        streaming.replay(provider, speed), MemorySink().connect(), StateStore(), lag_seconds=lag_seconds
+    )
+    print(f"replayed {speed:g} times faster than real time with a {lag_seconds:g}s lag, latencies in ms:")
+    print(latencies.round(2).to_string())
+
+    start = time.perf_counter()
+    streaming.run_streaming(iter(records), MemorySink().connect(), StateStore(), lag_seconds=lag_seconds)
+    elapsed = time.perf_counter() - start
+    print(f"unpaced: {elapsed:.2f}s, {len(records) / elapsed:,.0f} records/s")
+
+
+if __name__ == "__main__":
+    speed, lag_seconds, *sizes = sys.argv[1:] + ["3600", "1"][len(sys.argv[1:]) :]
+    main(float(speed), float(lag_seconds), *map(int, sizes))
@@ -0,0 +1,151 @@
+"""
+module to generate synthetic missions, jobs, waypoints and tracking locations
+with the same columns as the BigQuery tables, used by the benchmarks
+"""
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+from tracking_location_annotation.data.data_provider import DataProvider
+
+MISSIONS_PER_COURIER_PER_DAY = 4
+JOBS_PER_MISSION = 2
+
+
+# pylint: disable=too-many-locals
+def make_frames(
+    start_date: np.datetime64, days: int = 1, couriers: int = 100, tls_per_courier_per_day: int = 1000, seed: int = 0
+) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    returns missions, waypoints, jobs and tracking locations dataframes
+    where every courier works a few missions a day, every mission has some jobs
+    with a pickup and a dropoff waypoint going pending -> arrived -> finished
+    """
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp(start_date).tz_localize("UTC")
+    missions, jobs, waypoints = [], [], []
+    mission_id, job_id, waypoint_id = 1, 1, 1
+    mission_length = pd.Timedelta(hours=24 / MISSIONS_PER_COURIER_PER_DAY)
+    for day in range(days):
+        for courier_id in range(1, couriers + 1):
+            for slot in range(MISSIONS_PER_COURIER_PER_DAY):
+                begin = start + pd.Timedelta(days=day) + slot * mission_length
+                begin += pd.Timedelta(seconds=int(rng.integers(0, 600)))
+                end = begin + mission_length * 0.8
+                missions += [
+                    (mission_id, None, "pending", begin, begin),
+                    (mission_id, courier_id, "in_progress", begin, begin + pd.Timedelta(minutes=1)),
+                    (mission_id, courier_id, "complete", begin, end),
+                ]
+                for job in range(JOBS_PER_MISSION):
+                    jobs += [
+                        (job_id, "requested", begin, begin, None),
+                        (job_id, "received", begin, begin + pd.Timedelta(seconds=30), mission_id),
+                    ]
+                    for leg in range(2):
+                        arrived = begin + (mission_length * 0.8) * (2 * job + leg + 1) / (2 * JOBS_PER_MISSION + 1)
+                        waypoints += [
+                            (waypoint_id, job_id, None, "pending", begin, begin + pd.Timedelta(seconds=40)),
+                            (waypoint_id, job_id, courier_id, "arrived", begin, arrived),
+                            (waypoint_id, job_id, courier_id, "finished", begin, arrived + pd.Timedelta(minutes=5)),
+                        ]
+                        waypoint_id += 1
+                    job_id += 1
+                mission_id += 1
+
+    df_missions = pd.DataFrame(missions, columns=["id", "courier_id", "state", "created_at", "updated_at"])
+    df_missions["timestamp"] = df_missions["updated_at"]
+    df_jobs = pd.DataFrame(jobs, columns=["id", "state", "created_at", "updated_at", "mission_id"])
+    df_jobs["timestamp"] = df_jobs["updated_at"]
+    df_waypoints = pd.DataFrame(waypoints, columns=["id", "job_id", "courier_id", "state", "created_at", "updated_at"])
+    df_waypoints["timestamp"] = df_waypoints["updated_at"]
+
+    n_tls = days * couriers * tls_per_courier_per_day
+    offsets = rng.integers(0, days * 24 * 3600 * 1000, n_tls)
+    timestamps = start + pd.TimedeltaIndex(offsets, unit="ms")
+    df_tl = pd.DataFrame(
+        {
+            "user_id": rng.integers(1, couriers + 1, n_tls),
+            "recorded_at": timestamps,
+            "is_moving": rng.random(n_tls) > 0.3,
+            "uuid": [f"tl-{i}" for i in range(n_tls)],
+            "timestamp": timestamps,
+            "odometer": rng.random(n_tls) * 1000,
+            "battery_level": rng.random(n_tls),
+            "altitude": rng.random(n_tls) * 10,
+            "longitude": 55 + rng.random(n_tls),
+            "altitude_accuracy": rng.random(n_tls),
+            "latitude": 25 + rng.random(n_tls),
+            "speed": rng.random(n_tls) * 20,
+            "heading": rng.random(n_tls) * 360,
+            "coords_accuracy": rng.random(n_tls) * 10,
+            "activity_type": rng.choice(["in_vehicle", "still", "on_foot"], n_tls),
+            "activity_confidence": rng.integers(0, 100, n_tls),
+        }
+    )
+    return df_missions, df_waypoints, df_jobs, df_tl
+
+
+class SyntheticProvider(DataProvider):
+    """
+    data provider serving synthetic dataframes,
+    every fetch returns fresh copies so runs don't affect each other
+    """
+
+    def __init__(self, start_date: np.datetime64, batch_size_in_days: int, noise: float = 0, **kwargs) -> None:
+        super().__init__(start_date, batch_size_in_days)
+        self.frames = make_frames(start_date, days=batch_size_in_days, **kwargs)
+        if noise:
+            self.frames = add_noise(self.frames, noise, kwargs.get("seed", 0))
+
+    def fetch_data(self) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+        df_missions, df_waypoints, df_jobs, df_tl = self.frames
+        return df_missions.copy(), df_waypoints.copy(), df_jobs.copy(), df_tl.copy()
+
+
+def add_noise(
+    frames: Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame], rate: float = 0.05, seed: int = 0
+) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    returns copies of the frames of make_frames with the irregularities of the real tables:
+    jobs moving to other missions, waypoints sent again later, dropped and late records,
+    couriers changing missions, missions updated again days later and records created
+    after the end date, every kind on a rate of the records
+    """
+    rng = np.random.default_rng(seed)
+    df_missions, df_waypoints, df_jobs, df_tl = (df.copy() for df in frames)
+    end = max(df["timestamp"].max() for df in frames)
+
+    def pick(dataframe: pd.DataFrame) -> pd.DataFrame:
+        return dataframe[rng.random(len(dataframe)) < rate]
+
+    def delay(dataframe: pd.DataFrame, low: pd.Timedelta, high: pd.Timedelta) -> pd.DataFrame:
+        offsets = rng.integers(low.value, high.value, len(dataframe)).astype("timedelta64[ns]")
+        return dataframe.assign(
+            timestamp=dataframe["timestamp"] + offsets, updated_at=dataframe["updated_at"] + offsets
+        )
+
+    # jobs moving to another mission, waypoints and missions sent again later
+    moved = delay(pick(df_jobs[df_jobs["mission_id"].notna()]), pd.Timedelta(0), pd.Timedelta(hours=3))
+    moved["mission_id"] = rng.choice(df_missions["id"].to_numpy(), len(moved))
+    resent = delay(pick(df_waypoints), pd.Timedelta(0), pd.Timedelta(hours=2))
+    revived = delay(pick(df_missions), pd.Timedelta(days=1), pd.Timedelta(days=2))
+    df_jobs, df_waypoints = pd.concat([df_jobs, moved]), pd.concat([df_waypoints, resent])
+    df_missions = pd.concat([df_missions, revived])
+
+    noisy = []
+    for dataframe in (df_missions, df_waypoints, df_jobs):
+        # dropped records, records received an hour early or late and created after the end date
+        dataframe = dataframe[rng.random(len(dataframe)) >= rate].reset_index(drop=True)
+        shifted = rng.random(len(dataframe)) < rate
+        dataframe.loc[shifted] = delay(dataframe[shifted], pd.Timedelta(hours=-1), pd.Timedelta(hours=1))
+        dataframe.loc[rng.random(len(dataframe)) < rate / 5, "created_at"] = end + pd.Timedelta(days=2)
+        noisy.append(dataframe.sort_values("timestamp", kind="mergesort", ignore_index=True))
+    df_missions, df_waypoints, df_jobs = noisy
+
+    swapped = (rng.random(len(df_missions)) < rate) & df_missions["courier_id"].notna()
+    df_missions.loc[swapped, "courier_id"] = rng.choice(df_tl["user_id"].drop_duplicates().to_numpy(), swapped.sum())
+    df_tl["user_id"] = df_tl["user_id"].astype("Int64")
+    df_tl.loc[rng.random(len(df_tl)) < rate, "user_id"] = pd.NA
+    return df_missions, df_waypoints, df_jobs, df_tl
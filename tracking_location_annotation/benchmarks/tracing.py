@@ -0,0 +1,60 @@
+"""
+benchmark of the debug logs of the process functions, annotates synthetic days with app.run
+without bulk_tls (every tracking location goes through process_tl) with debug disabled,
+with 1 in every events traced, and with the events of one mission traced, the debug logs
+are written to a temporary file
+
+    python -m tracking_location_annotation.benchmarks.tracing 1000
+"""
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from tracking_location_annotation import app
+from tracking_location_annotation.benchmarks.synthetic import SyntheticProvider
+from tracking_location_annotation.common.log import update_tracers
+from tracking_location_annotation.data import get_data_util
+from tracking_location_annotation.db import StateStore
+from tracking_location_annotation.sink.memory_sink import MemorySink
+
+LOGGERS = ["tracking_location_annotation.app", "tracking_location_annotation.annotator"]
+
+
+def main(every: int = 1000, days: int = 2, couriers: int = 200, tls_per_courier_per_day: int = 2000) -> None:
+    "prints the wall time of app.run and the lines logged for every tracing mode"
+    provider = SyntheticProvider(
+        np.datetime64("2022-02-01"), days, couriers=couriers, tls_per_courier_per_day=tls_per_courier_per_day
+    )
+    get_data_util.BULK_TLS = False
+    mission_id = int(provider.frames[0].id.iloc[0])
+    modes = {
+        "debug disabled": (logging.INFO, 1, frozenset()),
+        f"1 in {every} events": (logging.DEBUG, every, frozenset()),
+        f"mission #{mission_id}": (logging.DEBUG, 1, frozenset({mission_id})),
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        for name, (level, sample_every, mission_ids) in modes.items():
+            path = os.path.join(directory, "debug.log")
+            handler = logging.FileHandler(path, mode="w")
+            for logger_name in LOGGERS:
+                logger = logging.getLogger(logger_name)
+                logger.setLevel(level)
+                logger.propagate = False
+                logger.handlers = [handler]
+            update_tracers(every=sample_every, mission_ids=mission_ids)
+
+            start = time.perf_counter()
+            app.run(provider, MemorySink().connect(), StateStore())
+            elapsed = time.perf_counter() - start
+            handler.close()
+            with open(path, encoding="utf-8") as file:
+                lines = sum(1 for _ in file)
+            print(f"{name:<20} {elapsed:6.2f}s, {lines:>9,} lines logged")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,75 @@
+"""
+module to define the Checkpointer, saving the annotation state at the step ends
+so a retried run resumes after the last processed step instead of the first one
+"""
+import os
+import pickle
+from pathlib import Path
+from typing import Any, Dict, NamedTuple, Optional
+
+from tracking_location_annotation.common import benchmark
+from tracking_location_annotation.common.benchmark import measure
+from tracking_location_annotation.common.log import get_logger
+from tracking_location_annotation.sink.sink import Sink
+
+logger = get_logger(__name__)
+
+
+class Checkpoint(NamedTuple):
+    """the state after a step: the end of the step, the store snapshot and the sink offset"""
+
+    step: int
+    store: Dict[str, Any]
+    sink_offset: Optional[int]
+
+
+class Checkpointer:
+    """
+    writes a checkpoint to path at every step end and loads it when created,
+    the path should be unique to the batch (start date and size) and outlive the process,
+    like the sink output that is resumed with it
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = Path(path)
+        self.checkpoint = self._load()
+
+    def __str__(self) -> str:
+        return f"checkpointer - path: {self.path}"
+
+    def _load(self) -> Optional[Checkpoint]:
+        if not self.path.exists():
+            return None
+        with open(self.path, "rb") as file:
+            checkpoint = pickle.load(file)
+        logger.info("loaded checkpoint %s", self.path)
+        return checkpoint
+
+    def connect(self, sink: Sink) -> Sink:
+        """
+        resumes the sink at the checkpoint offset, or connects it
+        and drops the checkpoint when the sink can't be resumed
+        """
+        if self.checkpoint is not None and sink.resume(self.checkpoint.sink_offset):
+            return sink
+        if self.checkpoint is not None:
+            logger.warning("%s can't be resumed, starting over", sink)
+            self.checkpoint = None
+        return sink.connect()
+
+    def save(self, step: int, store: Dict[str, Any], sink_offset: Optional[int]) -> None:
+        "writes the checkpoint, under a temporary name first so a crash never leaves a partial file"
+        with measure("checkpoint.save"):
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(".tmp")
+            with open(tmp_path, "wb") as file:
+                pickle.dump(Checkpoint(step, store, sink_offset), file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+        size = self.path.stat().st_size
+        benchmark.gauge("checkpoint.bytes", size)
+        logger.info("checkpoint of %d bytes saved to %s", size, self.path)
+
+    def remove(self) -> None:
+        "removes the checkpoint once the run is done"
+        self.path.unlink(missing_ok=True)
+        self.checkpoint = None
@@ -1,11 +1,13 @@
 """
 Defining a decorator to measure the performance if the code
 """
+import resource
+import sys
 import time
 import tracemalloc
 from collections import defaultdict
 from contextlib import ContextDecorator, contextmanager
-from typing import TypeVar
+from typing import Dict, List, TypeVar
 
 import numpy as np
 import pandas as pd
@@ -14,6 +16,8 @@ from tracking_location_annotation.common.constants import BENCHMARK
 
 Func = TypeVar("Func")
 traces = defaultdict(lambda: [])
+counters: Dict[str, int] = defaultdict(int)
+gauges: Dict[str, List[int]] = defaultdict(list)
 
 
 @contextmanager
@@ -31,6 +35,30 @@ def memory_usage():
     tracemalloc.stop()
 
 
+def peak_rss_mb() -> float:
+    """
+    Returns the peak resident set size of the process so far in MB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on linux
+    return peak / 10**6 if sys.platform == "darwin" else peak / 10**3
+
+
+@contextmanager
+def resource_usage(label: str = "resource_usage"):
+    """
+    Prints wall time of the yielded code and the peak RSS of the process,
+    unlike memory_usage it sees memory allocated outside python (numpy, pandas, arrow).
+    The peak is process wide, run one measurement per process to compare implementations.
+    """
+
+    timer = time.monotonic()
+
+    yield
+
+    print(f"{label}: wall time {time.monotonic() - timer:.2f}s; peak RSS {peak_rss_mb():.1f}MB")
+
+
 class measure(ContextDecorator):  # pylint: disable =invalid-name
     """
     Class that can be used as a decorator or as context to measure the performance of the code.
@@ -61,6 +89,11 @@ class measure(ContextDecorator):  # pylint: disable =invalid-name
 
         return super().__call__(func)  # type: ignore
 
+    def _recreate_cm(self):
+        # a fresh instance per decorated call, so the same function
+        # can be measured from several threads at once
+        return measure(self.label)
+
     def __enter__(self):
         if BENCHMARK:
             self.start_time = time.monotonic_ns()
@@ -73,9 +106,35 @@ class measure(ContextDecorator):  # pylint: disable =invalid-name
         return False
 
 
+def count(label: str, value: int = 1) -> None:
+    """
+    Increments the counter with the given label, counters are printed by print_stats.
+    """
+    if BENCHMARK:
+        counters[label] += value
+
+
+def gauge(label: str, value: int) -> None:
+    """
+    Records the current value of the gauge with the given label, print_stats prints the last and max values.
+    """
+    if BENCHMARK:
+        gauges[label].append(value)
+
+
+def frame_memory(label: str, dataframe: pd.DataFrame) -> None:
+    """
+    Adds the memory used by the dataframe, in bytes, to the counter with the given label.
+    """
+    if BENCHMARK:
+        counters[label] += int(dataframe.memory_usage(deep=True).sum())
+
+
 def reset():
-    "Remove all the traces callected."
+    "Remove all the traces, counters and gauges callected."
     traces.clear()
+    counters.clear()
+    gauges.clear()
 
 
 def print_stats(sort_by="sum", ascending=False):
@@ -90,6 +149,23 @@ def print_stats(sort_by="sum", ascending=False):
     if not BENCHMARK:
         return
 
+    if counters:
+        print(pd.Series(counters, name="count").sort_index().to_string())
+
+    if gauges:
+        print(
+            pd.DataFrame(
+                {
+                    "last": [values[-1] for values in gauges.values()],
+                    "max": [max(values) for values in gauges.values()],
+                },
+                index=list(gauges),
+            ).sort_index()
+        )
+
+    if not traces:
+        return
+
     dataframe = pd.DataFrame(
         [
             pd.Series(runs, name=name).agg(
@@ -9,5 +9,46 @@ from dotenv import load_dotenv
 load_dotenv()
 
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# log file written along stderr, when set
+LOG_FILE = os.getenv("LOG_FILE", "")
+# debug logs of the process_* functions: 1 in LOG_SAMPLE_EVERY events, or only the events
+# of the missions in LOG_TRACE_MISSION_IDS (comma separated ids) when set
+LOG_SAMPLE_EVERY = int(os.getenv("LOG_SAMPLE_EVERY", "1"))
+LOG_TRACE_MISSION_IDS = frozenset(
+    int(mission_id) for mission_id in os.getenv("LOG_TRACE_MISSION_IDS", "").split(",") if mission_id.strip()
+)
 # kafka
-BENCHMARK = os.environ.get("BENCHMARK", "False")
+BENCHMARK = os.environ.get("BENCHMARK", "False").lower() == "true"
+# local cache of bigquery results
+QUERY_CACHE_DIR = os.getenv("QUERY_CACHE_DIR", ".query_cache")
+QUERY_CACHE_MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_BYTES", str(20 * 10**9)))
+# format of the local data files read by __main__: csv, parquet or arrow
+LOCAL_DATA_FORMAT = os.getenv("LOCAL_DATA_FORMAT", "csv")
+# waypoints and jobs received before their parent are dropped after waiting this long, or when too many wait
+ORPHAN_TTL_HOURS = int(os.getenv("ORPHAN_TTL_HOURS", "24"))
+ORPHAN_MAX_SIZE = int(os.getenv("ORPHAN_MAX_SIZE", "1000000"))
+# spill the least recently used missions and jobs to a sqlite file in this directory, when set,
+# keeping at most STATE_HOT_RECORDS of each in memory
+STATE_SPILL_DIR = os.getenv("STATE_SPILL_DIR", "")
+STATE_HOT_RECORDS = int(os.getenv("STATE_HOT_RECORDS", "100000"))
+# incremental runs only read their own days and carry the state between runs in this directory, when set
+INCREMENTAL_STATE_DIR = os.getenv("INCREMENTAL_STATE_DIR", "")
+# worker processes of the sharded engine, 1 runs the single process engine
+ANNOTATION_WORKERS = int(os.getenv("ANNOTATION_WORKERS", "1"))
+# steps get_data prepares on a background thread while the current one is processed, 0 prepares them inline
+PREFETCH_STEPS = int(os.getenv("PREFETCH_STEPS", "1"))
+# steps with more records than this are prepared and processed in parts, 0 for whole steps
+STEP_MAX_EVENTS = int(os.getenv("STEP_MAX_EVENTS", "1000000"))
+# tracking locations are assigned to missions in bulk (see get_data_util.TLStep), false processes them one at a time
+BULK_TLS = os.getenv("BULK_TLS", "True").lower() == "true"
+# engine of a batch without checkpoints: streaming (app.run, sharded with ANNOTATION_WORKERS > 1) or vectorized
+ANNOTATION_ENGINE = os.getenv("ANNOTATION_ENGINE", "streaming")
+# streaming mode: records wait this long (in event time, or in wall time when the source is quiet)
+# to be put back in order, and at most STREAMING_MAX_BUFFERED records wait at once
+STREAMING_WATERMARK_LAG_SECONDS = float(os.getenv("STREAMING_WATERMARK_LAG_SECONDS", "5"))
+STREAMING_MAX_BUFFERED = int(os.getenv("STREAMING_MAX_BUFFERED", "100000"))
+# the records passed by the watermark are processed together at most this often
+STREAMING_RELEASE_INTERVAL_SECONDS = float(os.getenv("STREAMING_RELEASE_INTERVAL_SECONDS", "0.05"))
+# the latency percentiles are computed on at most this many records of every type, and logged this often
+STREAMING_LATENCY_SAMPLES = int(os.getenv("STREAMING_LATENCY_SAMPLES", "10000"))
+STREAMING_LATENCY_LOG_SECONDS = float(os.getenv("STREAMING_LATENCY_LOG_SECONDS", "60"))
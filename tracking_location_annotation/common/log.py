@@ -2,30 +2,93 @@
 Define logger configuration
 """
 import logging
+from typing import AbstractSet, List, Optional
 
-from tracking_location_annotation.common.constants import LOG_LEVEL
+from tracking_location_annotation.common.constants import LOG_FILE, LOG_LEVEL, LOG_SAMPLE_EVERY, LOG_TRACE_MISSION_IDS
 
 # silent urllib3 and google libraries DEBUG logs
 logging.getLogger("urllib3").setLevel(logging.WARNING)
 logging.getLogger("google").setLevel(logging.WARNING)
 
+_configured = False
+
+
+def configure() -> None:
+    "Configures the root logger handlers, only the first time it is called."
+    global _configured  # pylint: disable=global-statement
+    if _configured:
+        return
+    _configured = True
+
+    logging.basicConfig(level=LOG_LEVEL, format="%(name)-12s: %(levelname)-8s %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+    if LOG_FILE:
+        # define a Handler which writes messages to the log file, with a format which is better for file use
+        file = logging.FileHandler(filename=LOG_FILE, mode="w")
+        file.setLevel(LOG_LEVEL)
+        file.setFormatter(logging.Formatter("%(asctime)s %(name)-12s %(levelname)-8s %(message)s"))
+        logging.getLogger().addHandler(file)
+
 
 def get_logger(name: str) -> logging.Logger:
     "Returns a logger with the given name."
+    configure()
+    return logging.getLogger(name)
+
+
+class Tracer:
+    """
+    Gates the debug logs of the hot paths (the process_* functions), when debug is disabled
+    an event costs one attribute lookup:
+
+        traced = tracer.enabled and tracer.sample(mission_id)
+        if traced:
+            logger.debug(...)
+
+    When enabled 1 in every events is traced, or only the events of mission_ids when given.
+    The level is read when the tracer is created and by update_tracers, which the runs call first.
+    """
+
+    __slots__ = ("logger", "enabled", "every", "mission_ids", "events")
+
+    def __init__(self, logger: logging.Logger) -> None:
+        self.logger = logger
+        self.enabled = False
+        self.every = LOG_SAMPLE_EVERY
+        self.mission_ids: AbstractSet[int] = LOG_TRACE_MISSION_IDS
+        self.events = 0
+        self.update()
+
+    def update(self, every: Optional[int] = None, mission_ids: Optional[AbstractSet[int]] = None) -> None:
+        "Reads the level of the logger again, and sets the sampling when given."
+        if every is not None:
+            self.every = every
+        if mission_ids is not None:
+            self.mission_ids = mission_ids
+        self.events = 0
+        self.enabled = self.logger.isEnabledFor(logging.DEBUG)
+
+    def sample(self, mission_id: Optional[int] = None) -> bool:
+        "Returns whether the event of the mission is traced."
+        if self.mission_ids:
+            return mission_id in self.mission_ids
+        self.events += 1
+        if self.events < self.every:
+            return False
+        self.events = 0
+        return True
+
+
+_tracers: List[Tracer] = []
+
+
+def get_tracer(name: str) -> Tracer:
+    "Returns a tracer of the logger with the given name, see Tracer."
+    tracer = Tracer(get_logger(name))
+    _tracers.append(tracer)
+    return tracer
 
-    logging.basicConfig(level=LOG_LEVEL, format="%(name)-12s: %(levelname)-8s %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
 
-    # get logger instance
-    logger = logging.getLogger(name)
-    # define a Handler which writes messages the sys.stderr
-    file = logging.FileHandler(filename="app.log", mode="w")
-    file.setLevel(LOG_LEVEL)
-    # set a format which is better for file use
-    formatter = logging.Formatter(
-        "%(asctime)s %(name)-12s %(levelname)-8s %(message)s",
-    )
-    # tell the handler to use this format
-    file.setFormatter(formatter)
-    # add the handler to the root logger
-    # logger.addHandler(file)
-    return logger
+def update_tracers(every: Optional[int] = None, mission_ids: Optional[AbstractSet[int]] = None) -> None:
+    "Updates every tracer after a change of log level or sampling, see Tracer.update."
+    for tracer in _tracers:
+        tracer.update(every, mission_ids)
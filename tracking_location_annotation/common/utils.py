@@ -2,10 +2,12 @@
 module to define helper functions
 """
 import math
-from typing import Any, Optional
+from typing import Any, Iterator, List, Optional, TypeVar
 
 import pandas as pd
 
+Item = TypeVar("Item")
+
 
 def maybe_int(x: Any) -> Optional[int]:
     """
@@ -29,3 +31,13 @@ def add_if_not_on_top(mylist: list, item: Any) -> None:
         if mylist[-1] == item:
             return
     mylist.append(item)
+
+
+def drain(items: List[Item]) -> Iterator[Item]:
+    """
+    yields the items of a list, removing each one from the list first
+    so the list does not keep the yielded items alive
+    """
+    items.reverse()
+    while items:
+        yield items.pop()
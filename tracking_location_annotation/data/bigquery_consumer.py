@@ -3,28 +3,106 @@ Define BigQuery consumer class to read data
 from BigQuery between two partition dates
 """
 import time
-from typing import Tuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache
+from typing import Iterator, Optional, Tuple
 
 import numpy as np
 import pandas as pd
 from google.cloud import bigquery, bigquery_storage  # type: ignore
 
+from tracking_location_annotation.common.benchmark import measure
 from tracking_location_annotation.common.log import get_logger
 from tracking_location_annotation.data.data_provider import DataProvider
+from tracking_location_annotation.data.query_cache import Fetch, QueryCache
 
 logger = get_logger(__name__)
 
+# number of arrow record batches downloaded ahead of processing when streaming
+STREAM_WINDOW = 16
 
-def _run_query(
-    client: bigquery.Client,
-    bqstorageclient: bigquery_storage.BigQueryReadClient,
-    query: str,  # pylint: disable=too-many-arguments
-    start_date: np.datetime64,
-    end_date: np.datetime64,
-    end_datetime: np.datetime64,
-) -> pd.DataFrame:
-    logger.info("running query: %s", query)
-    job_config = bigquery.QueryJobConfig(
+WAYPOINTS_QUERY = """
+        SELECT
+            id, job_id, courier_id, state,
+            created_at, updated_at, updated_at as timestamp
+        FROM `quiqup.core_2022.ae_job_pickups`
+        WHERE updated_at >= @start_date AND updated_at {end} @end_date
+        """
+
+MISSIONS_QUERY = """
+        SELECT
+            id, courier_id, state,
+            created_at, updated_at, updated_at as timestamp
+            FROM `quiqup.core_2022.ae_missions`
+            WHERE updated_at >= @start_date AND updated_at {end} @end_date
+        """
+
+JOBS_QUERY = """
+        SELECT
+            id, state, created_at,
+            updated_at, mission_id, updated_at as timestamp
+        FROM `quiqup.core_2022.ae_jobs`
+        WHERE updated_at >= @start_date AND updated_at {end} @end_date
+        """
+
+TRACKING_LOCATIONS_QUERY = """
+        SELECT
+            location.user_id,
+            location.recorded_at,
+            location.is_moving,
+            location.uuid,
+            location.timestamp,
+            location.odometer,
+            -- location.battery,
+            location.battery.level as battery_level,
+            -- location.extras,
+            -- location.coords,
+            location.coords.altitude,
+            location.coords.longitude,
+            location.coords.altitude_accuracy as altitude_accuracy,
+            location.coords.latitude,
+            location.coords.speed,
+            location.coords.heading,
+            location.coords.accuracy as coords_accuracy,
+            location.activity.type as activity_type,
+            location.activity.confidence as activity_confidence,
+            -- location.salesforce_user_id
+        FROM `quiqup.core.prod_ae_tracking_locations`
+        WHERE _PARTITIONDATE between @start_date and @end_date
+        AND
+        location.timestamp >= @start_datetime AND location.timestamp {end} @end_datetime
+        ORDER By location.timestamp
+        """
+
+
+def _bounded(query: str, end_inclusive: bool = True) -> str:
+    """
+    returns the query keeping the records at its end date, or not: the incremental
+    runs read them with the next day (see DataProvider.end_inclusive)
+    """
+    return query.format(end="<=" if end_inclusive else "<")
+
+
+@cache
+def _get_client() -> bigquery.Client:
+    """
+    bigquery client shared by all the consumers of the process
+    """
+    return bigquery.Client(project="quiqup")
+
+
+@cache
+def _get_bqstorageclient() -> bigquery_storage.BigQueryReadClient:
+    """
+    storage read api client shared by all the consumers of the process
+    """
+    return bigquery_storage.BigQueryReadClient()
+
+
+def _job_config(
+    start_date: np.datetime64, end_date: np.datetime64, end_datetime: np.datetime64
+) -> bigquery.QueryJobConfig:
+    return bigquery.QueryJobConfig(
         query_parameters=[
             bigquery.ScalarQueryParameter("start_date", "STRING", str(start_date)),
             bigquery.ScalarQueryParameter("end_date", "STRING", str(end_date)),
@@ -34,6 +112,19 @@ def _run_query(
             bigquery.ScalarQueryParameter("end_datetime", "STRING", str(end_datetime)),
         ]
     )
+
+
+def _run_query(
+    client: bigquery.Client,
+    bqstorageclient: bigquery_storage.BigQueryReadClient,
+    query: str,  # pylint: disable=too-many-arguments
+    start_date: np.datetime64,
+    end_date: np.datetime64,
+    end_datetime: np.datetime64,
+    allow_empty: bool = False,
+) -> pd.DataFrame:
+    logger.info("running query: %s", query)
+    job_config = _job_config(start_date, end_date, end_datetime)
     # timer
     timer = time.time()
     dataframe = (
@@ -45,7 +136,7 @@ def _run_query(
         )
     )
 
-    assert len(dataframe) > 0, "dataframe can't be empty"
+    assert allow_empty or len(dataframe) > 0, "dataframe can't be empty"
     logger.info(
         "query finished running in %s seconds, and got %d records of size %d MB",
         round(time.time() - timer, 2),
@@ -55,6 +146,37 @@ def _run_query(
     return dataframe
 
 
+def _stream_query(
+    client: bigquery.Client,
+    bqstorageclient: bigquery_storage.BigQueryReadClient,
+    query: str,  # pylint: disable=too-many-arguments
+    start_date: np.datetime64,
+    end_date: np.datetime64,
+    end_datetime: np.datetime64,
+    max_queue_size: int = STREAM_WINDOW,
+) -> Iterator[pd.DataFrame]:
+    """
+    submits the query right away and returns an iterator over its result,
+    one arrow record batch at a time, the storage read api keeps at most
+    max_queue_size batches downloaded ahead.
+    queries with ORDER BY are read from a single stream so the order is preserved
+    """
+    logger.info("running query: %s", query)
+    job_config = _job_config(start_date, end_date, end_datetime)
+    timer = time.time()
+    query_job = client.query(query, job_config=job_config)
+
+    def record_batches() -> Iterator[pd.DataFrame]:
+        rows = query_job.result()
+        logger.info(
+            "query finished running in %s seconds, streaming %d records", round(time.time() - timer, 2), rows.total_rows
+        )
+        for record_batch in rows.to_arrow_iterable(bqstorage_client=bqstorageclient, max_queue_size=max_queue_size):
+            yield record_batch.to_pandas()
+
+    return record_batches()
+
+
 class BqConsumer(DataProvider):
     """
     Bigquery consumer to query data between two partition dates
@@ -63,131 +185,194 @@ class BqConsumer(DataProvider):
     - quiqup.core.prod_ae_1_missions
     - quiqup.core.prod_ae_1_job_pickups
     - quiqup.core.prod_ae_tracking_locations
+
+    with streaming=True the tracking locations are streamed as arrow record batches
+    instead of being downloaded in full before processing starts,
+    stream_window is the number of batches downloaded ahead of processing
+
+    with a cache the results are stored per day, and only the days missing
+    from the cache are queried, tracking locations are cached by the day of
+    their timestamp so the ones uploaded more than a day late are not seen
     """
 
-    def __init__(self, start_date: np.datetime64, batch_size_in_days: int):
-        self.start_date = start_date
-        self.end_date = start_date + np.timedelta64(batch_size_in_days + 1)
-        self.end_datetime = self.end_date - np.timedelta64(21, "h")
-        self.client = bigquery.Client(project="quiqup")
-        self.bqstorageclient = bigquery_storage.BigQueryReadClient()
+    def __init__(
+        self,
+        start_date: np.datetime64,
+        batch_size_in_days: int,
+        streaming: bool = False,
+        stream_window: int = STREAM_WINDOW,
+        cache: Optional[QueryCache] = None,
+        incremental: bool = False,
+    ):
+        super().__init__(start_date, batch_size_in_days, incremental)
+        self.streaming = streaming
+        self.stream_window = stream_window
+        self.cache = cache
+        self.client = _get_client()
+        self.bqstorageclient = _get_bqstorageclient()
 
     def __str__(self) -> str:
         return f"BQ Consumer - date= {self.start_date}"
 
+    def _fetch_days(self, query: str) -> Fetch:
+        "returns a function querying full days, for the cache"
+
+        def fetch(first_day: np.datetime64, last_day: np.datetime64) -> pd.DataFrame:
+            end_date = last_day + np.timedelta64(1, "D")
+            return _run_query(
+                self.client,
+                self.bqstorageclient,
+                _bounded(query),
+                start_date=first_day,
+                end_date=end_date,
+                end_datetime=end_date.astype("datetime64[h]"),
+                allow_empty=True,
+            )
+
+        return fetch
+
+    def _query(self, table: str, query: str) -> pd.DataFrame:
+        """
+        runs one of the core tables queries, filtered on updated_at between
+        start_date and end_date, through the cache if there is one
+        """
+        if self.cache is None:
+            return _run_query(
+                self.client,
+                self.bqstorageclient,
+                _bounded(query, self.end_inclusive),
+                start_date=self.start_date,
+                end_date=self.end_date,
+                end_datetime=self.end_datetime,
+            )
+
+        dataframe = self.cache.get(
+            table=table,
+            query=_bounded(query),
+            days=list(np.arange(self.start_date, self.end_date)),
+            fetch=self._fetch_days(query),
+            day_column="updated_at",
+        )
+        if self.end_inclusive:
+            # the records at the first instant of end_date, not worth caching the whole day for
+            at_end_date = _run_query(
+                self.client,
+                self.bqstorageclient,
+                _bounded(query),
+                start_date=self.end_date,
+                end_date=self.end_date,
+                end_datetime=self.end_date.astype("datetime64[h]"),
+                allow_empty=True,
+            )
+            dataframe = pd.concat([dataframe, at_end_date], ignore_index=True)
+        assert len(dataframe) > 0, "dataframe can't be empty"
+        return dataframe
+
+    def _tracking_location_days(self) -> Iterator[pd.DataFrame]:
+        "yields the cached tracking locations one day at a time, up to end_datetime"
+        assert self.cache is not None, "the tracking locations are only read by day through the cache"
+        end_datetime = pd.Timestamp(self.end_datetime).tz_localize("UTC")
+        days = self.cache.iter_days(
+            table="prod_ae_tracking_locations",
+            query=_bounded(TRACKING_LOCATIONS_QUERY),
+            days=list(
+                np.arange(
+                    self.start_date,
+                    self.end_datetime.astype("datetime64[D]") + np.timedelta64(int(self.end_inclusive), "D"),
+                )
+            ),
+            fetch=self._fetch_days(TRACKING_LOCATIONS_QUERY),
+            day_column="timestamp",
+            max_days_per_fetch=1 if self.streaming else None,
+        )
+        for dataframe in days:
+            timestamps = pd.to_datetime(dataframe.timestamp, utc=True)
+            yield dataframe[
+                (timestamps <= end_datetime) if self.end_inclusive else (timestamps < end_datetime)
+            ].reset_index(drop=True)
+
+    @measure("bq.get_waypoints")
     def get_waypoints(self) -> pd.DataFrame:
         """
         sql query to get data from quiqup.core.prod_ae_1_job_pickups table
         """
-        query = """
-        SELECT
-            id, job_id, courier_id, state,
-            created_at, updated_at, updated_at as timestamp
-        FROM `quiqup.core_2022.ae_job_pickups`
-        WHERE updated_at between @start_date and @end_date
-        """
-        return _run_query(
-            self.client,
-            self.bqstorageclient,
-            query,
-            start_date=self.start_date,
-            end_date=self.end_date,
-            end_datetime=self.end_datetime,
-        )
+        return self._query("ae_job_pickups", WAYPOINTS_QUERY)
 
+    @measure("bq.get_missions")
     def get_missions(self) -> pd.DataFrame:
         """
         sql query to get data from quiqup.core.prod_ae_1_missions table
         """
-        query = """
-        SELECT
-            id, courier_id, state,
-            created_at, updated_at, updated_at as timestamp
-            FROM `quiqup.core_2022.ae_missions`
-            WHERE updated_at between @start_date and @end_date
-        """
-
-        return _run_query(
-            self.client,
-            self.bqstorageclient,
-            query,
-            start_date=self.start_date,
-            end_date=self.end_date,
-            end_datetime=self.end_datetime,
-        )
+        return self._query("ae_missions", MISSIONS_QUERY)
 
+    @measure("bq.get_jobs")
     def get_jobs(self) -> pd.DataFrame:
         """
         sql query to get data from quiqup.core.prod_ae_1_jobs table
         """
-        query = """
-        SELECT
-            id, state, created_at,
-            updated_at, mission_id, updated_at as timestamp
-        FROM `quiqup.core_2022.ae_jobs`
-        WHERE updated_at between @start_date and @end_date
+        return self._query("ae_jobs", JOBS_QUERY)
+
+    @measure("bq.get_tracking_locations")
+    def get_tracking_locations(self) -> pd.DataFrame:
         """
+        sql query to get data from quiqup.core.prod_ae_tracking_locations table
+        """
+        if self.cache is not None:
+            dataframe = pd.concat(list(self._tracking_location_days()), ignore_index=True)
+            assert len(dataframe) > 0, "dataframe can't be empty"
+            return dataframe
 
         return _run_query(
             self.client,
             self.bqstorageclient,
-            query,
+            _bounded(TRACKING_LOCATIONS_QUERY, self.end_inclusive),
             start_date=self.start_date,
             end_date=self.end_date,
             end_datetime=self.end_datetime,
         )
 
-    def get_tracking_locations(self) -> pd.DataFrame:
+    def stream_tracking_locations(self) -> Iterator[pd.DataFrame]:
         """
-        sql query to get data from quiqup.core.prod_ae_tracking_locations table
-        """
-        query = """
-        SELECT
-            location.user_id,
-            location.recorded_at,
-            location.is_moving,
-            location.uuid,
-            location.timestamp,
-            location.odometer,
-            -- location.battery,
-            location.battery.level as battery_level,
-            -- location.extras,
-            -- location.coords,
-            location.coords.altitude,
-            location.coords.longitude,
-            location.coords.altitude_accuracy as altitude_accuracy,
-            location.coords.latitude,
-            location.coords.speed,
-            location.coords.heading,
-            location.coords.accuracy as coords_accuracy,
-            location.activity.type as activity_type,
-            location.activity.confidence as activity_confidence,
-            -- location.salesforce_user_id
-        FROM `quiqup.core.prod_ae_tracking_locations`
-        WHERE _PARTITIONDATE between @start_date and @end_date
-        AND
-        location.timestamp between @start_datetime and @end_datetime
-        ORDER By location.timestamp
+        same query as get_tracking_locations, yielding one record batch at a time,
+        or one day at a time when reading through the cache
         """
+        if self.cache is not None:
+            return self._tracking_location_days()
 
-        return _run_query(
+        return _stream_query(
             self.client,
             self.bqstorageclient,
-            query,
+            _bounded(TRACKING_LOCATIONS_QUERY, self.end_inclusive),
             start_date=self.start_date,
             end_date=self.end_date,
             end_datetime=self.end_datetime,
+            max_queue_size=self.stream_window,
         )
 
     def fetch_data(self) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
-        """function that combines the BQ calls
+        """function that runs the BQ calls concurrently
         to return a tuple of dataframes"""
         logger.info("getting data from BQ")
 
-        df_missions = self.get_missions()
-        df_jobs = self.get_jobs()
-        df_waypoints = self.get_waypoints()
-        df_tl = self.get_tracking_locations()
-        # df_tl = pd.DataFrame(columns=['recorded_at','timestamp'])
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            missions = executor.submit(self.get_missions)
+            jobs = executor.submit(self.get_jobs)
+            waypoints = executor.submit(self.get_waypoints)
+            tls = executor.submit(self.get_tracking_locations)
+
+            return missions.result(), waypoints.result(), jobs.result(), tls.result()
+
+    def stream_data(self) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, Iterator[pd.DataFrame]]:
+        """same as fetch_data, streaming the tracking locations in streaming mode"""
+        if not self.streaming:
+            return super().stream_data()
+        logger.info("getting data from BQ, streaming tracking locations")
+
+        # the tracking locations query runs while the other tables are downloaded
+        tl_chunks = self.stream_tracking_locations()
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            missions = executor.submit(self.get_missions)
+            jobs = executor.submit(self.get_jobs)
+            waypoints = executor.submit(self.get_waypoints)
 
-        return df_missions, df_waypoints, df_jobs, df_tl
+            return missions.result(), waypoints.result(), jobs.result(), tl_chunks
@@ -1,29 +1,65 @@
 """
 module to define CSVConsumer class
 """
+from contextlib import closing
 from typing import Tuple
 
 import numpy as np
 import pandas as pd
 
+from tracking_location_annotation.common.benchmark import measure
 from tracking_location_annotation.data.data_provider import DataProvider
 
+# rows parsed at a time, only the rows inside the dates are kept
+CHUNK_ROWS = 100_000
+DTYPES = {
+    "state": str,
+    "uuid": str,
+    "activity_type": str,
+    "odometer": np.float64,
+    "battery_level": np.float64,
+    "altitude": np.float64,
+    "longitude": np.float64,
+    "altitude_accuracy": np.float64,
+    "latitude": np.float64,
+    "speed": np.float64,
+    "heading": np.float64,
+    "coords_accuracy": np.float64,
+}
+
 
 class CSVConsumer(DataProvider):
     """
-    data prodivder from csv files
+    data prodivder from csv files, read in chunks keeping
+    the rows with a timestamp between start_date and end_date
     """
 
-    def __init__(self, start_date: np.datetime64, batch_size_in_days: int, data_path: str) -> None:
-        self.start_date = start_date
-        self.end_date = start_date + np.timedelta64(batch_size_in_days + 1)
-        self.end_datetime = self.end_date - np.timedelta64(21, "h")
+    def __init__(
+        self, start_date: np.datetime64, batch_size_in_days: int, data_path: str, incremental: bool = False
+    ) -> None:
+        super().__init__(start_date, batch_size_in_days, incremental)
         self.data_path = data_path
 
+    def read_csv(self, filename: str) -> pd.DataFrame:
+        """
+        reads the csv file chunk by chunk, parsing the timestamps to utc
+        and dropping the rows outside the dates before concatenating the chunks
+        """
+        start = pd.Timestamp(self.start_date).tz_localize("UTC")
+        end = pd.Timestamp(self.end_date).tz_localize("UTC")
+        inclusive = "both" if self.end_inclusive else "left"
+        chunks = []
+        with closing(pd.read_csv(self.data_path + filename, dtype=DTYPES, chunksize=CHUNK_ROWS)) as reader:
+            for chunk in reader:
+                chunk["timestamp"] = pd.to_datetime(chunk["timestamp"], utc=True)
+                chunks.append(chunk[chunk["timestamp"].between(start, end, inclusive=inclusive)])
+        return pd.concat(chunks, ignore_index=True)
+
+    @measure("csv.fetch_data")
     def fetch_data(self) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
-        df_missions = pd.read_csv(self.data_path + "/missions_data.csv")
-        df_waypoints = pd.read_csv(self.data_path + "/waypoints_data.csv")
-        df_jobs = pd.read_csv(self.data_path + "/jobs_data.csv")
-        df_tl = pd.read_csv(self.data_path + "/tl_data.csv")
+        df_missions = self.read_csv("/missions_data.csv")
+        df_waypoints = self.read_csv("/waypoints_data.csv")
+        df_jobs = self.read_csv("/jobs_data.csv")
+        df_tl = self.read_csv("/tl_data.csv")
 
         return df_missions, df_waypoints, df_jobs, df_tl
@@ -3,11 +3,13 @@ abstract class created to be inherited from
 defined data providers
 """
 from abc import ABC, abstractmethod
-from typing import Tuple
+from typing import Iterator, Tuple
 
 import numpy as np
 import pandas as pd
 
+from tracking_location_annotation.common.utils import drain
+
 
 class DataProvider(ABC):
     """
@@ -15,10 +17,20 @@ class DataProvider(ABC):
     to read data from providers into the app
     """
 
-    def __init__(self, start_date: np.datetime64, batch_size_in_days: int) -> None:
+    def __init__(self, start_date: np.datetime64, batch_size_in_days: int, incremental: bool = False) -> None:
         self.start_date = start_date
-        self.end_date = start_date + np.timedelta64(batch_size_in_days + 1)
-        self.end_datetime = self.end_date - np.timedelta64(21, "h")
+        self.incremental = incremental
+        # the records at end_date are read by the next day of an incremental run, not by this one
+        self.end_inclusive = not incremental
+        if incremental:
+            # the state of the previous days is carried over (see app.run_incremental),
+            # so only the days of the batch are read
+            self.end_date = start_date + np.timedelta64(batch_size_in_days)
+            self.end_datetime = self.end_date.astype("datetime64[h]")
+        else:
+            # an extra day to see the end of the missions started on the last day
+            self.end_date = start_date + np.timedelta64(batch_size_in_days + 1)
+            self.end_datetime = self.end_date - np.timedelta64(21, "h")
 
     @abstractmethod
     def fetch_data(self) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:  # pragma: no cover
@@ -26,3 +38,12 @@ class DataProvider(ABC):
         to fetch the data given a start time
         and a data source
         """
+
+    def stream_data(self) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, Iterator[pd.DataFrame]]:
+        """
+        same as fetch_data but the tracking locations come as an iterator of
+        dataframes ordered by timestamp, providers able to stream them override it
+        """
+        df_missions, df_waypoints, df_jobs, df_tl = self.fetch_data()
+        # drained so the raw frame is freed once it is cleaned
+        return df_missions, df_waypoints, df_jobs, drain([df_tl])
@@ -2,169 +2,741 @@
 Module to read data from BQ or CSV File based on env
 clean data and parse it into multiple bartches for processing
 """
-from datetime import datetime, timedelta
-from typing import Callable, List, Optional, Tuple
+import queue
+import threading
+from collections import deque
+from contextlib import closing
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Generator,
+    Iterable,
+    Iterator,
+    List,
+    Literal,
+    NamedTuple,
+    Optional,
+    Protocol,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
+import numpy as np
 import pandas as pd
 
+from tracking_location_annotation.common import benchmark
 from tracking_location_annotation.common.benchmark import measure
+from tracking_location_annotation.common.constants import BULK_TLS, PREFETCH_STEPS, STEP_MAX_EVENTS
 from tracking_location_annotation.common.log import get_logger
 from tracking_location_annotation.data.data_provider import DataProvider
-from tracking_location_annotation.db import JOBS, MISSIONS, courier_id_to_mission_id
+from tracking_location_annotation.db import StateStore, get_store
 
 logger = get_logger(__name__)
 
+# consumed rows a cursor keeps before compacting its dataframe
+RELEASE_ROWS = 1_000_000
+# records are processed one step at a time, old missions and jobs are evicted between steps
+STEP = pd.Timedelta(hours=24).value
+# missions and jobs not updated for this long before the step are evicted
+EVICTION_DELAY = pd.Timedelta(hours=3).value
+
+DATETIME_COLUMNS = {"timestamp", "created_at", "updated_at", "recorded_at"}
+CATEGORICAL_COLUMNS = {"state", "activity_type"}
+# missing foreign keys become 0, the models treat 0 as no reference
+ID_COLUMNS = {"id", "courier_id", "job_id", "mission_id"}
+FLOAT32_COLUMNS = {"odometer", "battery_level", "altitude", "altitude_accuracy", "speed", "heading", "coords_accuracy"}
+
+Item = TypeVar("Item")
+
+
+def to_nanoseconds(series: pd.Series) -> np.ndarray:
+    """
+    parses a column of datetimes (or datetime strings) once into int64 utc nanoseconds,
+    missing values become the int64 minimum (NaT)
+    """
+    return pd.to_datetime(series, utc=True).to_numpy(dtype="datetime64[ns]").view(np.int64)
+
+
+def to_nanoseconds_scalar(date: np.datetime64) -> int:
+    "returns the date as int64 nanoseconds"
+    return int(np.datetime64(date, "ns").astype(np.int64))
+
+
+def validate_ids(dataframe: pd.DataFrame) -> pd.DataFrame:
+    """
+    drops the records without an id (null or 0) and converts the ids
+    and foreign keys to int64, missing foreign keys become 0
+    """
+    if "id" in dataframe:
+        dataframe = dataframe[dataframe["id"].fillna(0).to_numpy() != 0]
+    return dataframe.assign(
+        **{column: dataframe[column].fillna(0).astype(np.int64) for column in ID_COLUMNS if column in dataframe}
+    )
+
+
+def normalize(
+    dataframe: pd.DataFrame,
+    record_type: str,
+    start_date: np.datetime64,
+    end_date: np.datetime64,
+    end_inclusive: bool = True,
+) -> pd.DataFrame:
+    """
+    keeps the records with a timestamp between start_date and end_date (excluded unless end_inclusive)
+    and a valid id,
+    and converts the columns to compact types: datetimes to int64 nanoseconds, ids to int64,
+    states to categoricals and sensor fields to float32, record_type is a categorical column
+    """
+    benchmark.frame_memory(f"memory.{record_type}.before", dataframe)
+    timestamps = to_nanoseconds(dataframe["timestamp"])
+    end = to_nanoseconds_scalar(end_date)
+    in_window = (timestamps >= to_nanoseconds_scalar(start_date)) & (
+        (timestamps <= end) if end_inclusive else (timestamps < end)
+    )
+    dataframe = dataframe.loc[in_window, [column for column in dataframe if not column.startswith("Unnamed")]]
+    dataframe = validate_ids(dataframe.assign(timestamp=timestamps[in_window]))
+
+    columns = {}
+    for column in dataframe:
+        if column in DATETIME_COLUMNS and column != "timestamp":
+            columns[column] = to_nanoseconds(dataframe[column])
+        elif column in CATEGORICAL_COLUMNS:
+            columns[column] = dataframe[column].astype("category")
+        elif column == "user_id":
+            columns[column] = dataframe[column].astype("Int64")
+        elif column in FLOAT32_COLUMNS:
+            columns[column] = dataframe[column].astype(np.float32)
+    columns["record_type"] = pd.Categorical.from_codes(np.zeros(len(dataframe), dtype=np.int8), [record_type])
+    dataframe = dataframe.assign(**columns)
+
+    benchmark.frame_memory(f"memory.{record_type}.after", dataframe)
+    return dataframe
+
+
+@measure("data.clean_tracking_locations")
+def clean_tracking_locations(
+    df_tl: pd.DataFrame, start_date: np.datetime64, end_date: np.datetime64, end_inclusive: bool = True
+) -> pd.DataFrame:
+    """
+    clean a tracking locations dataframe (or a chunk of it) the same way clean_data
+    cleans the other tables, and sort it by timestamp
+    """
+    return sort_by_timestamp(normalize(df_tl, "tl", start_date, end_date, end_inclusive))
+
 
 @measure("data.clean_data")
-def clean_data(data_provider: DataProvider) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+def clean_data(data_provider: DataProvider) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, Iterator[pd.DataFrame]]:
     """
-    clean data by removing unwanted columns, rows
-    and by setting time related columns type to np.datetime64
+    clean data by removing unwanted columns, rows and by converting the columns
+    to compact types (datetimes are int64 nanoseconds from here on),
+    tracking locations are cleaned lazily chunk by chunk as they are streamed
     """
 
-    df_missions, df_waypoints, df_jobs, df_tl = data_provider.fetch_data()
+    df_missions, df_waypoints, df_jobs, tl_chunks = data_provider.stream_data()
     start_date = data_provider.start_date
     end_date = data_provider.end_date
-    # changing datetime types
 
-    # for missions
-    df_missions["timestamp"] = pd.to_datetime(df_missions["timestamp"]).dt.tz_localize(None)
-    df_missions["created_at"] = pd.to_datetime(df_missions["created_at"]).dt.tz_localize(None)
-    df_missions["updated_at"] = pd.to_datetime(df_missions["updated_at"]).dt.tz_localize(None)
+    end_inclusive = data_provider.end_inclusive
+    df_missions = normalize(df_missions, "mission", start_date, end_date, end_inclusive)
+    df_waypoints = normalize(df_waypoints, "waypoint", start_date, end_date, end_inclusive)
+    df_jobs = normalize(df_jobs, "job", start_date, end_date, end_inclusive)
+
+    tls = clean_tracking_location_chunks(tl_chunks, start_date, end_date, end_inclusive)
+    return sort_by_timestamp(df_missions), sort_by_timestamp(df_waypoints), sort_by_timestamp(df_jobs), tls
+
+
+def clean_tracking_location_chunks(
+    tl_chunks: Iterator[pd.DataFrame], start_date: np.datetime64, end_date: np.datetime64, end_inclusive: bool
+) -> Iterator[pd.DataFrame]:
+    """
+    cleans the chunks one by one, the raw chunk is not referenced
+    anymore while its cleaned version is being consumed
+    """
+    for df_tl in tl_chunks:
+        df_tl = clean_tracking_locations(df_tl, start_date, end_date, end_inclusive)
+        yield df_tl
+
 
-    # for waypoints
-    df_waypoints["timestamp"] = pd.to_datetime(df_waypoints["timestamp"]).dt.tz_localize(None)
-    df_waypoints["created_at"] = pd.to_datetime(df_waypoints["created_at"]).dt.tz_localize(None)
-    df_waypoints["updated_at"] = pd.to_datetime(df_waypoints["updated_at"]).dt.tz_localize(None)
+def sort_by_timestamp(dataframe: pd.DataFrame) -> pd.DataFrame:
+    """
+    sort dataframe by timestamp once, records with the same timestamp
+    keep their original order and records without timestamp are dropped
+    """
+    dataframe = dataframe[dataframe.timestamp.notna()]  # normalized frames have no missing timestamp left
+    return dataframe.sort_values("timestamp", kind="mergesort", ignore_index=True)  # stable
+
+
+def merge_order(*dataframes: pd.DataFrame) -> np.ndarray:
+    """
+    returns the index of the dataframe of every record in the k-way merge of dataframes
+    already sorted by timestamp, records with the same timestamp come in the order
+    the dataframes were passed (a stable sort of presorted runs is a merge)
+    """
+    timestamps = np.concatenate([df.timestamp.to_numpy(dtype=np.int64) for df in dataframes])
+    sources = np.repeat(np.arange(len(dataframes), dtype=np.int8), [len(df) for df in dataframes])
+    return sources[np.argsort(timestamps, kind="stable")]
+
+
+def merge_sorted(*dataframes: pd.DataFrame) -> Iterator[Any]:
+    """
+    k-way merge of dataframes already sorted by timestamp, see merge_order,
+    records are pulled lazily from each dataframe
+    """
+    order = merge_order(*dataframes)
+    records: List[Iterator[Any]] = [iter(df.itertuples(index=False)) for df in dataframes]
+    return map(next, map(records.__getitem__, order.tolist()))
+
+
+class FrameCursor:
+    """
+    walks forward over a dataframe sorted by timestamp,
+    consumed rows are released in large chunks instead of on every step
+    """
 
-    # for jobs
-    df_jobs["timestamp"] = pd.to_datetime(df_jobs["timestamp"]).dt.tz_localize(None)
-    df_jobs["created_at"] = pd.to_datetime(df_jobs["created_at"]).dt.tz_localize(None)
-    df_jobs["updated_at"] = pd.to_datetime(df_jobs["updated_at"]).dt.tz_localize(None)
+    def __init__(self, dataframe: pd.DataFrame, release_rows: int = RELEASE_ROWS) -> None:
+        self.dataframe = dataframe
+        self.position = 0
+        self.release_rows = release_rows
 
-    # for tracking location
-    df_tl["recorded_at"] = pd.to_datetime(df_tl["recorded_at"]).dt.tz_localize(None)
-    df_tl["timestamp"] = pd.to_datetime(df_tl["timestamp"]).dt.tz_localize(None)
+    def __len__(self) -> int:
+        return len(self.dataframe) - self.position
 
-    # filtering out unwanted data
+    def peek(self) -> Optional[int]:
+        "returns the timestamp of the next row or None if all the rows were taken"
+        if not len(self):
+            return None
+        return self.dataframe.timestamp.iloc[self.position]
 
-    # for missions
-    df_missions = df_missions[df_missions["timestamp"].between(start_date, end_date)]
-    df_missions = df_missions.drop(df_missions.filter(regex="Unname"), axis=1)
+    def timestamps_until(self, timestamp: int) -> np.ndarray:
+        "returns the timestamps of the rows take_until would take, without taking them"
+        end = max(self.position, int(self.dataframe.timestamp.searchsorted(timestamp)))
+        return self.dataframe.timestamp.to_numpy()[self.position : end]
 
-    # for waypoints
-    df_waypoints = df_waypoints[df_waypoints["timestamp"].between(start_date, end_date)]
-    df_waypoints = df_waypoints.drop(df_waypoints.filter(regex="Unname"), axis=1)
+    def take_until(self, timestamp: int) -> pd.DataFrame:
+        "returns the rows before the given timestamp that were not taken yet"
+        end = max(self.position, int(self.dataframe.timestamp.searchsorted(timestamp)))
+        rows = self.dataframe.iloc[self.position : end]
+        self.position = end
+        return rows
 
-    # for jobs
-    df_jobs = df_jobs[df_jobs["timestamp"].between(start_date, end_date)]
-    df_jobs = df_jobs.drop(df_jobs.filter(regex="Unname"), axis=1)
+    def release(self) -> None:
+        """
+        drop the consumed rows once there are at least release_rows of them and
+        they outnumber the remaining rows, so the total copying stays linear in the frame size
+        """
+        if self.position >= max(self.release_rows, len(self)):
+            logger.debug("releasing %d consumed rows, %d rows left", self.position, len(self))
+            self.dataframe = self.dataframe.iloc[self.position :].copy()
+            self.position = 0
 
-    # for tracking location
-    df_tl = df_tl[df_tl["timestamp"].between(start_date, end_date)]
-    df_tl = df_tl.drop(df_tl.filter(regex="Unname"), axis=1)
 
-    # adding type column
-    df_missions = df_missions.assign(record_type="mission")
-    df_waypoints = df_waypoints.assign(record_type="waypoint")
-    df_jobs = df_jobs.assign(record_type="job")
-    df_tl = df_tl.assign(record_type="tl")
+class StreamCursor:
+    """
+    cursor over a stream of dataframe chunks arriving in timestamp order,
+    chunks are only read as far as the step being taken so memory is bounded
+    by one step and the chunks the provider buffers ahead, not by the whole batch
+    """
 
-    return df_missions, df_waypoints, df_jobs, df_tl
+    def __init__(self, chunks: Iterable[pd.DataFrame], release_rows: int = RELEASE_ROWS) -> None:
+        self.chunks = iter(chunks)
+        self.cursors: Deque[FrameCursor] = deque()
+        self.release_rows = release_rows
+        self.last_timestamp: Optional[int] = None
 
+    def _read_chunk(self) -> bool:
+        "appends the next non empty chunk, returns False once the stream is exhausted"
+        for chunk in self.chunks:
+            if chunk.empty:
+                continue
+            if self.last_timestamp is not None and chunk.timestamp.iloc[0] < self.last_timestamp:
+                raise ValueError("tracking locations stream is not ordered by timestamp")
+            self.last_timestamp = chunk.timestamp.iloc[-1]
+            # large chunks are split so the consumed pieces can be freed, see release
+            if len(chunk) > self.release_rows:
+                pieces = [
+                    chunk.iloc[start : start + self.release_rows].copy()
+                    for start in range(0, len(chunk), self.release_rows)
+                ]
+            else:
+                pieces = [chunk]
+            self.cursors.extend(FrameCursor(piece, self.release_rows) for piece in pieces)
+            return True
+        return False
+
+    def peek(self) -> Optional[int]:
+        "returns the timestamp of the next row or None if the stream is exhausted"
+        while self.cursors and not len(self.cursors[0]):
+            self.cursors.popleft()
+        if not self.cursors and not self._read_chunk():
+            return None
+        return self.cursors[0].peek()
+
+    def _read_until(self, timestamp: int) -> None:
+        "reads chunks until one goes past the given timestamp or the stream is exhausted"
+        while (self.last_timestamp is None or self.last_timestamp < timestamp) and self._read_chunk():
+            pass
+
+    def timestamps_until(self, timestamp: int) -> np.ndarray:
+        "returns the timestamps of the rows take_slices_until would take, without taking them"
+        self._read_until(timestamp)
+        return np.concatenate(
+            [np.zeros(0, dtype=np.int64)] + [cursor.timestamps_until(timestamp) for cursor in self.cursors]
+        )
+
+    def take_slices_until(self, timestamp: int) -> List[Tuple[pd.DataFrame, int, int]]:
+        """
+        returns the (chunk, start, stop) row ranges before the given timestamp,
+        reading chunks until one goes past it
+        """
+        self._read_until(timestamp)
+        slices = []
+        for cursor in self.cursors:
+            start = cursor.position
+            cursor.take_until(timestamp)
+            if cursor.position > start:
+                slices.append((cursor.dataframe, start, cursor.position))
+        while self.cursors and not len(self.cursors[0]):
+            self.cursors.popleft()
+        return slices
+
+    def take_until(self, timestamp: int) -> pd.DataFrame:
+        "returns the rows before the given timestamp, reading chunks until one goes past it"
+        rows = [chunk.iloc[start:stop] for chunk, start, stop in self.take_slices_until(timestamp)]
+        if len(rows) == 1:
+            return rows[0]
+        if not rows:
+            return pd.DataFrame(columns=["timestamp"])
+        return pd.concat(rows, ignore_index=True)
+
+    def release(self) -> None:
+        """
+        the chunks are never compacted, the tracking locations buckets keep row positions
+        into them, a chunk is dropped once all its rows are taken and no bucket refers to it
+        """
+
+
+class Record(Protocol):
+    "a mission, waypoint or job yielded by get_data, a row of its cleaned dataframe (see normalize)"
+
+    @property
+    def record_type(self) -> Literal["mission", "waypoint", "job"]:
+        ...
+
+    def __iter__(self) -> Iterator[Any]:
+        ...
+
+
+class TLEvent(NamedTuple):
+    """
+    a tracking location yielded by get_data without bulk_tls,
+    a row of tl_events pointing to its row in a cleaned chunk
+    """
 
-def filter_df(dataframe, *, start: datetime, end: datetime) -> pd.DataFrame:
-    "filter dataframe to get data between two timestamps only"
-    return dataframe[dataframe.timestamp.between(start, end, inclusive="left")]
+    user_id: int  # pd.NA when missing
+    timestamp: int
+    record_type: Literal["tl"]
+    chunk: pd.DataFrame
+    row: int
+
+
+class TLStep(NamedTuple):
+    """
+    the tracking locations of a step, yielded before its other records when they are assigned in bulk
+    (see tl_assignment). the tracking locations are rows of chunks, with their courier and their
+    position: the number of missions, jobs and waypoints before them in the step.
+    the missions of the step come with their positions among these records
+    """
+
+    missions: pd.DataFrame
+    mission_positions: np.ndarray
+    chunks: List[pd.DataFrame]
+    chunk_indexes: np.ndarray
+    rows: np.ndarray
+    couriers: np.ndarray
+    positions: np.ndarray
+    record_type: Literal["tls"] = "tls"
+
+
+# the records yielded by get_data, process_entry dispatches them on their record_type
+Entry = Union[Record, TLEvent, TLStep]
+
+
+def tl_events(slices: List[Tuple[pd.DataFrame, int, int]]) -> pd.DataFrame:
+    """
+    tracking location events for the given (chunk, start, stop) row ranges, an event only
+    carries what process_tl needs: the user_id and the chunk with the row position in it
+    """
+    events = []
+    for chunk, start, stop in slices:
+        chunks = np.empty(stop - start, dtype=object)
+        chunks.fill(chunk)
+        events.append(
+            pd.DataFrame(
+                {
+                    "user_id": chunk["user_id"].array[start:stop],
+                    "timestamp": chunk["timestamp"].to_numpy()[start:stop],
+                    "record_type": "tl",
+                    "chunk": chunks,
+                    "row": np.arange(start, stop),
+                }
+            )
+        )
+    if len(events) == 1:
+        return events[0]
+    if not events:
+        return pd.DataFrame(columns=TLEvent._fields)
+    return pd.concat(events, ignore_index=True)
 
 
 @measure("data.get_step_data")
 def get_step_data(
     *,
-    prev_step: datetime,
-    step: datetime,
-    df_missions: pd.DataFrame,
-    df_waypoints: pd.DataFrame,
-    df_jobs: pd.DataFrame,
-    df_tl: pd.DataFrame,
-) -> List:
-    """use filter_df to get data between two timestamps from
-    all dataframes, transform it to tuples and sort it by timestamp
+    prev_step: int,
+    step: int,
+    missions: FrameCursor,
+    waypoints: FrameCursor,
+    jobs: FrameCursor,
+    tls: StreamCursor,
+) -> Iterator[Entry]:
+    """take the records before the step from all the cursors
+    and merge them into one stream ordered by timestamp
     """
-    logger.info("getting data between %s and %s", prev_step.strftime("%m/%d/%Y %H"), step.strftime("%m/%d/%Y %H"))
-    # get data within step
-    df_missions = filter_df(df_missions, start=prev_step, end=step)
-    df_waypoints = filter_df(df_waypoints, start=prev_step, end=step)
-    df_jobs = filter_df(df_jobs, start=prev_step, end=step)
-    df_tl = filter_df(df_tl, start=prev_step, end=step)
+    logger.info(
+        "getting data between %s and %s",
+        pd.Timestamp(prev_step).strftime("%m/%d/%Y %H"),
+        pd.Timestamp(step).strftime("%m/%d/%Y %H"),
+    )
+    # missions first, then waypoints, jobs and tls for records with the same timestamp
+    return merge_sorted(
+        missions.take_until(step),
+        waypoints.take_until(step),
+        jobs.take_until(step),
+        tl_events(tls.take_slices_until(step)),
+    )
 
-    # iterating over data
-    missions = list(df_missions.itertuples(index=False))
-    waypoints = list(df_waypoints.itertuples(index=False))
-    jobs = list(df_jobs.itertuples(index=False))
-    tracking_location = list(df_tl.itertuples(index=False))
 
-    # sorting by timestamp
-    return sorted(
-        [*missions, *waypoints, *jobs, *tracking_location], key=lambda element: element.timestamp
-    )  # type: ignore
+@measure("data.get_bulk_step_data")
+def get_bulk_step_data(
+    *,
+    prev_step: int,
+    step: int,
+    missions: FrameCursor,
+    waypoints: FrameCursor,
+    jobs: FrameCursor,
+    tls: StreamCursor,
+) -> Tuple[TLStep, Iterator[Record]]:
+    """same as get_step_data but the tracking locations are returned
+    together as a TLStep instead of being merged with the other records
+    """
+    logger.info(
+        "getting data between %s and %s",
+        pd.Timestamp(prev_step).strftime("%m/%d/%Y %H"),
+        pd.Timestamp(step).strftime("%m/%d/%Y %H"),
+    )
+    step_missions, step_waypoints, step_jobs = (
+        missions.take_until(step),
+        waypoints.take_until(step),
+        jobs.take_until(step),
+    )
+    order = merge_order(step_missions, step_waypoints, step_jobs)
+    records: List[Iterator[Any]] = [
+        iter(df.itertuples(index=False)) for df in (step_missions, step_waypoints, step_jobs)
+    ]
 
+    slices = tls.take_slices_until(step)
+    chunks = [chunk for chunk, _, _ in slices]
+    timestamps = np.concatenate(
+        [np.zeros(0, dtype=np.int64)] + [chunk["timestamp"].to_numpy()[start:stop] for chunk, start, stop in slices]
+    )
+    # tracking locations come after the other records with the same timestamp
+    record_timestamps = np.sort(
+        np.concatenate([df.timestamp.to_numpy(dtype=np.int64) for df in (step_missions, step_waypoints, step_jobs)])
+    )
+    tl_step = TLStep(
+        missions=step_missions,
+        mission_positions=np.flatnonzero(order == 0),
+        chunks=chunks,
+        chunk_indexes=np.repeat(np.arange(len(slices)), [stop - start for _, start, stop in slices]),
+        rows=np.concatenate([np.zeros(0, dtype=np.int64)] + [np.arange(start, stop) for _, start, stop in slices]),
+        couriers=np.concatenate(
+            [np.zeros(0, dtype=np.int64)]
+            + [chunk["user_id"].iloc[start:stop].to_numpy(dtype=np.int64, na_value=0) for chunk, start, stop in slices]
+        ),
+        positions=record_timestamps.searchsorted(timestamps, side="right"),
+    )
+    return tl_step, map(next, map(records.__getitem__, order.tolist()))
 
-def get_data(data_provider: DataProvider, on_batch_end: Optional[Callable] = None):
+
+def evict_step(store: StateStore, prev_step: int) -> None:
+    "evicts the old records from the store at the start of the step starting at prev_step"
+    # clear jobs and missions from db
+    evicted_missions, evicted_jobs = store.evict(prev_step - EVICTION_DELAY)
+    benchmark.count("db.evicted_missions", evicted_missions)
+    benchmark.count("db.evicted_jobs", evicted_jobs)
+    # orphans are kept for their ttl after the records they arrived with
+    store.unmapped_waypoints.evict(prev_step)
+    store.unmapped_jobs.evict(prev_step)
+    for name, size in store.sizes().items():
+        benchmark.gauge(f"db.{name}", size)
+
+
+class PreparedStep(NamedTuple):
     """
-    read data from csv and pass it to cleaning function
+    the records of a part of a step ready to be processed, tl_step is None
+    unless the tracking locations are assigned in bulk. the store is evicted
+    before the first part of the step and on_batch_end is called after the last one
     """
-    df_missions, df_waypoints, df_jobs, df_tl = clean_data(data_provider)
 
-    # get minimum timestamp in all the dataframes
-    min_ts = min(
-        df_missions.timestamp.min(), df_waypoints.timestamp.min(), df_jobs.timestamp.min(), df_tl.timestamp.min()
+    prev_step: int
+    step: int
+    tl_step: Optional[TLStep]
+    entries: Iterable[Entry]
+    first: bool = True
+    last: bool = True
+
+
+def step_parts(
+    prev_step: int, step: int, cursors: List[Union[FrameCursor, StreamCursor]], max_events: int
+) -> List[int]:
+    """
+    returns the bounds of the parts of the step with at most max_events records each (0 for no limit),
+    from the timestamps of the cursors. records with the same timestamp are never split, so a part
+    may be larger when more than max_events records share a timestamp
+    """
+    if not max_events:
+        return [prev_step, step]
+    timestamps = [cursor.timestamps_until(step) for cursor in cursors]
+    total = sum(map(len, timestamps))
+    if total <= max_events:
+        return [prev_step, step]
+    merged = np.sort(np.concatenate(timestamps))
+    bounds, start = [prev_step], 0
+    while total - start > max_events:
+        cut = merged[start + max_events]
+        end = int(merged.searchsorted(cut, side="left"))
+        if end == start:
+            end = int(merged.searchsorted(cut, side="right"))
+            if end == total:
+                break
+            cut = merged[end]
+        bounds.append(int(cut))
+        start = end
+    bounds.append(step)
+    sizes = np.diff([0, *merged.searchsorted(bounds[1:-1]).tolist(), total]).tolist()
+    for size in sizes:
+        benchmark.gauge("data.step_records", size)
+    logger.info(
+        "%d records between %s and %s split into %d parts of %s records",
+        total,
+        pd.Timestamp(prev_step).strftime("%m/%d/%Y %H"),
+        pd.Timestamp(step).strftime("%m/%d/%Y %H"),
+        len(sizes),
+        sizes,
     )
-    # get maximum timestamp in all the dataframes
-    max_ts = max(
-        df_missions.timestamp.max(), df_waypoints.timestamp.max(), df_jobs.timestamp.min(), df_tl.timestamp.max()
+    return bounds
+
+
+def prepare_steps(
+    *,
+    missions: FrameCursor,
+    waypoints: FrameCursor,
+    jobs: FrameCursor,
+    tls: StreamCursor,
+    step: int,
+    bulk_tls: bool,
+    materialize: bool = False,
+    max_events: int = 0,
+) -> Generator[PreparedStep, None, None]:
+    """
+    takes the records of one step after the other from the cursors until every record was taken,
+    in parts of at most max_events records (see step_parts), with materialize the records are
+    converted to tuples right away instead of lazily, so the work is done by whoever runs this generator
+    """
+    cursors: List[Union[FrameCursor, StreamCursor]] = [missions, waypoints, jobs, tls]
+    while any(cursor.peek() is not None for cursor in cursors):
+        prev_step, step = step, step + STEP
+        bounds = step_parts(prev_step, step, cursors, max_events)
+        for part, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:])):
+            tl_step: Optional[TLStep] = None
+            entries: Iterable[Entry]
+            if bulk_tls:
+                tl_step, entries = get_bulk_step_data(
+                    prev_step=start, step=stop, missions=missions, waypoints=waypoints, jobs=jobs, tls=tls
+                )
+            else:
+                entries = get_step_data(
+                    prev_step=start, step=stop, missions=missions, waypoints=waypoints, jobs=jobs, tls=tls
+                )
+            if materialize:
+                with measure("data.materialize_step"):
+                    entries = list(entries)
+            yield PreparedStep(prev_step, step, tl_step, entries, first=part == 0, last=part == len(bounds) - 2)
+
+            # release consumed rows once the part is handed over, the taken rows are views or copies
+            for cursor in cursors:
+                cursor.release()
+
+
+def prefetch(items: Iterator[Item], depth: int, name: str = "prefetch") -> Generator[Item, None, None]:
+    """
+    runs the iterator on a background thread keeping at most depth items ready in a bounded
+    queue, the thread waits when the queue is full (backpressure). the time the consumer waits
+    for an item is measured as {name}.stall, the time the thread waits for room as {name}.backpressure
+    and the items ready when one is taken are gauged as {name}.queue_depth.
+    errors of the iterator are raised in the consumer, closing the generator stops the thread
+    """
+    ready: "queue.Queue" = queue.Queue(maxsize=depth)
+    stopped = threading.Event()
+    done = object()
+
+    def put(item) -> bool:
+        "puts the item once there is room, returns False if the consumer stopped meanwhile"
+        with measure(f"{name}.backpressure"):
+            while not stopped.is_set():
+                try:
+                    ready.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+        return False
+
+    def produce() -> None:
+        try:
+            for item in items:
+                if not put((item, None)):
+                    return
+        except BaseException as error:  # pylint: disable=broad-except
+            put((done, error))
+            return
+        put((done, None))
+
+    thread = threading.Thread(target=produce, name=name, daemon=True)
+    thread.start()
+    try:
+        while True:
+            benchmark.gauge(f"{name}.queue_depth", ready.qsize())
+            with measure(f"{name}.stall"):
+                item, error = ready.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def get_data(
+    data_provider: DataProvider,
+    on_batch_end: Optional[Callable[[int], None]] = None,
+    store: Optional[StateStore] = None,
+    resume_step: Optional[int] = None,
+    bulk_tls: Optional[bool] = None,
+    prefetch_steps: Optional[int] = None,
+    max_step_events: Optional[int] = None,
+) -> Iterator[Entry]:
+    """
+    read data from the data provider, clean it and yield
+    the records one day at a time ordered by timestamp,
+    evicting the old records from the store (the default store if none).
+    on_batch_end is called with the end of every step once its records
+    are processed, and the records before resume_step (one of these ends) are skipped.
+    with bulk_tls (BULK_TLS if none) the tracking locations of every step are yielded
+    at once as a TLStep before the other records instead of one by one.
+    up to prefetch_steps (PREFETCH_STEPS if none) steps are prepared on a background thread
+    while the current step is processed, see prefetch.
+    steps with more than max_step_events (STEP_MAX_EVENTS if none) records are prepared
+    and processed in parts, the evictions and on_batch_end still happen once per step
+    """
+    df_missions, df_waypoints, df_jobs, tl_chunks = clean_data(data_provider)
+    records = get_cleaned_data(
+        df_missions,
+        df_waypoints,
+        df_jobs,
+        tl_chunks,
+        on_batch_end=on_batch_end,
+        store=store,
+        resume_step=resume_step,
+        bulk_tls=bulk_tls,
+        prefetch_steps=prefetch_steps,
+        max_step_events=max_step_events,
     )
-    # create a list ranging between the max and min timestamps
-    # with 1 minute step
-    steps = pd.date_range(min_ts, max_ts, freq="24h")
-    steps = steps.union([steps[-1] + steps.freq * 1])  # type: ignore
-    for prev_step, step in zip(steps[:-1], steps[1:]):
-        all_entries = get_step_data(
-            prev_step=prev_step,
-            step=step,
-            df_missions=df_missions,
-            df_jobs=df_jobs,
-            df_waypoints=df_waypoints,
-            df_tl=df_tl,
-        )
-        # clear data
-        # clear jobs and missions from db
-        for k in list(MISSIONS.keys()):
-            if MISSIONS[k].timestamp < prev_step - timedelta(hours=3):
-                MISSIONS[k].tls_bucket.clear()
-                if mission := MISSIONS.pop(k, None):
-                    courier_id_to_mission_id.pop(mission.id, None)
-
-        for k in list(JOBS.keys()):
-            if JOBS[k].timestamp < prev_step - timedelta(hours=3):
-                JOBS.pop(k, None)
-
-        def clear_df(df: pd.DataFrame, timestamp):
-            old_rows = df.timestamp < timestamp
-            df.drop(df[old_rows].index, axis=0, inplace=True)
-
-        # clear used data from dataframes
-        # df_missions = df_missions[df_missions.timestamp > prev_step]
-        # df_jobs = df_jobs[df_jobs.timestamp > prev_step]
-        # df_waypoints = df_waypoints[df_waypoints.timestamp > prev_step]
-        # df_tl = df_tl[df_tl.timestamp > prev_step]
-        clear_df(df_missions, prev_step)
-        clear_df(df_jobs, prev_step)
-        clear_df(df_waypoints, prev_step)
-        clear_df(df_tl, prev_step)
-
-        for entry in all_entries:
-            yield entry
-
-        if on_batch_end:
-            on_batch_end()
+    # the cursors own the dataframes from now on
+    del df_missions, df_waypoints, df_jobs
+    yield from records
+
+
+def get_cleaned_data(
+    df_missions: pd.DataFrame,
+    df_waypoints: pd.DataFrame,
+    df_jobs: pd.DataFrame,
+    tl_chunks: Iterable[pd.DataFrame],
+    *,
+    on_batch_end: Optional[Callable[[int], None]] = None,
+    store: Optional[StateStore] = None,
+    resume_step: Optional[int] = None,
+    first_step: Optional[int] = None,
+    bulk_tls: Optional[bool] = None,
+    prefetch_steps: Optional[int] = None,
+    max_step_events: Optional[int] = None,
+) -> Iterator[Entry]:
+    """
+    same as get_data for dataframes returned by clean_data, the steps
+    start at first_step if given instead of the first record
+    """
+    store = get_store(store)
+    bulk_tls = BULK_TLS if bulk_tls is None else bulk_tls
+    missions, waypoints, jobs = FrameCursor(df_missions), FrameCursor(df_waypoints), FrameCursor(df_jobs)
+    tls = StreamCursor(tl_chunks)
+    cursors: List[Union[FrameCursor, StreamCursor]] = [missions, waypoints, jobs, tls]
+    del df_missions, df_waypoints, df_jobs
+
+    # steps of 1 day starting at the minimum timestamp in all the dataframes,
+    # until every record was taken (tracking locations may still be streaming)
+    first_timestamps = [timestamp for timestamp in (cursor.peek() for cursor in cursors) if timestamp is not None]
+    if not first_timestamps:
+        return
+    step = min(first_timestamps) if first_step is None else first_step
+    if resume_step is not None:
+        logger.info("resuming at %s", pd.Timestamp(resume_step).strftime("%m/%d/%Y %H"))
+        for cursor in (missions, waypoints, jobs):
+            cursor.take_until(resume_step)
+        tls.take_slices_until(resume_step)
+        step = resume_step
+    prefetch_steps = PREFETCH_STEPS if prefetch_steps is None else prefetch_steps
+    max_step_events = STEP_MAX_EVENTS if max_step_events is None else max_step_events
+    # the cursors are only used by the steps preparation from here on, the store stays on this thread
+    steps = prepare_steps(
+        missions=missions,
+        waypoints=waypoints,
+        jobs=jobs,
+        tls=tls,
+        step=step,
+        bulk_tls=bulk_tls,
+        materialize=prefetch_steps > 0,
+        max_events=max_step_events,
+    )
+    if prefetch_steps > 0:
+        steps = prefetch(steps, prefetch_steps, name="data.prefetch")
+    # closing the records stops the preparation of the next steps
+    with closing(steps):
+        for prev_step, step, tl_step, all_entries, first, last in steps:
+            if first:
+                evict_step(store, prev_step)
+
+            if tl_step is not None:
+                yield tl_step
+                # the tracking locations assigned by tl_step before a record are appended when it's processed
+                for position, entry in enumerate(all_entries):
+                    store.pending_tls.position = position
+                    yield entry
+                store.pending_tls.flush(store.missions)
+            else:
+                for entry in all_entries:
+                    yield entry
+
+            if last and on_batch_end:
+                on_batch_end(step)
@@ -0,0 +1,128 @@
+"""
+module to define ParquetConsumer class, reading local parquet
+or arrow ipc files through memory mapping
+"""
+from typing import Dict, List, Mapping, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pyarrow import dataset as ds
+from pyarrow import fs
+from pyarrow import parquet as pq
+
+from tracking_location_annotation.common.benchmark import measure
+from tracking_location_annotation.common.log import get_logger
+from tracking_location_annotation.data.data_provider import DataProvider
+
+logger = get_logger(__name__)
+
+FILE_EXTENSIONS = {"parquet": "parquet", "arrow": "arrow"}
+# rows per parquet row group (or arrow record batch), row groups outside the dates are skipped
+ROW_GROUP_SIZE = 100_000
+DATETIME_COLUMNS = ["created_at", "updated_at", "timestamp", "recorded_at"]
+# columns read from every table, in the order the models expect them
+COLUMNS: Dict[str, List[str]] = {
+    "missions_data": ["id", "courier_id", "state", "created_at", "updated_at", "timestamp"],
+    "waypoints_data": ["id", "job_id", "courier_id", "state", "created_at", "updated_at", "timestamp"],
+    "jobs_data": ["id", "state", "created_at", "updated_at", "mission_id", "timestamp"],
+    "tl_data": [
+        "user_id",
+        "recorded_at",
+        "is_moving",
+        "uuid",
+        "timestamp",
+        "odometer",
+        "battery_level",
+        "altitude",
+        "longitude",
+        "altitude_accuracy",
+        "latitude",
+        "speed",
+        "heading",
+        "coords_accuracy",
+        "activity_type",
+        "activity_confidence",
+    ],
+}
+
+
+def write_table(dataframe: pd.DataFrame, path: str, file_format: str = "parquet") -> None:
+    """
+    writes a dataframe in a format ParquetConsumer reads, with typed utc datetimes
+    and the rows sorted by timestamp so the row groups cover disjoint time ranges
+    """
+    dataframe = dataframe.drop(dataframe.filter(regex="Unname"), axis=1)
+    for column in DATETIME_COLUMNS:
+        if column in dataframe:
+            dataframe[column] = pd.to_datetime(dataframe[column], utc=True)
+    dataframe = dataframe.sort_values("timestamp", kind="mergesort", ignore_index=True)  # stable
+
+    table = pa.Table.from_pandas(dataframe, preserve_index=False)
+    if file_format == "parquet":
+        pq.write_table(table, path, row_group_size=ROW_GROUP_SIZE)
+    else:
+        with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table, max_chunksize=ROW_GROUP_SIZE)
+
+
+def write_tables(
+    frames: Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame], data_path: str, file_format: str = "parquet"
+) -> None:
+    "writes missions, waypoints, jobs and tracking locations under data_path"
+    for name, dataframe in zip(COLUMNS, frames):
+        write_table(dataframe, f"{data_path}/{name}.{FILE_EXTENSIONS[file_format]}", file_format)
+
+
+class ParquetConsumer(DataProvider):
+    """
+    data provider from parquet or arrow ipc files (written by write_tables),
+    the files are memory mapped, only the needed columns are read and
+    the start_date/end_date filter is pushed down to the reader
+    so parquet row groups outside the dates are not read at all
+    """
+
+    def __init__(
+        self,
+        start_date: np.datetime64,
+        batch_size_in_days: int,
+        data_path: str,
+        file_format: str = "parquet",
+        columns: Optional[Dict[str, Optional[List[str]]]] = None,
+        incremental: bool = False,
+    ) -> None:
+        super().__init__(start_date, batch_size_in_days, incremental)
+        self.data_path = data_path
+        self.file_format = file_format
+        self.columns: Mapping[str, Optional[List[str]]] = COLUMNS
+        if columns is not None:
+            self.columns = columns
+        self.filesystem = fs.LocalFileSystem(use_mmap=True)
+
+    def __str__(self) -> str:
+        return f"Parquet Consumer - path: {self.data_path}, format: {self.file_format}"
+
+    def read_table(self, name: str) -> pd.DataFrame:
+        """
+        reads the rows of the table between start_date and end_date
+        """
+        dataset = ds.dataset(
+            f"{self.data_path}/{name}.{FILE_EXTENSIONS[self.file_format]}",
+            format="parquet" if self.file_format == "parquet" else "ipc",
+            filesystem=self.filesystem,
+        )
+        timestamp_type = dataset.schema.field("timestamp").type
+        start = pa.scalar(pd.Timestamp(self.start_date).tz_localize("UTC"), type=timestamp_type)
+        end = pa.scalar(pd.Timestamp(self.end_date).tz_localize("UTC"), type=timestamp_type)
+        table = dataset.to_table(
+            columns=self.columns.get(name),
+            filter=(ds.field("timestamp") >= start)
+            & ((ds.field("timestamp") <= end) if self.end_inclusive else (ds.field("timestamp") < end)),
+        )
+        logger.info("read %d records from %s", table.num_rows, name)
+        return table.to_pandas()
+
+    @measure("parquet.fetch_data")
+    def fetch_data(self) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+        df_missions, df_waypoints, df_jobs, df_tl = map(self.read_table, COLUMNS)
+        return df_missions, df_waypoints, df_jobs, df_tl
@@ -0,0 +1,168 @@
+"""
+Define a local cache for query results, stored as one parquet file
+per table, query and day so overlapping date ranges are read from disk
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from tracking_location_annotation.common import benchmark
+from tracking_location_annotation.common.constants import QUERY_CACHE_DIR, QUERY_CACHE_MAX_BYTES
+from tracking_location_annotation.common.log import get_logger
+
+logger = get_logger(__name__)
+
+# fetches the full days between two dates (both included)
+Fetch = Callable[[np.datetime64, np.datetime64], pd.DataFrame]
+# the queries of a provider read through the cache concurrently, one eviction runs at a time
+EVICTION_LOCK = threading.Lock()
+
+
+def day_of(series: pd.Series) -> np.ndarray:
+    "returns the utc day of every timestamp (or timestamp string) in the series"
+    return pd.to_datetime(series, utc=True).dt.tz_localize(None).to_numpy(dtype="datetime64[D]")
+
+
+def utc_today() -> np.datetime64:
+    "returns the current utc day, the days from it on are still being written to the tables"
+    return np.datetime64("now", "D")
+
+
+class QueryCache:
+    """
+    caches query results per day under {path}/{table}/{query hash}/{day}.parquet
+
+    only the days missing from the cache are fetched, in contiguous runs,
+    and split by day on day_column before being written. the days from the
+    current utc day on are incomplete and never written, they are fetched
+    again by the next run. the least recently used files are removed once
+    the cache grows above max_bytes, a file evicted before it is read is fetched again
+    """
+
+    def __init__(self, path: str = QUERY_CACHE_DIR, max_bytes: int = QUERY_CACHE_MAX_BYTES) -> None:
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+
+    def __str__(self) -> str:
+        return f"query cache - path: {self.path}"
+
+    def _day_path(self, table: str, query: str, day: np.datetime64) -> Path:
+        query_hash = hashlib.sha1(query.encode("utf-8")).hexdigest()[:12]
+        return self.path / table / query_hash / f"{day}.parquet"
+
+    def get(self, *, table: str, query: str, days: List[np.datetime64], fetch: Fetch, day_column: str) -> pd.DataFrame:
+        """
+        returns the rows of all the given days, fetching the missing ones
+        """
+        frames = list(self.iter_days(table=table, query=query, days=days, fetch=fetch, day_column=day_column))
+        return pd.concat(frames, ignore_index=True)
+
+    def iter_days(
+        self,
+        *,
+        table: str,
+        query: str,
+        days: List[np.datetime64],
+        fetch: Fetch,
+        day_column: str,
+        max_days_per_fetch: Optional[int] = None,
+    ) -> Iterator[pd.DataFrame]:
+        """
+        yields the rows of the given days one day at a time, a missing day is
+        fetched together with the following missing days (at most max_days_per_fetch)
+        """
+        paths = [self._day_path(table, query, day) for day in days]
+        fetched: Dict[Path, Optional[pd.DataFrame]] = {}
+        for i, (day, path) in enumerate(zip(days, paths)):
+            if path in fetched:
+                # the days which are not cached are kept in memory until yielded
+                dataframe = fetched.pop(path)
+                if dataframe is None:
+                    dataframe = self._read(path)
+            else:
+                dataframe = self._read(path)
+                if dataframe is not None:
+                    benchmark.count(f"query_cache.{table}.hits")
+            if dataframe is None:
+                run = [day]
+                for next_day, next_path in zip(days[i + 1 :], paths[i + 1 :]):
+                    if next_path.exists() or next_day != run[-1] + 1 or len(run) == max_days_per_fetch:
+                        break
+                    run.append(next_day)
+                benchmark.count(f"query_cache.{table}.misses", len(run))
+                logger.info("query cache miss for %s between %s and %s", table, run[0], run[-1])
+                dataframe, following = self._write_days(table, query, run, fetch(run[0], run[-1]), day_column)
+                fetched.update(following)
+            yield dataframe
+
+        self.evict()
+
+    @staticmethod
+    def _read(path: Path) -> Optional[pd.DataFrame]:
+        "returns the rows of a cached day, or None when its file is missing (not written yet or evicted)"
+        try:
+            # reading bumps the access time used for eviction
+            os.utime(path)
+            return pd.read_parquet(path)
+        except FileNotFoundError:
+            return None
+
+    def _write_days(
+        self, table: str, query: str, days: List[np.datetime64], dataframe: pd.DataFrame, day_column: str
+    ) -> Tuple[pd.DataFrame, Dict[Path, Optional[pd.DataFrame]]]:
+        """
+        splits the fetched rows by day and writes a file per day, empty days included,
+        returns the rows of the first day, yielded right away, and the path of
+        every following day with the rows of the days which are not written
+        """
+        row_days = day_of(dataframe[day_column])
+        today = utc_today()
+        first_day = dataframe[row_days == days[0]].reset_index(drop=True)
+        days_by_path: Dict[Path, Optional[pd.DataFrame]] = {}
+        for day in days:
+            path = self._day_path(table, query, day)
+            day_rows = dataframe[row_days == day].reset_index(drop=True)
+            if day >= today:
+                days_by_path[path] = day_rows
+                continue
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # written under a unique temporary name first so readers (and concurrent writers) never see a partial file
+            handle, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+            os.close(handle)
+            try:
+                day_rows.to_parquet(tmp_path, index=False)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            days_by_path[path] = None
+        del days_by_path[self._day_path(table, query, days[0])]
+        return first_day, days_by_path
+
+    def size(self) -> int:
+        "returns the size of all the cached files in bytes"
+        return sum(path.stat().st_size for path in self.path.glob("*/*/*.parquet"))
+
+    def evict(self) -> None:
+        "removes the least recently used files until the cache fits in max_bytes"
+        with EVICTION_LOCK:
+            files = []
+            for path in self.path.glob("*/*/*.parquet"):
+                try:
+                    files.append((path.stat(), path))
+                except FileNotFoundError:  # removed by another process
+                    continue
+            files.sort(key=lambda file: file[0].st_mtime)
+            total = sum(stat.st_size for stat, _ in files)
+            for stat, path in files:
+                if total <= self.max_bytes:
+                    break
+                total -= stat.st_size
+                path.unlink(missing_ok=True)
+                benchmark.count("query_cache.evictions")
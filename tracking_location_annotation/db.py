@@ -1,19 +1,310 @@
 """
 module to dfine the app database which are
-dictionaries holding values for missions, jobs and waypoints records
+dictionaries holding values for missions, jobs and waypoints records,
+grouped in a StateStore so independent runs don't share them
 """
-from collections import defaultdict
-from typing import Dict
+import heapq
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, Generic, Iterator, List, MutableMapping, Optional, Tuple, TypeVar, Union
 
-from tracking_location_annotation.models import Job, Mission, Waypoint
+import numpy as np
 
-MISSIONS: Dict[int, Mission] = {}  # takes mission_id -> returns mission
+from tracking_location_annotation.common import benchmark
+from tracking_location_annotation.common.constants import ORPHAN_MAX_SIZE, ORPHAN_TTL_HOURS
 
-JOBS: Dict[int, Job] = {}  # takes job_id -> returns job
+if TYPE_CHECKING:  # models import this module, only needed for the annotations
+    from tracking_location_annotation.models import Job, Mission, Waypoint
 
-# to cover receiving waypoints before jobs
-unmapped_waypoints: Dict[int, Dict[int, Waypoint]] = defaultdict(lambda: {})
-# to cover receiving jobs before missions
-unmapped_jobs: Dict[int, Dict[int, Job]] = defaultdict(lambda: {})
-# to see if courier is in shift
-courier_id_to_mission_id: Dict[int, int] = {}  # takes mission id -> returns courier id
+# the buffered records, jobs or waypoints
+Orphan = TypeVar("Orphan", bound=Union["Job", "Waypoint"])
+
+
+class OrphanBuffer(Dict[int, Dict[int, Orphan]], Generic[Orphan]):
+    """
+    records received before their parent (waypoints before their job, jobs before their mission),
+    takes parent id -> returns the records by id
+
+    the arrival order is kept so the records waiting longer than ttl are evicted
+    at the step boundaries, and the oldest ones when there are more than max_size.
+    the evicted and the late matched (taken by their parent) records are counted
+    """
+
+    def __init__(self, name: str, ttl: int, max_size: int) -> None:
+        super().__init__()
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+        # (parent id, record id) -> arrival timestamp, in arrival order
+        self.arrivals: "OrderedDict[Tuple[int, int], int]" = OrderedDict()
+
+    def add(self, parent_id: int, record: Orphan) -> None:
+        "buffers the record until its parent is received"
+        self.setdefault(parent_id, {})[record.id] = record
+        self.arrivals[(parent_id, record.id)] = record.timestamp
+        # a record received again moves to the end
+        self.arrivals.move_to_end((parent_id, record.id))
+        if len(self.arrivals) > self.max_size:
+            self._drop(next(iter(self.arrivals)))
+            benchmark.count(f"db.{self.name}.overflowed")
+
+    def take(self, parent_id: int) -> Iterator[Orphan]:
+        "removes and yields the records waiting for the parent"
+        records = self.pop(parent_id, {})
+        if records:
+            benchmark.count(f"db.{self.name}.late_matched", len(records))
+        for record_id, record in records.items():
+            self.arrivals.pop((parent_id, record_id), None)
+            yield record
+
+    def evict(self, timestamp: int) -> int:
+        "removes the records received before timestamp - ttl, returns how many were removed"
+        limit = timestamp - self.ttl
+        expired = 0
+        while self.arrivals:
+            key, arrival = next(iter(self.arrivals.items()))
+            if arrival >= limit:
+                break
+            self._drop(key)
+            expired += 1
+        benchmark.count(f"db.{self.name}.expired", expired)
+        return expired
+
+    def _drop(self, key: Tuple[int, int]) -> None:
+        parent_id, record_id = key
+        del self.arrivals[key]
+        records = self[parent_id]
+        del records[record_id]
+        if not records:
+            del self[parent_id]
+
+    def size(self) -> int:
+        "returns the number of buffered records"
+        return len(self.arrivals)
+
+    def clear(self) -> None:
+        super().clear()
+        self.arrivals.clear()
+
+    def restore(self, other: "OrphanBuffer[Orphan]") -> None:
+        "replaces the buffered records by the ones of the other buffer"
+        self.clear()
+        self.update(other)
+        self.arrivals.update(other.arrivals)
+
+
+class PendingTLs(Dict[int, List[Any]]):
+    """
+    tracking locations assigned to their mission in bulk at the start of a step (see tl_assignment),
+    takes mission id -> returns [positions, chunk indexes, rows, state codes, count appended]
+
+    the position of a tracking location is the number of missions, jobs and waypoints before it
+    in the step, they are appended to the mission bucket only when the mission is used,
+    sync appends the ones before the record being processed (position)
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.position = 0
+        self.chunks: List[Any] = []
+
+    def add(
+        self,
+        chunks: List[Any],
+        mission_ids: np.ndarray,
+        positions: np.ndarray,
+        chunk_indexes: np.ndarray,
+        rows: np.ndarray,
+        states: np.ndarray,
+    ) -> None:
+        "adds the tracking locations of a step, ordered by position, with their mission id (0 for none)"
+        self.chunks = chunks
+        assigned = np.flatnonzero(mission_ids)
+        order = assigned[np.argsort(mission_ids[assigned], kind="stable")]
+        mission_ids = mission_ids[order]
+        bounds = [0, *(np.flatnonzero(np.diff(mission_ids)) + 1).tolist(), len(order)] if len(order) else []
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            rows_order = order[start:stop]
+            self[int(mission_ids[start])] = [
+                positions[rows_order],
+                chunk_indexes[rows_order],
+                rows[rows_order],
+                states[rows_order],
+                0,
+            ]
+
+    def sync(self, mission: "Mission") -> None:
+        "appends the tracking locations of the mission before the record being processed to its bucket"
+        self._append(mission, self.position)
+
+    def _append(self, mission: "Mission", position: Optional[int]) -> None:
+        "appends the tracking locations of the mission before position, all of them if none"
+        if not (pending := self.get(mission.id)):
+            return
+        positions, chunk_indexes, rows, states, start = pending
+        stop = len(positions) if position is None else int(positions.searchsorted(position, side="right"))
+        if stop <= start:
+            return
+        # one extend per run of rows in the same chunk
+        bounds = [start, *(np.flatnonzero(np.diff(chunk_indexes[start:stop])) + start + 1).tolist(), stop]
+        for first, last in zip(bounds[:-1], bounds[1:]):
+            mission.tls_bucket.extend_rows(self.chunks[chunk_indexes[first]], rows[first:last], states[first:last])
+        if stop == len(positions):
+            del self[mission.id]
+        else:
+            pending[4] = stop
+
+    def flush(self, missions: MutableMapping[int, "Mission"]) -> None:
+        "appends all the pending tracking locations, at the end of the step"
+        for mission_id in list(self):
+            self._append(missions[mission_id], None)
+        self.chunks = []
+        self.position = 0
+
+    def size(self) -> int:
+        "returns the number of tracking locations not appended yet"
+        return sum(len(pending[0]) - pending[4] for pending in self.values())
+
+    def clear(self) -> None:
+        super().clear()
+        self.chunks = []
+        self.position = 0
+
+
+ORPHAN_TTL = ORPHAN_TTL_HOURS * 3600 * 10**9  # in nanoseconds like the records timestamps
+
+
+class StateStore:
+    """
+    the state of one annotation run, passed to app.run, the process functions,
+    the annotator and the model lookups. the module level names below
+    are the default store, used when no store is passed
+    """
+
+    def __init__(self, orphan_ttl: int = ORPHAN_TTL, orphan_max_size: int = ORPHAN_MAX_SIZE) -> None:
+        self.missions: MutableMapping[int, "Mission"] = {}  # takes mission_id -> returns mission
+        self.jobs: MutableMapping[int, "Job"] = {}  # takes job_id -> returns job
+        # to cover receiving waypoints before jobs
+        self.unmapped_waypoints: OrphanBuffer["Waypoint"] = OrphanBuffer(
+            "unmapped_waypoints", orphan_ttl, orphan_max_size
+        )
+        # to cover receiving jobs before missions
+        self.unmapped_jobs: OrphanBuffer["Job"] = OrphanBuffer("unmapped_jobs", orphan_ttl, orphan_max_size)
+        # to see if courier is in shift
+        self.courier_id_to_mission_id: Dict[int, int] = {}  # takes courier id -> returns mission id
+        # eviction indexes, heaps of (timestamp, id) pushed every time a record is stored,
+        # an entry is stale once the record was stored again with a later timestamp
+        self.missions_by_timestamp: List[Tuple[int, int]] = []
+        self.jobs_by_timestamp: List[Tuple[int, int]] = []
+        # tracking locations of the step assigned in bulk, not in the buckets yet
+        self.pending_tls = PendingTLs()
+
+    def store_mission(self, mission: "Mission") -> None:
+        "adds or replaces the mission and indexes it by timestamp"
+        self.missions[mission.id] = mission
+        heapq.heappush(self.missions_by_timestamp, (mission.timestamp, mission.id))
+
+    def store_job(self, job: "Job") -> None:
+        "adds or replaces the job and indexes it by timestamp"
+        self.jobs[job.id] = job
+        heapq.heappush(self.jobs_by_timestamp, (job.timestamp, job.id))
+
+    def evict(self, limit: int) -> Tuple[int, int]:
+        """
+        removes the missions and jobs last stored before limit, with their courier lookup,
+        only the expired index entries are visited. returns the evicted missions and jobs
+        """
+        evicted_missions = 0
+        while self.missions_by_timestamp and self.missions_by_timestamp[0][0] < limit:
+            _, mission_id = heapq.heappop(self.missions_by_timestamp)
+            mission = self._peek(self.missions, mission_id)
+            if mission is None or mission.timestamp >= limit:
+                continue
+            mission.tls_bucket.clear()
+            del self.missions[mission_id]
+            # the courier may be on a newer mission already
+            if self.courier_id_to_mission_id.get(mission.courier_id) == mission_id:
+                del self.courier_id_to_mission_id[mission.courier_id]
+            evicted_missions += 1
+
+        evicted_jobs = 0
+        while self.jobs_by_timestamp and self.jobs_by_timestamp[0][0] < limit:
+            _, job_id = heapq.heappop(self.jobs_by_timestamp)
+            job = self._peek(self.jobs, job_id)
+            if job is None or job.timestamp >= limit:
+                continue
+            del self.jobs[job_id]
+            evicted_jobs += 1
+
+        return evicted_missions, evicted_jobs
+
+    def _peek(self, records: MutableMapping[int, Any], key: int) -> Any:
+        "returns the record for the eviction, stores that keep records elsewhere avoid loading them back"
+        return records.get(key)
+
+    def sizes(self) -> Dict[str, int]:
+        "returns the number of entries in every structure, for the gauges"
+        return {
+            "missions": len(self.missions),
+            "jobs": len(self.jobs),
+            "unmapped_waypoints": self.unmapped_waypoints.size(),
+            "unmapped_jobs": self.unmapped_jobs.size(),
+            "courier_id_to_mission_id": len(self.courier_id_to_mission_id),
+            "missions_by_timestamp": len(self.missions_by_timestamp),
+            "jobs_by_timestamp": len(self.jobs_by_timestamp),
+            "pending_tls": self.pending_tls.size(),
+        }
+
+    def clear(self) -> None:
+        "removes everything from the store"
+        self.missions.clear()
+        self.jobs.clear()
+        self.unmapped_waypoints.clear()
+        self.unmapped_jobs.clear()
+        self.courier_id_to_mission_id.clear()
+        self.missions_by_timestamp.clear()
+        self.jobs_by_timestamp.clear()
+        self.pending_tls.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        "returns the content of the store as picklable values, see restore"
+        return {
+            "missions": {key: self._peek(self.missions, key) for key in self.missions},
+            "jobs": {key: self._peek(self.jobs, key) for key in self.jobs},
+            "unmapped_waypoints": self.unmapped_waypoints,
+            "unmapped_jobs": self.unmapped_jobs,
+            "courier_id_to_mission_id": self.courier_id_to_mission_id,
+            "missions_by_timestamp": self.missions_by_timestamp,
+            "jobs_by_timestamp": self.jobs_by_timestamp,
+        }
+
+    def restore(self, snapshot: Dict[str, Any]) -> None:
+        "replaces the content of the store by a snapshot, in place so the default store names stay valid"
+        self.clear()
+        self.missions.update(snapshot["missions"])
+        self.jobs.update(snapshot["jobs"])
+        self.unmapped_waypoints.restore(snapshot["unmapped_waypoints"])
+        self.unmapped_jobs.restore(snapshot["unmapped_jobs"])
+        self.courier_id_to_mission_id.update(snapshot["courier_id_to_mission_id"])
+        self.missions_by_timestamp.extend(snapshot["missions_by_timestamp"])
+        self.jobs_by_timestamp.extend(snapshot["jobs_by_timestamp"])
+
+    def close(self) -> None:
+        "releases the resources of the store, nothing to release when everything is in memory"
+
+
+default_store = StateStore()
+
+MISSIONS = default_store.missions
+JOBS = default_store.jobs
+unmapped_waypoints = default_store.unmapped_waypoints
+unmapped_jobs = default_store.unmapped_jobs
+courier_id_to_mission_id = default_store.courier_id_to_mission_id
+store_mission = default_store.store_mission
+store_job = default_store.store_job
+evict = default_store.evict
+sizes = default_store.sizes
+
+
+def get_store(store: Optional[StateStore] = None) -> StateStore:
+    "returns the store or the default store when it's none"
+    return default_store if store is None else store
@@ -2,6 +2,7 @@
 module to upload csv result files to google cloud storage
 """
 from functools import cache
+from typing import Optional
 
 from google.cloud import storage  # type: ignore
 
@@ -23,12 +24,12 @@ def _get_bucket() -> storage.Bucket:
 
 
 @measure("gcs_upload_filename")
-def upload_filename(local_filename: str, remote_dir: str) -> None:
+def upload_filename(local_filename: str, remote_dir: str, remote_name: Optional[str] = None) -> None:
     """
     Uploads the given local filename to the destination directory in the bucket.
-    The uploaded blob has the name of the local filename appended to the provided
+    The uploaded blob has the name of the local filename (or remote_name) appended to the provided
     destination directory.
     """
     logger.info("[google.storage] uploading filename %s", local_filename)
     bucket = _get_bucket()
-    bucket.blob(f"{remote_dir}/{local_filename}").upload_from_filename(str(local_filename))
+    bucket.blob(f"{remote_dir}/{remote_name or local_filename}").upload_from_filename(str(local_filename))
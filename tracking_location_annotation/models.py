@@ -1,12 +1,121 @@
 """
-file to define the models that will represent the records with some helper functions
+file to define the models that will represent the records with some helper functions,
+datetimes are int64 nanoseconds and ids are ints (0 or None for no reference)
+as produced by clean_data, the models do no conversion
 """
-from typing import Any, Dict, List, Optional, Set
+from array import array
+from itertools import chain
+from threading import Lock
+from typing import Dict, Hashable, Iterator, List, Optional, Set, Tuple
 
+import numpy as np
 import pandas as pd
-from numpy import datetime64
 
-from tracking_location_annotation.common.utils import maybe_int
+from tracking_location_annotation.db import StateStore, get_store
+
+# mission states are stored as small codes in the buckets, shared by all the stores,
+# a missing state (nan) has its code too
+MISSION_STATES: List[Hashable] = []
+_MISSION_STATE_CODES: Dict[Hashable, int] = {}
+_MISSION_STATES_LOCK = Lock()
+
+
+def mission_state_code(state: Hashable) -> int:
+    """returns the code of the mission state, registering new states"""
+    if (code := _MISSION_STATE_CODES.get(state)) is None:
+        with _MISSION_STATES_LOCK:
+            if (code := _MISSION_STATE_CODES.get(state)) is None:
+                MISSION_STATES.append(state)
+                code = _MISSION_STATE_CODES[state] = len(MISSION_STATES) - 1
+    return code
+
+
+class TLBucket:
+    """
+    tracking locations waiting for a waypoint to be annotated with, kept as
+    row positions into the cleaned tracking locations chunks together with the
+    code of the mission state when they arrived, the records are only built by the sink.
+    rows of the same chunk are grouped in segments, in arrival order
+    """
+
+    __slots__ = ("chunks", "rows", "states")
+
+    def __init__(self) -> None:
+        self.chunks: List[pd.DataFrame] = []
+        self.rows: List[array] = []
+        self.states: List[array] = []
+
+    def __len__(self) -> int:
+        return sum(map(len, self.rows))
+
+    def __bool__(self) -> bool:
+        return bool(self.rows)
+
+    def append(self, chunk: pd.DataFrame, row: int, state: str) -> None:
+        """adds a tracking location, the row of the chunk, with the mission state"""
+        if not self.chunks or self.chunks[-1] is not chunk:
+            self.chunks.append(chunk)
+            self.rows.append(array("q"))
+            self.states.append(array("h"))
+        self.rows[-1].append(row)
+        self.states[-1].append(mission_state_code(state))
+
+    def extend_rows(self, chunk: pd.DataFrame, rows: np.ndarray, states: np.ndarray) -> None:
+        """adds tracking locations of the chunk at once, rows are int64 positions and states int16 codes"""
+        if not self.chunks or self.chunks[-1] is not chunk:
+            self.chunks.append(chunk)
+            self.rows.append(array("q"))
+            self.states.append(array("h"))
+        self.rows[-1].frombytes(rows.astype(np.int64, copy=False).tobytes())
+        self.states[-1].frombytes(states.astype(np.int16, copy=False).tobytes())
+
+    def extend(self, other: "TLBucket") -> None:
+        """adds the tracking locations of the other bucket (which may be this one) after these ones"""
+        for chunk, rows, states in list(zip(other.chunks, other.rows, other.states)):
+            if self.chunks and self.chunks[-1] is chunk:
+                self.rows[-1].extend(rows)
+                self.states[-1].extend(states)
+            else:
+                self.chunks.append(chunk)
+                self.rows.append(array("q", rows))
+                self.states.append(array("h", states))
+
+    def clear(self) -> None:
+        """removes all the tracking locations"""
+        self.chunks = []
+        self.rows = []
+        self.states = []
+
+    def take(self) -> Tuple[List[pd.DataFrame], List[array], List[array]]:
+        """removes all the tracking locations and returns the chunks with their row and state arrays,
+        the arrays are handed over, not copied, the bucket starts new ones"""
+        taken = self.chunks, self.rows, self.states
+        self.clear()
+        return taken
+
+    def segments(self) -> Iterator[Tuple[pd.DataFrame, np.ndarray, np.ndarray]]:
+        """yields the chunks with the positions and mission state codes of their tracking locations"""
+        for chunk, rows, states in zip(self.chunks, self.rows, self.states):
+            yield chunk, np.array(rows, dtype=np.int64), np.array(states, dtype=np.int16)
+
+    def __getstate__(self) -> Tuple[Optional[pd.DataFrame], array, List[Hashable]]:
+        """pickles the rows of the tracking locations instead of the whole chunks they
+        point to (see spill_store and checkpoint), they are one chunk once unpickled.
+        the state names are pickled with the codes since codes differ between processes"""
+        if not self.rows:
+            # never falsy, __setstate__ is not called for falsy states
+            return None, array("h"), []
+        records = pd.concat([chunk.iloc[rows] for chunk, rows, _ in self.segments()], ignore_index=True)
+        return records, array("h", chain.from_iterable(self.states)), list(MISSION_STATES)
+
+    def __setstate__(self, state: Tuple[Optional[pd.DataFrame], array, List[Hashable]]) -> None:
+        self.clear()
+        records, states, names = state
+        if records is not None:
+            codes = [mission_state_code(name) for name in names]
+            self.chunks.append(records)
+            self.rows.append(array("q", range(len(records))))
+            self.states.append(array("h", [codes[code] for code in states]))
 
 
 # pylint: disable=too-many-arguments, redefined-builtin
@@ -15,29 +124,44 @@ class Mission:
     class represting mission object, and its jobs
     """
 
+    __slots__ = (
+        "id",
+        "courier_id",
+        "state",
+        "created_at",
+        "updated_at",
+        "timestamp",
+        "record_type",
+        "jobs",
+        "tls_bucket",
+        "waypoints_processing_order",
+        "jobs_from_other_missions",
+        "intermediate_tls_bucket",
+    )
+
     def __init__(
         self,
         id: int,
-        courier_id: Optional[Any],
+        courier_id: Optional[int],
         state: str,
-        created_at: datetime64,
-        updated_at: datetime64,
-        timestamp: datetime64,
+        created_at: int,
+        updated_at: int,
+        timestamp: int,
         record_type: str,
     ) -> None:
 
-        self.id = int(id)
-        self.courier_id = maybe_int(courier_id)
+        self.id = id
+        self.courier_id = courier_id
         self.state = state
         self.created_at = created_at
         self.updated_at = updated_at
         self.timestamp = timestamp
         self.record_type = record_type
         self.jobs: Dict[int, Job] = {}
-        self.tls_bucket: List[TrackingLocation] = []
+        self.tls_bucket = TLBucket()
         self.waypoints_processing_order: List[int] = []
         self.jobs_from_other_missions: Set[int] = set()
-        self.intermediate_tls_bucket: List[TrackingLocation] = []
+        self.intermediate_tls_bucket = TLBucket()
 
     @property
     def is_done(self) -> bool:
@@ -64,22 +188,24 @@ class Job:
     class represting job object, and its waypoints
     """
 
+    __slots__ = ("id", "state", "created_at", "updated_at", "mission_id", "timestamp", "record_type", "waypoints")
+
     def __init__(
         self,
         id: int,
         state: str,
-        created_at: datetime64,
-        updated_at: datetime64,
-        mission_id: Optional[Any],
-        timestamp: datetime64,
+        created_at: int,
+        updated_at: int,
+        mission_id: Optional[int],
+        timestamp: int,
         record_type: str,
     ) -> None:
 
-        self.id = int(id)
+        self.id = id
         self.state = state
         self.created_at = created_at
         self.updated_at = updated_at
-        self.mission_id = maybe_int(mission_id)
+        self.mission_id = mission_id
         self.timestamp = timestamp
         self.record_type = record_type
         self.waypoints: Dict[int, Waypoint] = {}
@@ -90,11 +216,11 @@ class Job:
     def __repr__(self) -> str:  # pragma: no cover
         return f"[{self.timestamp}] Job#:{self.id}, state:{self.state}, mission_id:{self.mission_id}"
 
-    def mission(self) -> Optional[Mission]:
-        """returns the mission of the job or none"""
+    def mission(self, store: Optional[StateStore] = None) -> Optional[Mission]:
+        """returns the mission of the job from the store (default store if none) or none"""
         if not self.mission_id:
             return None
-        return MISSIONS.get(self.mission_id)
+        return get_store(store).missions.get(self.mission_id)
 
     def add_waypoint(self, new_waypoint: "Waypoint") -> None:
         """replaces the old waypoint with new waypoint or adds new one"""
@@ -111,21 +237,23 @@ class Waypoint:
     model to represent the waypoints table records with some helper functions
     """
 
+    __slots__ = ("id", "job_id", "courier_id", "state", "created_at", "updated_at", "timestamp", "record_type")
+
     def __init__(
         self,
-        id: float,
-        job_id: Optional[Any],
-        courier_id: Optional[Any],
+        id: int,
+        job_id: Optional[int],
+        courier_id: Optional[int],
         state: str,
-        created_at: datetime64,
-        updated_at: datetime64,
-        timestamp: datetime64,
+        created_at: int,
+        updated_at: int,
+        timestamp: int,
         record_type: str,
     ) -> None:
 
-        self.id = int(id)
-        self.job_id = maybe_int(job_id)
-        self.courier_id = maybe_int(courier_id)
+        self.id = id
+        self.job_id = job_id
+        self.courier_id = courier_id
         self.state = state
         self.created_at = created_at
         self.updated_at = updated_at
@@ -143,24 +271,47 @@ class Waypoint:
             return False
         return self.id == other.id
 
-    def mission(self) -> Optional[Mission]:
+    def mission(self, store: Optional[StateStore] = None) -> Optional[Mission]:
         """returns the associated mission or null"""
-        if job := self.job():
-            return job.mission()
+        if job := self.job(store):
+            return job.mission(store)
         return None
 
-    def job(self) -> Optional[Job]:
-        """returns the associated job or null or none"""
+    def job(self, store: Optional[StateStore] = None) -> Optional[Job]:
+        """returns the associated job from the store (default store if none) or null or none"""
         if not self.job_id:
             return None
-        return JOBS.get(self.job_id)
+        return get_store(store).jobs.get(self.job_id)
 
 
 class TrackingLocation:
     """
-    model to represent the tracking locations table records with some helper functions
+    model to represent the tracking locations table records with some helper functions,
+    the buckets keep row positions instead, these are built from the annotated records
     """
 
+    __slots__ = (
+        "user_id",
+        "recorded_at",
+        "is_moving",
+        "uuid",
+        "timestamp",
+        "odometer",
+        "battery_level",
+        "altitude",
+        "longitude",
+        "altitude_accuracy",
+        "latitude",
+        "speed",
+        "heading",
+        "coords_accuracy",
+        "activity_type",
+        "activity_confidence",
+        "record_type",
+        "mission_state",
+        "waypoint_id",
+    )
+
     def __init__(self, row: pd.Series) -> None:
 
         self.user_id = row.user_id
@@ -188,9 +339,3 @@ class TrackingLocation:
 
     def __repr__(self) -> str:  # pragma: no cover
         return f"[{self.timestamp}] TL#:{self.uuid}, courier_id:{self.user_id}"
-
-
-from tracking_location_annotation.db import (  # pylint: disable=wrong-import-position, cyclic-import
-    JOBS,
-    MISSIONS,
-)
@@ -1,16 +1,26 @@
 """
-module to generate csv files for local development
+module to generate csv files for local development,
+or parquet/arrow files with the format as first argument:
+
+    python tracking_location_annotation/resources/script.py parquet
 """
+import sys
+
 import numpy as np
 
 from tracking_location_annotation.data.bigquery_consumer import BqConsumer
+from tracking_location_annotation.data.parquet_consumer import write_tables
 
 start_date = np.datetime64("2022-02-01")
 batch_size_in_days = 1
+file_format = sys.argv[1] if len(sys.argv) > 1 else "csv"
 
 consumer = BqConsumer(start_date=start_date, batch_size_in_days=batch_size_in_days)
 
-consumer.get_missions().to_csv("missions_data.csv", index=False)
-consumer.get_jobs().to_csv("jobs_data.csv", index=False)
-consumer.get_waypoints().to_csv("waypoints_data.csv", index=False)
-consumer.get_tracking_locations().to_csv("tl_data.csv", index=False)
+if file_format == "csv":
+    consumer.get_missions().to_csv("missions_data.csv", index=False)
+    consumer.get_jobs().to_csv("jobs_data.csv", index=False)
+    consumer.get_waypoints().to_csv("waypoints_data.csv", index=False)
+    consumer.get_tracking_locations().to_csv("tl_data.csv", index=False)
+else:
+    write_tables(consumer.fetch_data(), ".", file_format)
@@ -0,0 +1,256 @@
+"""
+module to define the sharded engine, annotating independent shards of the records
+in a process pool with the same process functions as app.run
+
+the state of a mission only depends on the records of its courier, its jobs and
+their waypoints, and a job can move between missions, so the records are partitioned
+by the connected components of couriers, missions and jobs. every component is
+processed by one worker with its own store, and the annotations are merged back
+in the order of the waypoints that triggered them, which is the order app.run writes them
+"""
+import heapq
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from tracking_location_annotation.annotator import Annotator
+from tracking_location_annotation.app import get_datetime_upper_limit, process_entry
+from tracking_location_annotation.common import benchmark
+from tracking_location_annotation.common.benchmark import measure
+from tracking_location_annotation.common.constants import ANNOTATION_WORKERS
+from tracking_location_annotation.common.log import get_logger, update_tracers
+from tracking_location_annotation.data.data_provider import DataProvider
+from tracking_location_annotation.data.get_data_util import clean_data, get_cleaned_data
+from tracking_location_annotation.db import StateStore
+from tracking_location_annotation.models import TLBucket, mission_state_code
+from tracking_location_annotation.sink.sink import Sink
+
+logger = get_logger(__name__)
+
+# couriers, missions and jobs share the node ids of the components, with their type in the low digits
+COURIER, MISSION, JOB = 0, 1, 2
+NODE_TYPES = 3
+
+
+class Shard(NamedTuple):
+    """
+    the cleaned records of some components, waypoint_positions are the positions
+    of the waypoints in all the waypoints, first_step is the start of the steps of all the shards
+    """
+
+    missions: pd.DataFrame
+    waypoints: pd.DataFrame
+    jobs: pd.DataFrame
+    tls: pd.DataFrame
+    waypoint_positions: np.ndarray
+    first_step: int
+    datetime_upper_limit: int
+
+
+class ShardSink(Sink):
+    """
+    memory sink recording the position of the waypoint being processed with every annotation,
+    the records are returned to the parent process instead of being flushed
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.name: str = "shard_sink"
+        self.position = -1
+        self.positions: List[int] = []
+
+    def connect(self) -> "ShardSink":
+        return self
+
+    def append_rows(self, chunk: pd.DataFrame, rows: np.ndarray, states: np.ndarray, waypoint_id: int) -> None:
+        super().append_rows(chunk, rows, states, waypoint_id)
+        self.positions.append(self.position)
+
+    def append_many(self, bucket: TLBucket, waypoint_id: int) -> None:
+        annotated = len(self.annotated)
+        super().append_many(bucket, waypoint_id)
+        self.positions.extend([self.position] * (len(self.annotated) - annotated))
+
+    def record_positions(self) -> np.ndarray:
+        "returns the waypoint position of every record, see records"
+        return np.repeat(np.array(self.positions, dtype=np.int64), [len(rows) for _, rows, _, _ in self.annotated])
+
+    def flush(self) -> None:
+        self.annotated.clear()
+        self.positions.clear()
+
+
+def _find(parents: Dict[int, int], node: int) -> int:
+    "returns the root of the node, halving the path on the way"
+    while parents[node] != node:
+        parents[node] = parents[parents[node]]
+        node = parents[node]
+    return node
+
+
+def _union(parents: Dict[int, int], first: int, second: int) -> None:
+    "joins the components of the two nodes, the smallest root stays so the roots are deterministic"
+    first, second = _find(parents, parents.setdefault(first, first)), _find(parents, parents.setdefault(second, second))
+    if first != second:
+        parents[max(first, second)] = min(first, second)
+
+
+def _roots(parents: Dict[int, int], nodes: np.ndarray) -> np.ndarray:
+    "returns the root of every node, -1 for the nodes without any mission or job"
+    unique, inverse = np.unique(nodes, return_inverse=True)
+    roots = [_find(parents, node) if node in parents else -1 for node in unique.tolist()]
+    return np.array(roots, dtype=np.int64)[inverse]
+
+
+@measure("sharded.components")
+def components(
+    df_missions: pd.DataFrame, df_waypoints: pd.DataFrame, df_jobs: pd.DataFrame, df_tl: pd.DataFrame
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    returns the component of every record of the cleaned dataframes, -1 for the waypoints
+    of unknown jobs and the tracking locations of couriers without missions, they are never annotated
+    """
+    parents: Dict[int, int] = {}
+    mission_nodes = df_missions["id"].to_numpy() * NODE_TYPES + MISSION
+    courier_nodes = df_missions["courier_id"].to_numpy() * NODE_TYPES + COURIER
+    job_nodes = df_jobs["id"].to_numpy() * NODE_TYPES + JOB
+    job_mission_nodes = df_jobs["mission_id"].to_numpy() * NODE_TYPES + MISSION
+    for node in np.concatenate([mission_nodes, job_nodes]).tolist():
+        parents.setdefault(node, node)
+    # missing couriers and missions are 0
+    edges = np.concatenate(
+        [
+            np.stack([courier_nodes, mission_nodes], axis=1)[df_missions["courier_id"].to_numpy() != 0],
+            np.stack([job_mission_nodes, job_nodes], axis=1)[df_jobs["mission_id"].to_numpy() != 0],
+        ]
+    )
+    for first, second in np.unique(edges, axis=0).tolist():
+        _union(parents, first, second)
+
+    tl_couriers = df_tl["user_id"].fillna(0).to_numpy(dtype=np.int64)
+    return (
+        _roots(parents, mission_nodes),
+        _roots(parents, df_waypoints["job_id"].to_numpy() * NODE_TYPES + JOB),
+        _roots(parents, job_nodes),
+        _roots(parents, np.where(tl_couriers != 0, tl_couriers * NODE_TYPES + COURIER, -1)),
+    )
+
+
+def assign_shards(roots: List[np.ndarray], shards: int) -> Dict[int, int]:
+    """
+    returns the shard of every component, the largest components (in records)
+    go first to the shard with the fewest records
+    """
+    components_roots, sizes = np.unique(np.concatenate(roots), return_counts=True)
+    loads = [(0, shard) for shard in range(shards)]
+    assignment = {}
+    for index in np.lexsort((components_roots, -sizes)).tolist():
+        if components_roots[index] == -1:
+            continue
+        load, shard = heapq.heappop(loads)
+        assignment[int(components_roots[index])] = shard
+        heapq.heappush(loads, (load + int(sizes[index]), shard))
+    return assignment
+
+
+@measure("sharded.partition")
+def partition(data_provider: DataProvider, shards: int) -> List[Shard]:
+    "cleans the data of the provider and splits it into shards of whole components"
+    df_missions, df_waypoints, df_jobs, tl_chunks = clean_data(data_provider)
+    # the tracking locations have to be read to be partitioned
+    df_tl = pd.concat(list(tl_chunks), ignore_index=True)
+    frames = [df_missions, df_waypoints, df_jobs, df_tl]
+    first_timestamps = [df.timestamp.iloc[0] for df in frames if len(df)]
+    if not first_timestamps:
+        return []
+    first_step = int(min(first_timestamps))
+    datetime_upper_limit = get_datetime_upper_limit(data_provider)
+
+    roots = components(*frames)
+    assignment = assign_shards(list(roots), shards)
+    shard_of = []
+    for frame_roots in roots:
+        unique, inverse = np.unique(frame_roots, return_inverse=True)
+        shard_of.append(np.array([assignment.get(root, -1) for root in unique.tolist()], dtype=np.int64)[inverse])
+
+    result = []
+    for shard in range(shards):
+        masks = [frame_shards == shard for frame_shards in shard_of]
+        missions, waypoints, jobs, tls = (frame[mask].reset_index(drop=True) for frame, mask in zip(frames, masks))
+        logger.info(
+            "shard %d: %d missions, %d waypoints, %d jobs and %d tracking locations",
+            shard,
+            len(missions),
+            len(waypoints),
+            len(jobs),
+            len(tls),
+        )
+        benchmark.gauge(f"sharded.shard_{shard}.records", sum(map(len, (missions, waypoints, jobs, tls))))
+        result.append(Shard(missions, waypoints, jobs, tls, np.flatnonzero(masks[1]), first_step, datetime_upper_limit))
+    return result
+
+
+def run_shard(shard: Shard) -> Tuple[pd.DataFrame, np.ndarray]:
+    """
+    processes the records of the shard with a new store, like app.run without checkpoints,
+    returns the annotated records and the position of the waypoint that annotated every record
+    """
+    update_tracers()
+    store = StateStore()
+    sink = ShardSink()
+    annotator = Annotator(sink, store)
+    positions: Iterator[int] = iter(shard.waypoint_positions.tolist())
+    records = get_cleaned_data(
+        shard.missions, shard.waypoints, shard.jobs, [shard.tls], store=store, first_step=shard.first_step
+    )
+    for entry in records:
+        if entry.record_type == "waypoint":
+            sink.position = next(positions)
+        process_entry(entry, annotator, shard.datetime_upper_limit, store)
+    return sink.records(), sink.record_positions()
+
+
+@measure("sharded.merge")
+def merge(results: List[Tuple[pd.DataFrame, np.ndarray]], data_sink: Sink) -> None:
+    """
+    appends the records of the shards to the sink in the order of the waypoints that
+    annotated them, one append per waypoint like the annotator
+    """
+    results = [(records, positions) for records, positions in results if len(positions)]
+    if not results:
+        return
+    state_codes, frames = [], []
+    for records, _ in results:
+        # the workers registered the mission states in their own order
+        codes = np.array([mission_state_code(state) for state in records.mission_state.cat.categories], np.int16)
+        state_codes.append(codes[records.mission_state.cat.codes.to_numpy()])
+        frames.append(records)
+    positions = np.concatenate([positions for _, positions in results])
+    order = np.argsort(positions, kind="stable")
+    positions, states = positions[order], np.concatenate(state_codes)[order]
+    records = pd.concat(frames, ignore_index=True).iloc[order].reset_index(drop=True)
+    waypoint_ids = records["waypoint_id"].to_numpy()
+    chunk = records.drop(columns=["mission_state", "waypoint_id"])
+
+    bounds: List[int] = np.concatenate([[0], np.flatnonzero(np.diff(positions)) + 1, [len(positions)]]).tolist()
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        data_sink.append_rows(chunk, np.arange(start, stop), states[start:stop], int(waypoint_ids[start]))
+
+
+def run_sharded(data_provider: DataProvider, data_sink: Sink, workers: Optional[int] = None) -> None:
+    """
+    annotates the records of the data provider like app.run (without checkpoints) with
+    the shards processed by a pool of workers (ANNOTATION_WORKERS if none), the sink only
+    gets the annotations once all the shards are done. the tracking locations are read at once.
+    every shard bounds its orphans to ORPHAN_MAX_SIZE on its own, so when the orphans
+    overflow the ones dropped can differ from the ones app.run drops
+    """
+    workers = workers or ANNOTATION_WORKERS
+    shards = partition(data_provider, workers)
+    with measure("sharded.pool"), ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(run_shard, shards))
+    merge(results, data_sink)
+    if data_sink.name != "memory_sink":
+        data_sink.flush()
@@ -2,11 +2,14 @@
 Define class to output in a csv file
 """
 import csv
+import os
 import typing
-from typing import List
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+import pandas as pd
 
 from tracking_location_annotation.common.log import get_logger
-from tracking_location_annotation.models import TrackingLocation
 from tracking_location_annotation.sink.sink import Sink
 
 logger = get_logger(__name__)
@@ -31,28 +34,21 @@ HEADER = [
 ]
 
 
-def _tls_to_rows(tls: List[TrackingLocation]) -> List[List]:
-    return [
-        [
-            tl.uuid,
-            tl.user_id,
-            tl.recorded_at,
-            tl.is_moving,
-            tl.timestamp,
-            tl.battery_level,
-            tl.altitude,
-            tl.altitude_accuracy,
-            tl.longitude,
-            tl.latitude,
-            tl.speed,
-            tl.heading,
-            tl.coords_accuracy,
-            tl.activity_type,
-            tl.activity_confidence,
-            tl.waypoint_id,
-        ]
-        for tl in tls
-    ]
+def _records_to_rows(records: pd.DataFrame) -> Iterator[Tuple]:
+    """
+    datetimes are written back as timestamps instead of int64 nanoseconds,
+    float32 sensor fields are written with their float32 (shortest) representation
+    """
+    columns = []
+    for column in HEADER:
+        values = records[column]
+        if column in ("recorded_at", "timestamp"):
+            columns.append(pd.to_datetime(values).tolist())
+        elif values.dtype == np.float32:
+            columns.append(list(values.to_numpy()))
+        else:
+            columns.append(values.tolist())
+    return zip(*columns)
 
 
 # pylint: disable=consider-using-with
@@ -66,7 +62,7 @@ class CSVSink(Sink):
         self.filename: str = filename
         self.csvwriter = None
         self.fd = None
-        self.tls: List[TrackingLocation] = []
+        super().__init__()
         self.name: str = "csv_sink"
 
     def __str__(self):
@@ -81,15 +77,35 @@ class CSVSink(Sink):
         self.csvwriter.writerow(HEADER)  # type: ignore
         return self
 
+    @typing.no_type_check
+    def resume(self, offset: Optional[int]) -> bool:
+        """reopen the csv file of a previous run, dropping the rows written after offset"""
+        if offset is None or not os.path.exists(self.filename) or os.path.getsize(self.filename) < offset:
+            return False
+        logger.info("resuming filesink %s at byte %d", self.filename, offset)
+        self.fd = open(self.filename, "r+", encoding="utf-8")  # pylint: disable
+        self.fd.truncate(offset)
+        self.fd.seek(offset)
+        self.csvwriter = csv.writer(self.fd)
+        return True
+
+    @typing.no_type_check
+    def offset(self) -> Optional[int]:
+        """byte position after the flushed rows"""
+        if self.fd is None:
+            raise ValueError(f"{self.filename} is not open, connect or resume the sink first")
+        return self.fd.tell()
+
     @typing.no_type_check
     def flush(self) -> None:
         """
         functions that flushes the output to a csv file
         creates row that maps tl attributes => waypoint_id
         """
-        self.csvwriter.writerows(_tls_to_rows(self.tls))
+        if self.annotated:
+            self.csvwriter.writerows(_records_to_rows(self.records()))
         self.fd.flush()
-        self.tls.clear()
+        self.annotated.clear()
 
     @typing.no_type_check
     def close(self) -> None:
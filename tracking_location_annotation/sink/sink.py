@@ -2,11 +2,13 @@
 Define class to output in diffrent sinks
 """
 from abc import ABC, abstractmethod
-from typing import List
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
 
-from tracking_location_annotation.models import TrackingLocation
+from tracking_location_annotation.models import MISSION_STATES, TLBucket, TrackingLocation
 
 
 class Sink(ABC):
@@ -15,7 +17,7 @@ class Sink(ABC):
     """
 
     def __init__(self) -> None:
-        self.tls: List[TrackingLocation] = []
+        self.annotated: List[Tuple[pd.DataFrame, np.ndarray, np.ndarray, int]] = []
         self.name: str = "sink"
 
     @abstractmethod
@@ -25,12 +27,68 @@ class Sink(ABC):
         -> create file, connect to kafka topic, etc...
         """
 
-    def append(self, tl: TrackingLocation) -> None:
+    def append_rows(self, chunk: pd.DataFrame, rows: np.ndarray, states: np.ndarray, waypoint_id: int) -> None:
         """
-        function that takes the annotated tracking
-        location object and adds it to the result list
+        takes annotated tracking locations as row positions into a chunk of the
+        cleaned tracking locations, with their mission state codes and waypoint id,
+        the records are only built when the sink writes them
         """
-        self.tls.append(tl)
+        self.annotated.append((chunk, rows, states, waypoint_id))
+
+    def append_many(self, bucket: TLBucket, waypoint_id: int) -> None:
+        """
+        takes all the tracking locations of a bucket annotated with the waypoint, the row and
+        state arrays of the bucket are handed over without copies and the bucket is left empty
+        """
+        for chunk, rows, states in zip(*bucket.take()):
+            self.annotated.append(
+                (chunk, np.frombuffer(rows, dtype=np.int64), np.frombuffer(states, dtype=np.int16), waypoint_id)
+            )
+
+    def records(self) -> pd.DataFrame:
+        """
+        builds the records of the annotated tracking locations in the order they were
+        annotated, with one row lookup per chunk instead of one per annotation
+        """
+        if not self.annotated:
+            return pd.DataFrame(columns=["uuid", "mission_state", "waypoint_id"])
+
+        segments: Dict[int, List[int]] = defaultdict(list)
+        for index, (chunk, *_) in enumerate(self.annotated):
+            segments[id(chunk)].append(index)
+        offsets = np.cumsum([0] + [len(rows) for _, rows, _, _ in self.annotated])
+
+        frames, positions = [], []
+        for indexes in segments.values():
+            chunk = self.annotated[indexes[0]][0]
+            rows = np.concatenate([self.annotated[index][1] for index in indexes])
+            states = np.concatenate([self.annotated[index][2] for index in indexes])
+            waypoint_ids = [self.annotated[index][3] for index in indexes]
+            lengths = [len(self.annotated[index][1]) for index in indexes]
+            frames.append(
+                chunk.iloc[rows].assign(
+                    mission_state=pd.Categorical.from_codes(states, MISSION_STATES),
+                    waypoint_id=np.repeat(np.array(waypoint_ids, dtype=np.int64), lengths),
+                )
+            )
+            positions.append(np.concatenate([np.arange(offsets[index], offsets[index + 1]) for index in indexes]))
+
+        records = pd.concat(frames, ignore_index=True)
+        return records.iloc[np.argsort(np.concatenate(positions), kind="stable")].reset_index(drop=True)
+
+    @property
+    def tls(self) -> List[TrackingLocation]:
+        """
+        the annotated tracking locations not flushed yet, built as objects
+        """
+        tls = []
+        row: Any  # a row of the records, with the fields of a cleaned tracking location
+        for row in self.records().itertuples(index=False):
+            tl = TrackingLocation(row)
+            tl.mission_state = row.mission_state
+            tl.waypoint_id = row.waypoint_id
+            tls.append(tl)
+        return tls
 
     @abstractmethod
     def flush(self) -> None:
@@ -43,10 +101,22 @@ class Sink(ABC):
         releases resources acquired by the sink
         """
 
+    def offset(self) -> Optional[int]:
+        """
+        returns the position after the flushed tls, to resume from a checkpoint,
+        or none when the sink can't be resumed
+        """
+        return None
+
+    def resume(self, offset: Optional[int]) -> bool:  # pylint: disable=unused-argument
+        """
+        connects to the sink keeping what was flushed before offset,
+        returns false when it can't resume and connect must be used
+        """
+        return False
+
     def get_dataframe(self) -> pd.DataFrame:
         """
         returns result in a dataframe
         """
-        df = pd.DataFrame([tl.__dict__ for tl in self.tls])
-        df = df[["uuid", "waypoint_id"]].reset_index(drop=True)
-        return df
+        return self.records()[["uuid", "waypoint_id"]].reset_index(drop=True)
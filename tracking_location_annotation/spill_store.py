@@ -0,0 +1,147 @@
+"""
+module to define a StateStore that keeps the recently used missions and jobs
+in memory and spills the others, with their tracking locations buckets, to sqlite
+"""
+import os
+import pickle
+import sqlite3
+import tempfile
+from collections import OrderedDict
+from typing import Any, Iterator, MutableMapping, Optional, Set, cast
+
+from tracking_location_annotation.common import benchmark
+from tracking_location_annotation.common.constants import STATE_HOT_RECORDS, STATE_SPILL_DIR
+from tracking_location_annotation.common.log import get_logger
+from tracking_location_annotation.db import StateStore
+
+logger = get_logger(__name__)
+
+# share of the hot records spilled at once when there are too many
+SPILL_BATCH = 0.1
+
+
+class SpillDict(MutableMapping[int, Any]):
+    """
+    dict of records by id keeping at most max_hot records in memory, the least recently
+    used ones are pickled to a sqlite table and loaded back (and removed from the table)
+    when they are used again. only the keys of the spilled records stay in memory
+
+    every record brought in memory, set or loaded back, spills the least recently used ones
+    past max_hot, so a record returned by a get stays in memory until max_hot others are used
+    """
+
+    def __init__(self, connection: sqlite3.Connection, table: str, max_hot: int) -> None:
+        self.connection = connection
+        self.table = table
+        self.max_hot = max_hot
+        self.hot: "OrderedDict[int, Any]" = OrderedDict()
+        self.cold: Set[int] = set()
+        self.connection.execute(f"CREATE TABLE {table} (key INTEGER PRIMARY KEY, value BLOB)")
+
+    def __getitem__(self, key: int) -> Any:
+        if key in self.hot:
+            self.hot.move_to_end(key)
+            return self.hot[key]
+        if key not in self.cold:
+            raise KeyError(key)
+        value = self._load(key)
+        self._delete(key)
+        self.hot[key] = value
+        benchmark.count(f"state.{self.table}.reloaded")
+        self._make_room()
+        return value
+
+    def __setitem__(self, key: int, value: Any) -> None:
+        if key in self.cold:
+            self._delete(key)
+        self.hot[key] = value
+        self.hot.move_to_end(key)
+        self._make_room()
+
+    def __delitem__(self, key: int) -> None:
+        if key in self.hot:
+            del self.hot[key]
+        elif key in self.cold:
+            self._delete(key)
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.hot or key in self.cold
+
+    def __iter__(self) -> Iterator[int]:
+        yield from list(self.hot)
+        yield from list(self.cold)
+
+    def __len__(self) -> int:
+        return len(self.hot) + len(self.cold)
+
+    def peek(self, key: int) -> Optional[Any]:
+        "returns the record without loading it back in memory, or none"
+        if key in self.hot:
+            return self.hot[key]
+        if key in self.cold:
+            return self._load(key)
+        return None
+
+    def spill(self, count: int) -> None:
+        "pickles the count least recently used records to the table"
+        rows = []
+        for _ in range(min(count, len(self.hot))):
+            key, value = self.hot.popitem(last=False)
+            rows.append((key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)))
+            self.cold.add(key)
+        self.connection.executemany(f"INSERT INTO {self.table} VALUES (?, ?)", rows)
+        benchmark.count(f"state.{self.table}.spilled", len(rows))
+
+    def clear(self) -> None:
+        self.hot.clear()
+        self.cold.clear()
+        self.connection.execute(f"DELETE FROM {self.table}")
+
+    def _make_room(self) -> None:
+        "spills the records past max_hot, and a batch more so the next ones do not spill one by one"
+        if len(self.hot) > self.max_hot:
+            self.spill(len(self.hot) - self.max_hot + int(self.max_hot * SPILL_BATCH))
+
+    def _load(self, key: int) -> Any:
+        (value,) = self.connection.execute(f"SELECT value FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        return pickle.loads(value)
+
+    def _delete(self, key: int) -> None:
+        self.connection.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+        self.cold.discard(key)
+
+
+class SpillStateStore(StateStore):
+    """
+    state store keeping at most max_hot missions and max_hot jobs in memory,
+    the others are spilled to a temporary sqlite file in path, removed by close
+    """
+
+    def __init__(self, path: str = STATE_SPILL_DIR, max_hot: int = STATE_HOT_RECORDS, **kwargs) -> None:
+        super().__init__(**kwargs)
+        os.makedirs(path, exist_ok=True)
+        handle, self.filename = tempfile.mkstemp(prefix="state_", suffix=".sqlite", dir=path)
+        os.close(handle)
+        # the file is scratch space, nothing to recover after a crash
+        self.connection = sqlite3.connect(self.filename, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode = OFF")
+        self.connection.execute("PRAGMA synchronous = OFF")
+        self.missions = SpillDict(self.connection, "missions", max_hot)
+        self.jobs = SpillDict(self.connection, "jobs", max_hot)
+        logger.info("spilling state to %s, keeping %d missions and jobs in memory", self.filename, max_hot)
+
+    def _peek(self, records: MutableMapping[int, Any], key: int) -> Any:
+        return cast(SpillDict, records).peek(key)
+
+    def sizes(self):
+        sizes = super().sizes()
+        sizes["spilled_missions"] = len(self.missions.cold)
+        sizes["spilled_jobs"] = len(self.jobs.cold)
+        return sizes
+
+    def close(self) -> None:
+        "closes and removes the sqlite file"
+        self.connection.close()
+        os.remove(self.filename)
@@ -0,0 +1,412 @@
+"""
+module to define the streaming engine, annotating the records as they arrive from a source
+instead of reading a whole batch, with the same process functions as app.run
+
+a source yields the records as dicts with their record_type (mission, waypoint, job or tl)
+and the columns of the tables, or None when it has nothing new. the records can arrive
+out of order, they wait in a reorder buffer until the watermark passes them:
+
+- the watermark is the latest timestamp received minus the lag, so a record late by less
+  than the lag is processed in order
+- a record waiting for longer than the lag in wall time lets everything before it through,
+  so the annotations don't wait for the next records when the source is quiet
+- records arriving behind the watermark are processed right away (counted as late)
+
+the released records are cleaned like clean_data, and the store is evicted at the same
+step boundaries as get_data, so a stream in order annotates like app.run.
+
+    python -m tracking_location_annotation.streaming events.jsonl annotations.csv    # tails events.jsonl
+    nc localhost 9000 | python -m tracking_location_annotation.streaming - annotations.csv
+"""
+import heapq
+import json
+import os
+import random
+import selectors
+import sys
+import time
+from collections import defaultdict, deque
+from itertools import count
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, NamedTuple, Optional, TextIO, Tuple
+
+import numpy as np
+import pandas as pd
+
+from tracking_location_annotation.annotator import Annotator
+from tracking_location_annotation.app import process_entry
+from tracking_location_annotation.common import benchmark
+from tracking_location_annotation.common.constants import (
+    STREAMING_LATENCY_LOG_SECONDS,
+    STREAMING_LATENCY_SAMPLES,
+    STREAMING_MAX_BUFFERED,
+    STREAMING_RELEASE_INTERVAL_SECONDS,
+    STREAMING_WATERMARK_LAG_SECONDS,
+)
+from tracking_location_annotation.common.log import get_logger, update_tracers
+from tracking_location_annotation.data.data_provider import DataProvider
+from tracking_location_annotation.data.get_data_util import (
+    ID_COLUMNS,
+    STEP,
+    Entry,
+    evict_step,
+    merge_order,
+    normalize,
+    sort_by_timestamp,
+    tl_events,
+    to_nanoseconds,
+    to_nanoseconds_scalar,
+)
+from tracking_location_annotation.data.parquet_consumer import COLUMNS
+from tracking_location_annotation.db import StateStore, get_store
+from tracking_location_annotation.sink.csv_sink import CSVSink
+from tracking_location_annotation.sink.sink import Sink
+
+logger = get_logger(__name__)
+
+# records with the same timestamp are processed in the order of get_data
+RECORD_TYPES = {"mission": "missions_data", "waypoint": "waypoints_data", "job": "jobs_data", "tl": "tl_data"}
+RANKS = {record_type: rank for rank, record_type in enumerate(RECORD_TYPES)}
+# the records are not filtered by date
+START_DATE, END_DATE = np.datetime64("1970-01-01"), np.datetime64("2262-01-01")
+LATENCY_PERCENTILES = [0.5, 0.9, 0.99]
+
+
+class Event(NamedTuple):
+    "a record of the source, ordered by timestamp then record type then arrival"
+
+    timestamp: int
+    rank: int
+    sequence: int
+    record_type: str
+    fields: Dict
+    arrival: int  # monotonic nanoseconds
+
+
+def tail(path: str, poll_interval: float = 0.1, idle_timeout: Optional[float] = None) -> Iterator[Optional[str]]:
+    """
+    yields the lines of the file as they are written, and None every poll_interval seconds
+    without a new line, stops after idle_timeout seconds without a new line (never if None)
+    """
+    with open(path, encoding="utf-8") as file:
+        idle_since = time.monotonic()
+        partial = ""
+        while True:
+            line = file.readline()
+            if line.endswith("\n"):
+                idle_since = time.monotonic()
+                yield partial + line
+                partial = ""
+                continue
+            # a line being written is kept until its end arrives
+            partial += line
+            if idle_timeout is not None and time.monotonic() - idle_since > idle_timeout:
+                if partial:
+                    yield partial
+                return
+            yield None
+            time.sleep(poll_interval)
+
+
+def json_records(lines: Iterable[Optional[str]]) -> Iterator[Optional[Dict]]:
+    """
+    parses json lines (from tail, a file or a socket.makefile()) into records,
+    blank lines are skipped and None is passed through
+    """
+    for line in lines:
+        if line is None:
+            yield None
+        elif line.strip():
+            yield json.loads(line)
+
+
+def replay(data_provider: DataProvider, speed: Optional[float] = None) -> Iterator[Dict]:
+    """
+    yields the records of a batch data provider in the order of get_data, as a source
+    to try the streaming mode locally. with a speed the records are paced in real time,
+    speed times faster than their timestamps
+    """
+    frames: List[pd.DataFrame] = []
+    start, end = to_nanoseconds_scalar(data_provider.start_date), to_nanoseconds_scalar(data_provider.end_date)
+    df_missions, df_waypoints, df_jobs, tl_chunks = data_provider.stream_data()
+    tables = [df_missions, df_waypoints, df_jobs, pd.concat(list(tl_chunks), ignore_index=True)]
+    for record_type, dataframe in zip(RECORD_TYPES, tables):
+        timestamps = to_nanoseconds(dataframe["timestamp"])
+        in_window = (timestamps >= start) & ((timestamps <= end) if data_provider.end_inclusive else (timestamps < end))
+        dataframe = dataframe[in_window].assign(timestamp=timestamps[in_window], record_type=record_type)
+        frames.append(
+            sort_by_timestamp(dataframe[[column for column in dataframe if not column.startswith("Unnamed")]])
+        )
+    lines: List[Iterator[str]] = [
+        iter(str(dataframe.to_json(orient="records", lines=True, date_format="iso", date_unit="us")).splitlines())
+        for dataframe in frames
+    ]
+    ordered: List[int] = np.sort(np.concatenate([dataframe["timestamp"].to_numpy() for dataframe in frames])).tolist()
+    sources: List[int] = merge_order(*frames).tolist()
+    started = time.monotonic_ns()
+    for timestamp, source in zip(ordered, sources):
+        if speed:
+            time.sleep(max(0, (timestamp - ordered[0]) / speed - (time.monotonic_ns() - started)) / 1e9)
+        record = json.loads(next(lines[source]))
+        record["timestamp"] = timestamp
+        yield record
+
+
+class ReorderBuffer:
+    """
+    records waiting to be processed in order, released once the watermark passes them,
+    see the module docstring. lag is in nanoseconds, and when more than max_size records
+    wait the oldest are released without waiting
+    """
+
+    def __init__(self, lag: int, max_size: int = STREAMING_MAX_BUFFERED) -> None:
+        self.lag = lag
+        self.max_size = max_size
+        self.events: List[Event] = []
+        self.arrivals: Deque[Tuple[int, int]] = deque()
+        self.latest = np.iinfo(np.int64).min
+        self.forced = np.iinfo(np.int64).min
+        self.sequence = count()
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    @property
+    def watermark(self) -> int:
+        "the records up to this timestamp are released"
+        return max(self.latest - self.lag, self.forced)
+
+    def push(self, record: Dict, arrival: int) -> None:
+        "adds a record of the source received at arrival (monotonic nanoseconds)"
+        record = dict(record)
+        record_type = record.pop("record_type")
+        # records without a timestamp go first, the cleaning drops them
+        timestamp: int = pd.Timestamp(record.get("timestamp", pd.NaT)).value
+        if timestamp < self.watermark:
+            benchmark.count("streaming.late_records")
+        event = Event(timestamp, RANKS[record_type], next(self.sequence), record_type, record, arrival)
+        heapq.heappush(self.events, event)
+        self.arrivals.append((arrival, timestamp))
+        self.latest = max(self.latest, timestamp)
+
+    def release(self, now: int) -> List[Event]:
+        "returns the records passed by the watermark at now (monotonic nanoseconds), in order"
+        while self.arrivals and self.arrivals[0][0] <= now - self.lag:
+            self.forced = max(self.forced, self.arrivals.popleft()[1])
+        watermark = self.watermark
+        released = []
+        while self.events and (self.events[0].timestamp <= watermark or len(self.events) > self.max_size):
+            if self.events[0].timestamp > watermark:
+                benchmark.count("streaming.forced_releases")
+            released.append(heapq.heappop(self.events))
+        benchmark.gauge("streaming.buffered", len(self.events))
+        return released
+
+    def drain(self) -> List[Event]:
+        "returns all the records left, in order"
+        released = [heapq.heappop(self.events) for _ in range(len(self.events))]
+        self.arrivals.clear()
+        return released
+
+
+class Reservoir:
+    """
+    latencies of one record type, the count and the max are exact and the percentiles
+    are computed on a uniform sample of at most size latencies (reservoir sampling)
+    """
+
+    def __init__(self, size: int = STREAMING_LATENCY_SAMPLES, seed: int = 0) -> None:
+        self.size = size
+        self.samples: List[int] = []
+        self.count = 0
+        self.max = 0
+        self.random = random.Random(seed)
+
+    def add(self, latency: int) -> None:
+        "records a latency in nanoseconds"
+        self.count += 1
+        self.max = max(self.max, latency)
+        if len(self.samples) < self.size:
+            self.samples.append(latency)
+            return
+        position = self.random.randrange(self.count)
+        if position < self.size:
+            self.samples[position] = latency
+
+
+def clean_events(events: List[Event]) -> Iterator[Tuple[Event, Entry]]:
+    """
+    cleans the records like clean_data, one dataframe per record type, and yields them
+    in the order of the events with the event, tracking locations as events of a new chunk.
+    the records dropped by the cleaning (no id, no timestamp) are skipped
+    """
+    frames: List[pd.DataFrame] = []
+    for record_type, table in RECORD_TYPES.items():
+        positions = [position for position, event in enumerate(events) if event.record_type == record_type]
+        if not positions:
+            continue
+        fields = [events[position].fields for position in positions]
+        dataframe = pd.DataFrame(fields, columns=COLUMNS[table])
+        # ids missing from all the records would stay objects
+        dataframe = dataframe.assign(
+            **{column: pd.to_numeric(dataframe[column]) for column in ID_COLUMNS & {*dataframe}}
+        )
+        dataframe.index = pd.Index(positions)
+        dataframe = normalize(dataframe[dataframe["timestamp"].notna()], record_type, START_DATE, END_DATE)
+        if record_type == "tl":
+            chunk = dataframe.reset_index(drop=True)
+            dataframe = tl_events([(chunk, 0, len(chunk))]).set_axis(dataframe.index)
+        frames.append(dataframe)
+    if not frames:
+        return
+    event_positions: np.ndarray = np.concatenate([dataframe.index.to_numpy() for dataframe in frames])
+    sources: np.ndarray = np.repeat(np.arange(len(frames)), [len(dataframe) for dataframe in frames])
+    order = np.argsort(event_positions, kind="stable")
+    records: List[Iterator[Any]] = [iter(dataframe.itertuples(index=False)) for dataframe in frames]
+    for position, source in zip(event_positions[order].tolist(), sources[order].tolist()):
+        yield events[position], next(records[source])
+
+
+class StreamProcessor:
+    """
+    processes the released records with the process functions of app.run, evicting
+    the store at the step boundaries of get_data, and records the latency of every record:
+    from its arrival to the end of its processing, annotations flushed to the sink
+    """
+
+    def __init__(
+        self,
+        data_sink: Sink,
+        store: Optional[StateStore] = None,
+        datetime_upper_limit: int = np.iinfo(np.int64).max,
+        clock: Callable[[], int] = time.monotonic_ns,
+    ) -> None:
+        self.data_sink = data_sink
+        self.store = get_store(store)
+        self.annotator = Annotator(data_sink, self.store)
+        self.datetime_upper_limit = datetime_upper_limit
+        self.clock = clock
+        self.step: Optional[int] = None
+        self.latencies: Dict[str, Reservoir] = defaultdict(Reservoir)
+        update_tracers()
+
+    def advance(self, timestamp: int) -> None:
+        "starts the steps up to the timestamp, the steps start at the first record"
+        step = timestamp if self.step is None else self.step
+        while timestamp >= step:
+            evict_step(self.store, step)
+            step += STEP
+        self.step = step
+
+    def process(self, events: List[Event]) -> None:
+        "processes the released records in order and flushes their annotations"
+        if not events:
+            return
+        processed = []
+        for event, entry in clean_events(events):
+            self.advance(event.timestamp)
+            annotations = len(self.data_sink.annotated)
+            process_entry(entry, self.annotator, self.datetime_upper_limit, self.store)
+            processed.append((event, len(self.data_sink.annotated) > annotations))
+        if self.data_sink.name != "memory_sink":
+            self.data_sink.flush()
+        now = self.clock()
+        for event, annotated in processed:
+            self.latencies[event.record_type].add(now - event.arrival)
+            if annotated:
+                # the waypoints that wrote annotations, the latency of the annotation itself
+                self.latencies["annotation"].add(now - event.arrival)
+
+    def latency_percentiles(self) -> pd.DataFrame:
+        "returns the count and the percentiles of the latencies (in milliseconds) by record type"
+        return pd.DataFrame(
+            {
+                record_type: {
+                    "count": latencies.count,
+                    **{
+                        f"p{int(percentile * 100)}": float(np.quantile(latencies.samples, percentile)) / 1e6
+                        for percentile in LATENCY_PERCENTILES
+                    },
+                    "max": latencies.max / 1e6,
+                }
+                for record_type, latencies in self.latencies.items()
+                if latencies.count
+            }
+        ).T
+
+
+def run_streaming(
+    source: Iterable[Optional[Dict]],
+    data_sink: Sink,
+    store: Optional[StateStore] = None,
+    lag_seconds: float = STREAMING_WATERMARK_LAG_SECONDS,
+    max_buffered: int = STREAMING_MAX_BUFFERED,
+    release_interval_seconds: float = STREAMING_RELEASE_INTERVAL_SECONDS,
+    datetime_upper_limit: int = np.iinfo(np.int64).max,
+    clock: Callable[[], int] = time.monotonic_ns,
+    log_interval_seconds: float = STREAMING_LATENCY_LOG_SECONDS,
+) -> pd.DataFrame:
+    """
+    annotates the records of the source as they arrive until it's exhausted, keeping the state
+    in the store (the default store if none), see the module docstring. the released records
+    are processed together every release_interval_seconds, or whenever the source is quiet,
+    cleaning them one at a time would cost more than processing them.
+    the latency percentiles are logged every log_interval_seconds and returned at the end,
+    see StreamProcessor
+    """
+    buffer = ReorderBuffer(int(lag_seconds * 1e9), max_buffered)
+    processor = StreamProcessor(data_sink, store, datetime_upper_limit, clock)
+    release_interval, log_interval = int(release_interval_seconds * 1e9), int(log_interval_seconds * 1e9)
+    last_release = last_log = clock()
+    for record in source:
+        now = clock()
+        if record is not None:
+            buffer.push(record, now)
+            if now - last_release < release_interval and len(buffer) <= max_buffered:
+                continue
+        processor.process(buffer.release(now))
+        last_release = now
+        if now - last_log >= log_interval:
+            logger.info("latencies in milliseconds:\n%s", processor.latency_percentiles().to_string())
+            last_log = now
+    processor.process(buffer.drain())
+    latencies = processor.latency_percentiles()
+    logger.info("latencies in milliseconds:\n%s", latencies.to_string())
+    return latencies
+
+
+def read_lines(stream: TextIO, poll_interval: float = 0.1) -> Iterator[Optional[str]]:
+    """
+    yields the lines of a stream (stdin or a socket.makefile()) as a source of json_records,
+    and None every poll_interval seconds without new data so the buffered records are
+    released while the stream is quiet. the file descriptor is read directly, the stream
+    must not have been read before
+    """
+    descriptor = stream.fileno()
+    partial = b""
+    with selectors.DefaultSelector() as selector:
+        selector.register(descriptor, selectors.EVENT_READ)
+        while True:
+            if not selector.select(poll_interval):
+                yield None
+                continue
+            data = os.read(descriptor, 1 << 16)
+            if not data:
+                if partial:
+                    yield partial.decode("utf-8")
+                return
+            # a line being written is kept until its end arrives
+            *lines, partial = (partial + data).split(b"\n")
+            for line in lines:
+                yield line.decode("utf-8") + "\n"
+
+
+def main(path: str, output: str, idle_timeout: Optional[float] = None) -> None:
+    "annotates the json lines written to path (- for stdin) as they come, to the csv file output"
+    sink = CSVSink(output).connect()
+    lines = read_lines(sys.stdin) if path == "-" else tail(path, idle_timeout=idle_timeout)
+    run_streaming(json_records(lines), sink)
+    sink.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], sys.argv[2], *map(float, sys.argv[3:]))
@@ -1,14 +1,18 @@
-from unittest import mock
-
 import pytest
 
+from tracking_location_annotation.common import benchmark
+
+
+@pytest.fixture(autouse=True)
+def record_benchmarks(monkeypatch):
+    "the tests check the counters and gauges, which are only recorded when benchmarking"
+    monkeypatch.setattr(benchmark, "BENCHMARK", True)
+
 
 @pytest.fixture(autouse=True)
 def reset_db():
-    from tracking_location_annotation import app, db
+    from tracking_location_annotation import db
 
-    with mock.patch.dict(db.MISSIONS, clear=True):
-        with mock.patch.dict(db.JOBS, clear=True):
-            with mock.patch.dict(app.unmapped_jobs, clear=True):
-                with mock.patch.dict(app.unmapped_waypoints, clear=True):
-                    yield
+    db.default_store.clear()
+    yield
+    db.default_store.clear()
@@ -1,14 +1,18 @@
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Text
-from unittest import mock
 
 import numpy as np
 import pandas as pd
 import pytest
 
 from tracking_location_annotation import annotator, app, db
+from tracking_location_annotation.benchmarks.synthetic import SyntheticProvider
+from tracking_location_annotation.data import get_data_util
 from tracking_location_annotation.data.csv_consumer import CSVConsumer
-from tracking_location_annotation.models import Job, Mission, TrackingLocation, Waypoint
+from tracking_location_annotation.data.get_data_util import tl_events
+from tracking_location_annotation.data.parquet_consumer import COLUMNS
+from tracking_location_annotation.models import Job, Mission, Waypoint
 from tracking_location_annotation.sink.memory_sink import MemorySink
 
 folders = list(Path("tracking_location_annotation/tests/fixtures").glob("sample*"))
@@ -33,6 +37,30 @@ def test_scenario(scenario_dir: Text):
     sink.flush()
 
 
+def test_scenarios_with_separate_stores_run_together():
+    def run_scenario(scenario_dir: Text):
+        consumer = CSVConsumer(start_date=np.datetime64("2022-02-02"), batch_size_in_days=1, data_path=scenario_dir)
+        sink = MemorySink().connect()
+        app.run(data_provider=consumer, data_sink=sink, store=db.StateStore())
+        return [tl.uuid for tl in sink.tls]
+
+    with ThreadPoolExecutor(max_workers=len(folders)) as executor:
+        uuids = list(executor.map(run_scenario, map(str, folders)))
+
+    assert uuids == [pd.read_csv(f"{folder}/results.csv").uuid.to_list() for folder in folders]
+    assert not db.MISSIONS and not db.JOBS
+
+
+# the columns of a cleaned tracking locations chunk
+TL_COLUMNS = [*COLUMNS["tl_data"], "record_type"]
+
+
+def tl_event(**values):
+    "a tracking location event pointing to a one row chunk"
+    chunk = pd.DataFrame({column: [values.get(column)] for column in TL_COLUMNS})
+    return next(tl_events([(chunk, 0, 1)]).itertuples(index=False))
+
+
 class TestJobMissionChange:
     @pytest.fixture
     def annotator(self):
@@ -69,7 +97,7 @@ class TestJobMissionChange:
             annotator,
             2000,
         )
-        app.process_tl(TrackingLocation(row=mock.Mock(user_id=1, uuid="foo1", timestamp=1003)))
+        app.process_tl(tl_event(user_id=1, uuid="foo1", timestamp=1003))
 
         app.process_waypoint(
             Waypoint(
@@ -87,12 +115,12 @@ class TestJobMissionChange:
         )
         assert len(annotator.sink.tls) == 1
 
-        assert len(app.unmapped_jobs) == 0
+        assert len(db.unmapped_jobs) == 0
         app.process_job(
             Job(id=1, state="pending", created_at=1000, updated_at="", mission_id=2, timestamp=1005, record_type="job"),
             2000,
         )
-        assert app.unmapped_jobs[2][1].timestamp == 1005
+        assert db.unmapped_jobs[2][1].timestamp == 1005
         assert db.JOBS[1].mission_id == 2
 
     def test_job_from_mission_to_mission(self, annotator):
@@ -138,7 +166,7 @@ class TestJobMissionChange:
             annotator,
             2000,
         )
-        app.process_tl(TrackingLocation(row=mock.Mock(user_id=1, uuid="foo1", timestamp=1003)))
+        app.process_tl(tl_event(user_id=1, uuid="foo1", timestamp=1003))
 
         app.process_waypoint(
             Waypoint(
@@ -156,19 +184,19 @@ class TestJobMissionChange:
         )
         assert len(annotator.sink.tls) == 1
 
-        assert len(app.unmapped_jobs) == 0
+        assert len(db.unmapped_jobs) == 0
         app.process_job(
             Job(id=1, state="pending", created_at=1000, updated_at="", mission_id=2, timestamp=1005, record_type="job"),
             2000,
         )
-        assert len(app.unmapped_jobs) == 0
+        assert len(db.unmapped_jobs) == 0
         assert db.JOBS[1].mission_id == 2
 
     def test_job_from_unmapped_to_mission(self):
         job = Job(
             id=1, state="pending", created_at=1000, updated_at="", mission_id=10, timestamp=1001, record_type="job"
         )
-        app.unmapped_jobs[10] = {1: job}
+        db.unmapped_jobs[10] = {1: job}
 
         app.process_mission(
             Mission(
@@ -183,5 +211,25 @@ class TestJobMissionChange:
             2000,
         )
 
-        assert len(app.unmapped_jobs) == 0
+        assert len(db.unmapped_jobs) == 0
         assert db.MISSIONS[10].jobs[1] == job
+
+
+def test_bulk_tls_annotate_like_one_tl_at_a_time(monkeypatch):
+    provider = SyntheticProvider(np.datetime64("2022-02-01"), 3, couriers=10, tls_per_courier_per_day=300)
+    # the missions of the last slots cross the step boundaries
+    for dataframe in provider.frames:
+        for column in dataframe.select_dtypes("datetimetz"):
+            dataframe[column] += pd.Timedelta(hours=3)
+
+    def annotate(bulk_tls):
+        monkeypatch.setattr(get_data_util, "BULK_TLS", bulk_tls)
+        sink = MemorySink().connect()
+        app.run(provider, sink, db.StateStore())
+        records = sink.records()
+        return records.assign(mission_state=records.mission_state.astype(str))[["uuid", "mission_state", "waypoint_id"]]
+
+    bulk = annotate(True)
+
+    assert len(bulk) > 0
+    assert bulk.equals(annotate(False))
@@ -0,0 +1,137 @@
+from pathlib import Path
+from typing import Dict
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from tracking_location_annotation import app
+from tracking_location_annotation.common import benchmark
+from tracking_location_annotation.data import bigquery_consumer
+from tracking_location_annotation.data.bigquery_consumer import BqConsumer
+from tracking_location_annotation.data.query_cache import QueryCache
+from tracking_location_annotation.sink.memory_sink import MemorySink
+
+SCENARIO_DIR = "tracking_location_annotation/tests/fixtures/sample01"
+TABLE_FILES = {
+    "ae_missions": "missions_data.csv",
+    "ae_jobs": "jobs_data.csv",
+    "ae_job_pickups": "waypoints_data.csv",
+    "prod_ae_tracking_locations": "tl_data.csv",
+}
+
+
+def record_batches(path: Path, dataframe: pd.DataFrame, rows_per_batch: int) -> None:
+    "records a dataframe as an arrow ipc stream of small record batches"
+    table = pa.Table.from_pandas(dataframe, preserve_index=False)
+    with pa.OSFile(str(path), "wb") as sink, pa.ipc.new_stream(sink, table.schema) as writer:
+        for batch in table.to_batches(max_chunksize=rows_per_batch):
+            writer.write_batch(batch)
+
+
+class FakeRowIterator:
+    "replays a table the way google.cloud.bigquery.table.RowIterator returns it"
+
+    def __init__(self, dataframe: pd.DataFrame, recording: Path) -> None:
+        self.dataframe = dataframe
+        self.recording = recording
+        self.total_rows = len(dataframe)
+        self.batches_read = 0
+
+    def to_dataframe(self, **kwargs) -> pd.DataFrame:
+        return self.dataframe.copy()
+
+    def to_arrow_iterable(self, bqstorage_client, max_queue_size):
+        with pa.ipc.open_stream(pa.memory_map(str(self.recording))) as reader:
+            for batch in reader:
+                self.batches_read += 1
+                yield batch
+
+
+class FakeClient:
+    "fake bigquery client serving the csv fixtures, tracking locations replayed from recorded batches"
+
+    def __init__(self, scenario_dir: str, recording: Path) -> None:
+        self.scenario_dir = scenario_dir
+        self.recording = recording
+        self.results: Dict[str, FakeRowIterator] = {}
+        self.queries = 0
+
+    def query(self, query, job_config):
+        self.queries += 1
+        table = next(table for table in TABLE_FILES if f".{table}`" in query)
+        dataframe = pd.read_csv(f"{self.scenario_dir}/{TABLE_FILES[table]}")
+        if "updated_at" in dataframe:
+            # the core tables are filtered on updated_at like the queries
+            parameters = {parameter.name: parameter.value for parameter in job_config.query_parameters}
+            updated_at = pd.to_datetime(dataframe.updated_at, utc=True)
+            start, end = (pd.Timestamp(parameters[name]).tz_localize("UTC") for name in ("start_date", "end_date"))
+            before_end = (updated_at <= end) if "<= @end_date" in query else (updated_at < end)
+            dataframe = dataframe[(updated_at >= start) & before_end]
+        result = FakeRowIterator(dataframe, self.recording)
+        self.results[table] = result
+        return mock.Mock(result=mock.Mock(return_value=result))
+
+
+@pytest.fixture
+def fake_client(tmp_path):
+    recording = tmp_path / "tl_batches.arrow"
+    record_batches(recording, pd.read_csv(f"{SCENARIO_DIR}/tl_data.csv"), rows_per_batch=3)
+    client = FakeClient(SCENARIO_DIR, recording)
+    with mock.patch.object(bigquery_consumer, "_get_client", return_value=client):
+        with mock.patch.object(bigquery_consumer, "_get_bqstorageclient"):
+            yield client
+
+
+def test_streaming_consumer(fake_client):
+    sink = MemorySink().connect()
+    result = pd.read_csv(f"{SCENARIO_DIR}/results.csv")
+
+    app.run(data_provider=BqConsumer(np.datetime64("2022-02-02"), batch_size_in_days=1, streaming=True), data_sink=sink)
+
+    assert result.uuid.to_list() == [tl.uuid for tl in sink.tls]
+    assert sink.get_dataframe().equals(result)
+    # tracking locations were replayed batch by batch, not downloaded as a dataframe
+    assert fake_client.results["prod_ae_tracking_locations"].batches_read == 4
+
+
+def test_stream_data_without_streaming_returns_one_chunk(fake_client):
+    consumer = BqConsumer(np.datetime64("2022-02-02"), batch_size_in_days=1)
+
+    *_, tl_chunks = consumer.stream_data()
+
+    assert [len(chunk) for chunk in tl_chunks] == [12]
+
+
+def test_fetch_data_runs_the_queries_concurrently(fake_client):
+    consumer = BqConsumer(np.datetime64("2022-02-02"), batch_size_in_days=1)
+    benchmark.reset()
+
+    df_missions, df_waypoints, df_jobs, df_tl = consumer.fetch_data()
+
+    assert [len(df_missions), len(df_waypoints), len(df_jobs), len(df_tl)] == [48, 61, 59, 12]
+    assert len(fake_client.results) == 4
+    assert {"bq.get_missions", "bq.get_jobs", "bq.get_waypoints", "bq.get_tracking_locations"} <= set(benchmark.traces)
+
+
+def test_cached_consumer_only_queries_missing_days(fake_client, tmp_path):
+    result = pd.read_csv(f"{SCENARIO_DIR}/results.csv")
+    cache = QueryCache(str(tmp_path / "cache"))
+    benchmark.reset()
+
+    *_, tl_chunks = BqConsumer(np.datetime64("2022-02-02"), batch_size_in_days=1, cache=cache).stream_data()
+    list(tl_chunks)
+    queries = fake_client.queries
+    sink = MemorySink().connect()
+    app.run(
+        data_provider=BqConsumer(np.datetime64("2022-02-02"), batch_size_in_days=1, streaming=True, cache=cache),
+        data_sink=sink,
+    )
+
+    # only the records at the first instant of end_date are queried again, for the 3 core tables
+    assert fake_client.queries == queries + 3
+    assert not list((tmp_path / "cache").glob("*/*/2022-02-04.parquet"))
+    assert benchmark.counters["query_cache.prod_ae_tracking_locations.hits"] == 2
+    assert sink.get_dataframe().equals(result)
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from tracking_location_annotation import app
+from tracking_location_annotation.benchmarks.synthetic import SyntheticProvider
+from tracking_location_annotation.checkpoint import Checkpointer
+from tracking_location_annotation.db import StateStore
+from tracking_location_annotation.sink.csv_sink import CSVSink
+
+
+def provider():
+    return SyntheticProvider(np.datetime64("2022-02-01"), 3, couriers=5, tls_per_courier_per_day=200)
+
+
+class FailingCSVSink(CSVSink):
+    "fails on the second flush, after the first step was checkpointed"
+
+    flushes = 0
+
+    def flush(self) -> None:
+        self.flushes += 1
+        if self.flushes == 2:
+            raise RuntimeError("pod evicted")
+        super().flush()
+
+
+def test_a_failed_run_resumes_from_the_last_checkpoint(tmp_path):
+    expected = CSVSink(str(tmp_path / "expected.csv")).connect()
+    app.run(provider(), expected, store=StateStore())
+    expected.close()
+
+    checkpointer = Checkpointer(str(tmp_path / "batch.checkpoint"))
+    sink = checkpointer.connect(FailingCSVSink(str(tmp_path / "output.csv")))
+    with pytest.raises(RuntimeError):
+        app.run(provider(), sink, store=StateStore(), checkpointer=checkpointer)
+    sink.fd.close()
+
+    checkpointer = Checkpointer(str(tmp_path / "batch.checkpoint"))
+    assert checkpointer.checkpoint is not None
+    sink = checkpointer.connect(CSVSink(str(tmp_path / "output.csv")))
+    app.run(provider(), sink, store=StateStore(), checkpointer=checkpointer)
+    sink.close()
+    checkpointer.remove()
+
+    assert (tmp_path / "output.csv").read_text() == (tmp_path / "expected.csv").read_text()
+    assert len((tmp_path / "expected.csv").read_text().splitlines()) > 1
+    assert not (tmp_path / "batch.checkpoint").exists()
+
+
+def test_a_sink_that_cant_resume_starts_over(tmp_path):
+    checkpointer = Checkpointer(str(tmp_path / "batch.checkpoint"))
+    checkpointer.save(0, StateStore().snapshot(), sink_offset=10)
+
+    checkpointer = Checkpointer(str(tmp_path / "batch.checkpoint"))
+    sink = checkpointer.connect(CSVSink(str(tmp_path / "missing.csv")))
+
+    assert checkpointer.checkpoint is None
+    sink.close()
+    assert (tmp_path / "missing.csv").read_text().startswith("uuid,")
+
+
+def test_the_offset_of_a_csv_sink_needs_an_open_file(tmp_path):
+    sink = CSVSink(str(tmp_path / "output.csv"))
+
+    with pytest.raises(ValueError):
+        sink.offset()
+    sink.connect().flush()
+    assert sink.offset() == (tmp_path / "output.csv").stat().st_size > 0
+    sink.close()
@@ -0,0 +1,30 @@
+import numpy as np
+import pandas as pd
+
+from tracking_location_annotation.data import csv_consumer
+from tracking_location_annotation.data.csv_consumer import CSVConsumer
+
+SCENARIO_DIR = "tracking_location_annotation/tests/fixtures/sample01"
+
+
+def test_rows_outside_the_dates_are_dropped(tmp_path):
+    timestamps = pd.date_range("2022-01-30", "2022-02-06", freq="6h", tz="UTC")
+    pd.DataFrame({"id": range(len(timestamps)), "state": "pending", "timestamp": timestamps}).to_csv(
+        tmp_path / "missions_data.csv", index=False
+    )
+
+    missions = CSVConsumer(np.datetime64("2022-02-02"), 1, str(tmp_path)).read_csv("/missions_data.csv")
+
+    assert missions.timestamp.min() == pd.Timestamp("2022-02-02", tz="UTC")
+    assert missions.timestamp.max() == pd.Timestamp("2022-02-04", tz="UTC")
+
+
+def test_chunked_read_keeps_every_row(monkeypatch):
+    consumer = CSVConsumer(np.datetime64("2022-02-02"), 1, SCENARIO_DIR)
+    full = consumer.fetch_data()
+    monkeypatch.setattr(csv_consumer, "CHUNK_ROWS", 5)
+
+    chunked = consumer.fetch_data()
+
+    for dataframe, chunked_dataframe in zip(full, chunked):
+        pd.testing.assert_frame_equal(dataframe, chunked_dataframe)
@@ -0,0 +1,103 @@
+import pytest
+
+from tracking_location_annotation import db
+from tracking_location_annotation.common import benchmark
+from tracking_location_annotation.models import Job, Mission, Waypoint
+
+
+def mission(mission_id: int, courier_id: int, timestamp: int) -> Mission:
+    return Mission(
+        id=mission_id,
+        courier_id=courier_id,
+        state="in_progress",
+        created_at=0,
+        updated_at=timestamp,
+        timestamp=timestamp,
+        record_type="mission",
+    )
+
+
+def job(job_id: int, timestamp: int) -> Job:
+    return Job(
+        id=job_id,
+        state="pending",
+        created_at=0,
+        updated_at=timestamp,
+        mission_id=1,
+        timestamp=timestamp,
+        record_type="job",
+    )
+
+
+def test_evict_only_removes_records_last_stored_before_the_limit():
+    db.store_mission(mission(1, courier_id=10, timestamp=100))
+    db.store_mission(mission(2, courier_id=20, timestamp=100))
+    # stored again later, the first index entry is stale
+    db.store_mission(mission(2, courier_id=20, timestamp=300))
+    db.store_job(job(1, timestamp=100))
+    db.store_job(job(2, timestamp=300))
+
+    assert db.evict(200) == (1, 1)
+    assert list(db.MISSIONS) == [2] and list(db.JOBS) == [2]
+    assert db.sizes()["missions_by_timestamp"] == 1 and db.sizes()["jobs_by_timestamp"] == 1
+
+
+def test_evict_removes_the_courier_lookup_of_the_evicted_mission():
+    db.store_mission(mission(1, courier_id=10, timestamp=100))
+    db.store_mission(mission(2, courier_id=20, timestamp=100))
+    db.courier_id_to_mission_id.update({10: 1, 20: 3})
+
+    db.evict(200)
+
+    # courier 20 moved to mission 3, its lookup is kept
+    assert db.courier_id_to_mission_id == {20: 3}
+
+
+def waypoint(waypoint_id: int, timestamp: int) -> Waypoint:
+    return Waypoint(
+        id=waypoint_id,
+        job_id=1,
+        courier_id=None,
+        state="pending",
+        created_at=0,
+        updated_at=timestamp,
+        timestamp=timestamp,
+        record_type="waypoint",
+    )
+
+
+class TestOrphanBuffer:
+    @pytest.fixture(autouse=True)
+    def reset_counters(self):
+        benchmark.reset()
+        yield
+        benchmark.reset()
+
+    def test_records_waiting_longer_than_the_ttl_are_evicted(self):
+        orphans = db.OrphanBuffer("orphans", ttl=100, max_size=10)
+        orphans.add(1, waypoint(1, timestamp=100))
+        orphans.add(2, waypoint(2, timestamp=150))
+        # received again, it waits from the new timestamp
+        orphans.add(1, waypoint(1, timestamp=200))
+
+        assert orphans.evict(260) == 1
+        assert list(orphans) == [1] and orphans.size() == 1
+        assert benchmark.counters["db.orphans.expired"] == 1
+
+    def test_the_oldest_records_overflow(self):
+        orphans = db.OrphanBuffer("orphans", ttl=100, max_size=2)
+        for waypoint_id in range(3):
+            orphans.add(waypoint_id // 2, waypoint(waypoint_id, timestamp=waypoint_id))
+
+        assert {parent_id: list(records) for parent_id, records in orphans.items()} == {0: [1], 1: [2]}
+        assert benchmark.counters["db.orphans.overflowed"] == 1
+
+    def test_take_removes_the_records_of_the_parent(self):
+        orphans = db.OrphanBuffer("orphans", ttl=100, max_size=10)
+        orphans.add(1, waypoint(1, timestamp=100))
+        orphans.add(1, waypoint(2, timestamp=100))
+
+        assert [record.id for record in orphans.take(1)] == [1, 2]
+        assert not orphans and orphans.size() == 0
+        assert list(orphans.take(1)) == []
+        assert benchmark.counters["db.orphans.late_matched"] == 2
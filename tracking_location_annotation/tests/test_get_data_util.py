@@ -0,0 +1,305 @@
+import gc
+import threading
+import time
+import weakref
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from tracking_location_annotation import app
+from tracking_location_annotation.benchmarks.synthetic import SyntheticProvider
+from tracking_location_annotation.common import benchmark
+from tracking_location_annotation.data.csv_consumer import CSVConsumer
+from tracking_location_annotation.data import get_data_util
+from tracking_location_annotation.data.get_data_util import (
+    FrameCursor,
+    StreamCursor,
+    clean_data,
+    get_data,
+    merge_sorted,
+    prefetch,
+    sort_by_timestamp,
+    step_parts,
+    validate_ids,
+)
+from tracking_location_annotation.db import StateStore
+from tracking_location_annotation.sink.memory_sink import MemorySink
+
+SCENARIO_DIR = "tracking_location_annotation/tests/fixtures/sample02"
+
+# the records of sample02 in timestamp order, the mission and the job
+# drop_started at the same timestamp keep the order of the tables
+SAMPLE02_RECORDS = [
+    ("job", 6332297, "pending"),
+    ("waypoint", 13215730, "pending"),
+    ("waypoint", 13215731, "pending"),
+    ("mission", 4378366, "pending"),
+    ("job", 6332297, "pending"),
+    ("job", 6332297, "requested"),
+    ("mission", 4378366, "requested"),
+    ("mission", 4378366, "pending_assignment"),
+    ("mission", 4378366, "pending_assignment"),
+    ("job", 6332297, "pending_assignment"),
+    ("job", 6332297, "assigned"),
+    ("mission", 4378366, "assigned"),
+    ("waypoint", 13215730, "pending"),
+    ("waypoint", 13215731, "pending"),
+    ("mission", 4378366, "pickup_started"),
+    ("mission", 4378366, "pickup_started"),
+    ("job", 6332297, "pickup_started"),
+    ("tl", "F6855C7A-4ED5-4DCB-A7E4-B3AA3D2CBFAD"),
+    ("tl", "7E211398-8BDE-475F-AA92-9F57B9AD5284"),
+    ("job", 6332297, "pickup_arrived"),
+    ("mission", 4378366, "pickup_arrived"),
+    ("waypoint", 13215730, "arrived"),
+    ("tl", "B9D426BC-7F66-4495-A229-27FDC377BC24"),
+    ("waypoint", 13215730, "finished"),
+    ("waypoint", 13215730, "finished"),
+    ("mission", 4378366, "items_purchased"),
+    ("mission", 4378366, "items_purchased"),
+    ("job", 6332297, "items_purchased"),
+    ("tl", "2057DACD-42E9-4883-A01E-1E043BA5BF9C"),
+    ("tl", "B0012B6C-0469-40B9-8AAC-3B65510F505E"),
+    ("mission", 4378367, "drop_started"),
+    ("job", 6332297, "drop_started"),
+    ("job", 6332297, "drop_arrived"),
+    ("mission", 4378367, "drop_arrived"),
+    ("waypoint", 13215731, "arrived"),
+    ("tl", "D94DEDAB-202E-48A9-AA02-FF1F7D382CB3"),
+    ("waypoint", 13215731, "finished"),
+    ("waypoint", 13215731, "finished"),
+    ("job", 6332297, "complete"),
+    ("mission", 4378367, "complete"),
+]
+
+
+def sample02():
+    return CSVConsumer(start_date=np.datetime64("2022-02-02"), batch_size_in_days=1, data_path=SCENARIO_DIR)
+
+
+def record_key(entry):
+    return (entry.record_type, entry.id, entry.state)
+
+
+def test_merge_sorted_keeps_dataframe_order_on_ties():
+    df_a = pd.DataFrame({"timestamp": pd.to_datetime(["2022-02-02 10:00", "2022-02-02 11:00"]), "name": ["a1", "a2"]})
+    df_b = pd.DataFrame({"timestamp": pd.to_datetime(["2022-02-02 09:00", "2022-02-02 10:00"]), "name": ["b1", "b2"]})
+
+    assert [entry.name for entry in merge_sorted(df_a, df_b)] == ["b1", "a1", "b2", "a2"]
+
+
+def test_sort_by_timestamp_is_stable_and_drops_missing_timestamps():
+    df = pd.DataFrame(
+        {
+            "timestamp": pd.to_datetime(["2022-02-02 10:00", None, "2022-02-02 09:00", "2022-02-02 10:00"]),
+            "name": ["first", "missing", "early", "second"],
+        }
+    )
+
+    assert sort_by_timestamp(df).name.to_list() == ["early", "first", "second"]
+
+
+def test_validate_ids_drops_missing_ids_and_fills_foreign_keys():
+    df = pd.DataFrame({"id": [1.0, None, 0.0, 4.0], "job_id": [10.0, 20.0, 30.0, None], "state": list("abcd")})
+
+    df = validate_ids(df)
+
+    assert df.state.to_list() == ["a", "d"]
+    assert df.id.to_list() == [1, 4] and df.job_id.to_list() == [10, 0]
+    assert df.id.dtype == np.int64 and df.job_id.dtype == np.int64
+
+
+def test_clean_data_frees_the_raw_tracking_locations_once_cleaned(monkeypatch):
+    provider = SyntheticProvider(np.datetime64("2022-02-01"), 1, couriers=2, tls_per_courier_per_day=50)
+    tables = [provider.fetch_data()]
+    raw_tl = weakref.ref(tables[0][3])
+    monkeypatch.setattr(provider, "fetch_data", tables.pop)
+
+    *_, tl_chunks = clean_data(provider)
+    df_tl = next(tl_chunks)
+    gc.collect()
+
+    assert raw_tl() is None and not df_tl.empty
+
+
+def test_get_data_merges_the_records_in_timestamp_order():
+    # tracking locations come as events pointing to their row
+    records = [
+        ("tl", entry.chunk.uuid.iloc[entry.row]) if entry.record_type == "tl" else record_key(entry)
+        for entry in get_data(sample02(), bulk_tls=False)
+    ]
+    assert records == SAMPLE02_RECORDS
+
+
+def test_bulk_tls_positions_match_the_merged_order():
+    merged, tls = [], {}
+    for entry in get_data(sample02(), bulk_tls=True):
+        if entry.record_type == "tls":
+            # the tracking locations left after the last record of the previous step
+            merged += [tl for position in sorted(tls) for tl in tls[position]]
+            tls, position = {}, 0
+            for tl_position, chunk, row in zip(entry.positions, entry.chunk_indexes, entry.rows):
+                tls.setdefault(tl_position, []).append(("tl", entry.chunks[chunk].uuid.iloc[row]))
+        else:
+            # the tracking locations at position p come before the p-th record of the step
+            merged += tls.pop(position, [])
+            merged.append(record_key(entry))
+            position += 1
+    merged += [tl for position in sorted(tls) for tl in tls[position]]
+
+    assert merged == SAMPLE02_RECORDS
+
+
+def test_get_data_prefetching_steps_yields_the_same_records():
+    provider = SyntheticProvider(np.datetime64("2022-02-01"), 3, couriers=5, tls_per_courier_per_day=200)
+
+    def records(prefetch_steps):
+        return [
+            entry.chunk.uuid.iloc[entry.row] if entry.record_type == "tl" else repr(entry)
+            for entry in get_data(provider, bulk_tls=False, prefetch_steps=prefetch_steps)
+        ]
+
+    assert records(2) == records(0)
+
+
+def test_get_data_in_parts_of_a_step_yields_the_same_records():
+    provider = SyntheticProvider(np.datetime64("2022-02-01"), 3, couriers=5, tls_per_courier_per_day=200)
+
+    def records(max_step_events):
+        return [
+            entry.chunk.uuid.iloc[entry.row] if entry.record_type == "tl" else repr(entry)
+            for entry in get_data(provider, bulk_tls=False, prefetch_steps=0, max_step_events=max_step_events)
+        ]
+
+    benchmark.reset()
+    assert records(500) == records(0)
+    sizes = benchmark.gauges["data.step_records"]
+    assert len(sizes) > 3 and max(sizes) <= 500
+
+
+@pytest.mark.parametrize("bulk_tls", [True, False])
+def test_run_in_parts_of_a_step_evicts_and_ends_batches_once_per_step(bulk_tls, monkeypatch):
+    provider = SyntheticProvider(
+        np.datetime64("2022-02-01"), 3, couriers=5, tls_per_courier_per_day=200, noise=0.2, seed=1
+    )
+
+    def run(max_step_events):
+        monkeypatch.setattr(get_data_util, "BULK_TLS", bulk_tls)
+        monkeypatch.setattr(get_data_util, "STEP_MAX_EVENTS", max_step_events)
+        batch_ends = []
+
+        def get_data(*args, on_batch_end, **kwargs):
+            def end_step(step):
+                batch_ends.append(step)
+                on_batch_end(step)
+
+            return get_data_util.get_data(*args, on_batch_end=end_step, **kwargs)
+
+        monkeypatch.setattr(app, "get_data", get_data)
+        sink = MemorySink().connect()
+        app.run(provider, sink, StateStore())
+        return sink.get_dataframe(), batch_ends
+
+    expected, expected_batch_ends = run(0)
+    annotations, batch_ends = run(300)
+    assert annotations.equals(expected)
+    assert batch_ends == expected_batch_ends
+
+
+def test_step_parts_never_split_records_with_the_same_timestamp():
+    day = pd.Timestamp("2022-02-02").value
+    hour = pd.Timedelta(hours=1).value
+    timestamps = [day, day, day, day + hour, day + 2 * hour, day + 2 * hour, day + 3 * hour]
+    cursors = [
+        FrameCursor(pd.DataFrame({"timestamp": timestamps[:4]})),
+        FrameCursor(pd.DataFrame({"timestamp": timestamps[4:]})),
+    ]
+    next_day = day + 24 * hour
+
+    assert step_parts(day, next_day, cursors, 0) == [day, next_day]
+    assert step_parts(day, next_day, cursors, 7) == [day, next_day]
+    # the 3 records at midnight make a part over the limit
+    assert step_parts(day, next_day, cursors, 2) == [day, day + hour, day + 2 * hour, day + 3 * hour, next_day]
+    assert step_parts(day, next_day, cursors, 3) == [day, day + hour, day + 3 * hour, next_day]
+    # peeking the timestamps does not take the rows
+    assert len(cursors[0].take_until(next_day)) == 4
+
+
+def test_prefetch_keeps_at_most_depth_items_ahead():
+    produced = []
+
+    def items():
+        for item in range(10):
+            produced.append(item)
+            yield item
+
+    prefetched = prefetch(items(), depth=2)
+    assert next(prefetched) == 0
+    # the thread is blocked on a full queue: 2 items ready and 1 waiting for room
+    time.sleep(0.2)
+    assert produced == [0, 1, 2, 3]
+    assert list(prefetched) == list(range(1, 10))
+
+
+def test_prefetch_raises_the_errors_of_the_iterator_and_stops_when_closed():
+    def items():
+        yield 1
+        raise KeyError("broken")
+
+    prefetched = prefetch(items(), depth=1)
+    assert next(prefetched) == 1
+    with pytest.raises(KeyError):
+        next(prefetched)
+
+    prefetched = prefetch(iter(range(1000)), depth=1, name="closed")
+    assert next(prefetched) == 0
+    prefetched.close()
+    assert not any(thread.name == "closed" for thread in threading.enumerate())
+
+
+def test_frame_cursor_releases_consumed_rows_in_chunks():
+    df = pd.DataFrame({"timestamp": pd.date_range("2022-02-02", periods=10, freq="1h"), "value": range(10)})
+    cursor = FrameCursor(df, release_rows=4)
+
+    assert cursor.take_until(pd.Timestamp("2022-02-02 03:00")).value.to_list() == [0, 1, 2]
+    cursor.release()
+    assert len(cursor.dataframe) == 10  # not enough consumed rows yet
+
+    assert cursor.take_until(pd.Timestamp("2022-02-02 06:00")).value.to_list() == [3, 4, 5]
+    cursor.release()
+    assert cursor.dataframe.value.to_list() == [6, 7, 8, 9]
+
+    assert cursor.take_until(pd.Timestamp("2022-02-02 08:00")).value.to_list() == [6, 7]
+    cursor.release()
+    assert len(cursor) == 2
+    assert cursor.take_until(pd.Timestamp("2022-02-03")).value.to_list() == [8, 9]
+
+
+def test_stream_cursor_reads_chunks_only_up_to_the_step():
+    days = pd.date_range("2022-02-02", periods=4, freq="12h")
+    chunks_read = []
+
+    def chunks():
+        for i, day in enumerate(days):
+            chunks_read.append(i)
+            yield pd.DataFrame({"timestamp": [day, day + pd.Timedelta(hours=1)], "value": [2 * i, 2 * i + 1]})
+
+    cursor = StreamCursor(chunks())
+
+    assert cursor.peek() == days[0]
+    assert cursor.take_until(pd.Timestamp("2022-02-02 13:00")).value.to_list() == [0, 1, 2]
+    assert chunks_read == [0, 1]
+    assert cursor.take_until(pd.Timestamp("2022-02-04")).value.to_list() == [3, 4, 5, 6, 7]
+    assert cursor.peek() is None
+
+
+def test_stream_cursor_rejects_unordered_chunks():
+    chunks = [
+        pd.DataFrame({"timestamp": [pd.Timestamp("2022-02-02 10:00")]}),
+        pd.DataFrame({"timestamp": [pd.Timestamp("2022-02-02 09:00")]}),
+    ]
+    cursor = StreamCursor(chunks)
+
+    with pytest.raises(ValueError):
+        cursor.take_until(pd.Timestamp("2022-02-03"))
@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from tracking_location_annotation import app
+from tracking_location_annotation.benchmarks.synthetic import make_frames
+from tracking_location_annotation.data.csv_consumer import CSVConsumer
+from tracking_location_annotation.data.get_data_util import clean_data
+from tracking_location_annotation.db import StateStore
+from tracking_location_annotation.sink.memory_sink import MemorySink
+
+START_DATE = np.datetime64("2022-02-01")
+
+
+@pytest.fixture
+def data_path(tmp_path):
+    frames = make_frames(START_DATE, days=3, couriers=5, tls_per_courier_per_day=200)
+    names = ["missions_data", "waypoints_data", "jobs_data", "tl_data"]
+    for name, dataframe in zip(names, frames):
+        # the last missions of every day end after midnight
+        for column in dataframe.select_dtypes("datetimetz"):
+            dataframe[column] += pd.Timedelta(hours=3)
+        dataframe.to_csv(tmp_path / f"{name}.csv", index=False, date_format="%Y-%m-%d %H:%M:%S.%f%z")
+    return str(tmp_path)
+
+
+def daily_runs(data_path, state_dir, days=3):
+    "the annotations of every day, each day run in a new store, like in a new process"
+    daily = []
+    for day in range(days):
+        sink = MemorySink().connect()
+        consumer = CSVConsumer(START_DATE + np.timedelta64(day, "D"), 1, data_path, incremental=True)
+        app.run_incremental(consumer, sink, state_dir, store=StateStore())
+        daily.append(sink.get_dataframe())
+    return daily
+
+
+def test_daily_runs_annotate_like_one_run(data_path, tmp_path):
+    sink = MemorySink().connect()
+    app.run_incremental(CSVConsumer(START_DATE, 3, data_path, incremental=True), sink, str(tmp_path / "once"))
+    expected = sink.get_dataframe()
+
+    daily = daily_runs(data_path, str(tmp_path / "daily"))
+
+    assert sum(map(len, daily)) == len(expected) > 0
+    assert [uuid for day in daily for uuid in day.uuid] == expected.uuid.to_list()
+    assert sorted(path.name for path in (tmp_path / "daily").iterdir()) == [
+        "2022-02-02.state",
+        "2022-02-03.state",
+        "2022-02-04.state",
+    ]
+
+
+def test_a_record_at_midnight_is_read_by_the_next_day_only(data_path, tmp_path):
+    sink = MemorySink().connect()
+    app.run_incremental(CSVConsumer(START_DATE, 3, data_path, incremental=True), sink, str(tmp_path / "before"))
+    annotated = set(sink.get_dataframe().uuid)
+
+    # the annotated tracking location closest to the first midnight is moved to it
+    tls = pd.read_csv(f"{data_path}/tl_data.csv")
+    midnight = pd.Timestamp("2022-02-02", tz="UTC")
+    timestamps = pd.to_datetime(tls.timestamp, utc=True)
+    row = (timestamps - midnight).abs()[tls.uuid.isin(annotated)].idxmin()
+    tls.loc[row, "timestamp"] = "2022-02-02 00:00:00.000000+0000"
+    tls.to_csv(f"{data_path}/tl_data.csv", index=False)
+    uuid = tls.uuid[row]
+
+    read = []
+    for day in range(2):
+        *_, tl_chunks = clean_data(CSVConsumer(START_DATE + np.timedelta64(day, "D"), 1, data_path, incremental=True))
+        read.append(any((chunk.uuid == uuid).any() for chunk in tl_chunks))
+    assert read == [False, True]
+
+    sink = MemorySink().connect()
+    app.run_incremental(CSVConsumer(START_DATE, 3, data_path, incremental=True), sink, str(tmp_path / "once"))
+    uuids = [uuid for day in daily_runs(data_path, str(tmp_path / "daily")) for uuid in day.uuid]
+    assert uuids == sink.get_dataframe().uuid.to_list()
+    assert len(uuids) == len(set(uuids))
+
+
+def test_the_state_must_end_where_the_run_starts(data_path, tmp_path):
+    app.run_incremental(CSVConsumer(START_DATE, 1, data_path, incremental=True), MemorySink(), str(tmp_path))
+    (tmp_path / "2022-02-02.state").rename(tmp_path / "2022-02-03.state")
+
+    with pytest.raises(ValueError):
+        app.run_incremental(
+            CSVConsumer(START_DATE + np.timedelta64(2, "D"), 1, data_path, incremental=True),
+            MemorySink(),
+            str(tmp_path),
+        )
+    with pytest.raises(ValueError):
+        app.run_incremental(CSVConsumer(START_DATE, 1, data_path), MemorySink(), str(tmp_path))
@@ -0,0 +1,88 @@
+import logging
+
+import numpy as np
+import pytest
+
+from tracking_location_annotation import app
+from tracking_location_annotation.common import log
+from tracking_location_annotation.common.log import Tracer, update_tracers
+from tracking_location_annotation.data import get_data_util
+from tracking_location_annotation.data.csv_consumer import CSVConsumer
+from tracking_location_annotation.sink.memory_sink import MemorySink
+
+SCENARIO_DIR = "tracking_location_annotation/tests/fixtures/sample01"
+
+
+@pytest.fixture
+def debug_logs(caplog):
+    caplog.set_level(logging.DEBUG, logger="tracking_location_annotation.app")
+    yield caplog
+    caplog.set_level(logging.INFO, logger="tracking_location_annotation.app")
+    update_tracers(every=1, mission_ids=frozenset())
+
+
+def run_sample01():
+    consumer = CSVConsumer(start_date=np.datetime64("2022-02-02"), batch_size_in_days=1, data_path=SCENARIO_DIR)
+    app.run(data_provider=consumer, data_sink=MemorySink().connect())
+
+
+def process_logs(caplog):
+    return [record.getMessage() for record in caplog.records if record.name == "tracking_location_annotation.app"]
+
+
+def test_tracer_samples_one_in_every_events_or_the_events_of_the_missions():
+    logger = logging.getLogger("test_tracer")
+    logger.setLevel(logging.DEBUG)
+    tracer = Tracer(logger)
+
+    tracer.update(every=3, mission_ids=frozenset())
+    assert tracer.enabled
+    assert [tracer.sample(mission_id) for mission_id in range(7)] == [False, False, True] * 2 + [False]
+
+    tracer.update(mission_ids=frozenset({4}))
+    assert [tracer.sample(mission_id) for mission_id in (None, 3, 4)] == [False, False, True]
+
+    logger.setLevel(logging.INFO)
+    tracer.update()
+    assert not tracer.enabled
+
+
+def test_process_functions_only_log_when_debug_is_enabled(debug_logs):
+    debug_logs.set_level(logging.INFO, logger="tracking_location_annotation.app")
+    run_sample01()
+    assert not [message for message in process_logs(debug_logs) if "#" in message]
+
+    debug_logs.set_level(logging.DEBUG, logger="tracking_location_annotation.app")
+    run_sample01()
+    assert any("Mission#" in message for message in process_logs(debug_logs))
+
+
+def test_process_functions_trace_the_events_of_the_given_missions(debug_logs):
+    update_tracers(every=1, mission_ids=frozenset())
+    run_sample01()
+    every = process_logs(debug_logs)
+    debug_logs.clear()
+
+    mission_id = next(int(message.split("Mission#:")[1].split(",")[0]) for message in every if "Mission#:" in message)
+    # the run reads the level again, the sampling stays
+    update_tracers(mission_ids=frozenset({mission_id}))
+    run_sample01()
+    traced = process_logs(debug_logs)
+
+    assert 0 < len(traced) < len(every)
+    assert all(f"{mission_id}" in message for message in traced if "Mission#:" in message)
+
+
+@pytest.mark.parametrize("bulk_tls", [True, False])
+def test_the_tls_of_a_traced_mission_are_logged_with_or_without_bulk_tls(bulk_tls, debug_logs, monkeypatch):
+    monkeypatch.setattr(get_data_util, "BULK_TLS", bulk_tls)
+    update_tracers(every=1, mission_ids=frozenset({4378349}))
+    run_sample01()
+
+    assert any("TL" in message and "mission#4378349" in message for message in process_logs(debug_logs))
+
+
+def test_handlers_are_configured_once():
+    handlers = list(logging.getLogger().handlers)
+    log.get_logger("another")
+    assert logging.getLogger().handlers == handlers
@@ -1,4 +1,6 @@
-from tracking_location_annotation.models import Mission, Waypoint
+import pandas as pd
+
+from tracking_location_annotation.models import MISSION_STATES, Mission, TLBucket, Waypoint
 
 
 class TestWaypoint:
@@ -59,3 +61,35 @@ class TestWaypoint:
         )
 
         assert w.mission() is None
+
+
+class TestTLBucket:
+    def test_rows_are_grouped_by_chunk_in_arrival_order(self):
+        chunk_a, chunk_b = pd.DataFrame({"uuid": ["a0", "a1"]}), pd.DataFrame({"uuid": ["b0"]})
+        bucket = TLBucket()
+        bucket.append(chunk_a, 0, "pending")
+        bucket.append(chunk_a, 1, "in_progress")
+        bucket.append(chunk_b, 0, "in_progress")
+
+        segments = list(bucket.segments())
+
+        assert len(bucket) == 3
+        assert [(chunk is chunk_a, rows.tolist()) for chunk, rows, _ in segments] == [(True, [0, 1]), (False, [0])]
+        assert [MISSION_STATES[code] for code in segments[0][2]] == ["pending", "in_progress"]
+
+    def test_extend_and_clear_keep_list_semantics(self):
+        chunk = pd.DataFrame({"uuid": ["a0", "a1"]})
+        bucket, other = TLBucket(), TLBucket()
+        bucket.append(chunk, 0, "pending")
+        other.append(chunk, 1, "pending")
+
+        bucket.extend(other)
+        assert [rows.tolist() for _, rows, _ in bucket.segments()] == [[0, 1]]
+
+        # extending a bucket with itself doubles it, like a list
+        bucket.extend(bucket)
+        assert len(bucket) == 4
+
+        alias = bucket
+        bucket.clear()
+        assert not alias and len(other) == 1
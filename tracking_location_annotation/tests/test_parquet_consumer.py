@@ -0,0 +1,59 @@
+from pathlib import Path
+from typing import Text
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from tracking_location_annotation import app
+from tracking_location_annotation.data.csv_consumer import CSVConsumer
+from tracking_location_annotation.data.parquet_consumer import ParquetConsumer, write_table, write_tables
+from tracking_location_annotation.sink.memory_sink import MemorySink
+
+folders = list(map(str, Path("tracking_location_annotation/tests/fixtures").glob("sample*")))
+START_DATE = np.datetime64("2022-02-02")
+
+
+def convert(scenario_dir: Text, data_path: Path, file_format: str) -> None:
+    tables = ("missions_data", "waypoints_data", "jobs_data", "tl_data")
+    missions, waypoints, jobs, tls = [pd.read_csv(f"{scenario_dir}/{name}.csv") for name in tables]
+    write_tables((missions, waypoints, jobs, tls), str(data_path), file_format)
+
+
+@pytest.mark.parametrize("file_format", ["parquet", "arrow"])
+@pytest.mark.parametrize("scenario_dir", folders)
+def test_scenario(scenario_dir: Text, file_format: str, tmp_path):
+    convert(scenario_dir, tmp_path, file_format)
+    consumer = ParquetConsumer(START_DATE, batch_size_in_days=1, data_path=str(tmp_path), file_format=file_format)
+    sink = MemorySink().connect()
+    result = pd.read_csv((f"{scenario_dir}/results.csv"))
+
+    app.run(data_provider=consumer, data_sink=sink)
+
+    assert result.uuid.to_list() == [tl.uuid for tl in sink.tls]
+    assert sink.get_dataframe().equals(result)
+
+
+@pytest.mark.parametrize("file_format", ["parquet", "arrow"])
+def test_reads_the_same_records_as_csv_consumer(file_format: str, tmp_path):
+    convert(folders[0], tmp_path, file_format)
+    csv_frames = CSVConsumer(START_DATE, batch_size_in_days=1, data_path=folders[0]).fetch_data()
+
+    frames = ParquetConsumer(START_DATE, 1, data_path=str(tmp_path), file_format=file_format).fetch_data()
+
+    for csv_frame, frame in zip(csv_frames, frames):
+        key = "uuid" if "uuid" in frame else "id"
+        assert sorted(frame[key]) == sorted(csv_frame[key])
+
+
+def test_columns_are_projected_and_dates_filtered(tmp_path):
+    timestamps = pd.date_range("2022-01-30", "2022-02-06", freq="6h", tz="UTC")
+    dataframe = pd.DataFrame({"id": range(len(timestamps)), "state": "pending", "timestamp": timestamps})
+    write_table(dataframe, str(tmp_path / "missions_data.parquet"))
+
+    consumer = ParquetConsumer(START_DATE, 1, data_path=str(tmp_path), columns={"missions_data": ["id", "timestamp"]})
+    missions = consumer.read_table("missions_data")
+
+    assert missions.columns.to_list() == ["id", "timestamp"]
+    assert missions.timestamp.min() == pd.Timestamp("2022-02-02", tz="UTC")
+    assert missions.timestamp.max() == pd.Timestamp("2022-02-04", tz="UTC")
@@ -0,0 +1,156 @@
+import os
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from tracking_location_annotation.common import benchmark
+from tracking_location_annotation.data import query_cache
+from tracking_location_annotation.data.query_cache import QueryCache
+
+QUERY = "SELECT * FROM `table`"
+
+
+def days(first: str, last: str):
+    return list(np.arange(np.datetime64(first), np.datetime64(last) + np.timedelta64(1, "D")))
+
+
+class FakeFetch:
+    "returns two rows per day and remembers the fetched ranges"
+
+    def __init__(self) -> None:
+        self.calls: List[Tuple[str, str]] = []
+
+    def __call__(self, first_day, last_day) -> pd.DataFrame:
+        self.calls.append((str(first_day), str(last_day)))
+        timestamps = pd.to_datetime(np.arange(first_day, last_day + np.timedelta64(1, "D")).repeat(2), utc=True)
+        return pd.DataFrame({"id": range(len(timestamps)), "updated_at": timestamps + pd.Timedelta(hours=1)})
+
+
+@pytest.fixture(autouse=True)
+def reset_counters():
+    benchmark.reset()
+    yield
+    benchmark.reset()
+
+
+def test_only_missing_days_are_fetched(tmp_path):
+    cache = QueryCache(str(tmp_path))
+    fetch = FakeFetch()
+
+    first = cache.get(
+        table="jobs", query=QUERY, days=days("2022-02-01", "2022-02-03"), fetch=fetch, day_column="updated_at"
+    )
+    second = cache.get(
+        table="jobs", query=QUERY, days=days("2022-02-02", "2022-02-05"), fetch=fetch, day_column="updated_at"
+    )
+
+    assert fetch.calls == [("2022-02-01", "2022-02-03"), ("2022-02-04", "2022-02-05")]
+    assert len(first) == 6 and len(second) == 8
+    assert second.updated_at.dt.day.to_list() == [2, 2, 3, 3, 4, 4, 5, 5]
+    assert benchmark.counters["query_cache.jobs.misses"] == 5
+    assert benchmark.counters["query_cache.jobs.hits"] == 2
+
+
+def test_empty_days_are_cached(tmp_path):
+    cache = QueryCache(str(tmp_path))
+    fetch = FakeFetch()
+
+    def fetch_nothing(first_day, last_day):
+        return fetch(first_day, last_day).iloc[:0]
+
+    cache.get(
+        table="jobs", query=QUERY, days=days("2022-02-01", "2022-02-02"), fetch=fetch_nothing, day_column="updated_at"
+    )
+    dataframe = cache.get(
+        table="jobs", query=QUERY, days=days("2022-02-01", "2022-02-02"), fetch=fetch_nothing, day_column="updated_at"
+    )
+
+    assert len(fetch.calls) == 1
+    assert dataframe.empty
+
+
+def test_queries_are_cached_separately(tmp_path):
+    cache = QueryCache(str(tmp_path))
+    fetch = FakeFetch()
+
+    cache.get(table="jobs", query=QUERY, days=days("2022-02-01", "2022-02-01"), fetch=fetch, day_column="updated_at")
+    cache.get(
+        table="jobs",
+        query=QUERY + " LIMIT 1",
+        days=days("2022-02-01", "2022-02-01"),
+        fetch=fetch,
+        day_column="updated_at",
+    )
+
+    assert len(fetch.calls) == 2
+
+
+def test_iter_days_fetches_at_most_max_days_per_fetch(tmp_path):
+    cache = QueryCache(str(tmp_path))
+    fetch = FakeFetch()
+
+    chunks = cache.iter_days(
+        table="tls",
+        query=QUERY,
+        days=days("2022-02-01", "2022-02-03"),
+        fetch=fetch,
+        day_column="updated_at",
+        max_days_per_fetch=1,
+    )
+
+    assert [len(chunk) for chunk in chunks] == [2, 2, 2]
+    assert fetch.calls == [("2022-02-01", "2022-02-01"), ("2022-02-02", "2022-02-02"), ("2022-02-03", "2022-02-03")]
+
+
+def test_days_from_the_current_utc_day_on_are_not_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(query_cache, "utc_today", lambda: np.datetime64("2022-02-02"))
+    cache = QueryCache(str(tmp_path))
+    fetch = FakeFetch()
+
+    first = cache.get(
+        table="jobs", query=QUERY, days=days("2022-02-01", "2022-02-03"), fetch=fetch, day_column="updated_at"
+    )
+    second = cache.get(
+        table="jobs", query=QUERY, days=days("2022-02-01", "2022-02-03"), fetch=fetch, day_column="updated_at"
+    )
+
+    assert fetch.calls == [("2022-02-01", "2022-02-03"), ("2022-02-02", "2022-02-03")]
+    assert first.updated_at.dt.day.to_list() == second.updated_at.dt.day.to_list() == [1, 1, 2, 2, 3, 3]
+    assert sorted(path.name for path in tmp_path.glob("jobs/*/*")) == ["2022-02-01.parquet"]
+
+
+def test_least_recently_used_days_are_evicted(tmp_path):
+    cache = QueryCache(str(tmp_path), max_bytes=10**9)
+    fetch = FakeFetch()
+    cache.get(table="jobs", query=QUERY, days=days("2022-02-01", "2022-02-03"), fetch=fetch, day_column="updated_at")
+    # the first day was used last
+    paths = sorted(tmp_path.glob("jobs/*/*.parquet"))
+    for age, path in enumerate([paths[1], paths[2], paths[0]]):
+        os.utime(path, (age, age))
+
+    cache.max_bytes = cache.size() - paths[1].stat().st_size
+    cache.evict()
+
+    assert sorted(path.name for path in tmp_path.glob("jobs/*/*.parquet")) == [
+        "2022-02-01.parquet",
+        "2022-02-03.parquet",
+    ]
+    assert benchmark.counters["query_cache.evictions"] == 1
+
+
+def test_a_day_evicted_before_it_is_read_is_fetched_again(tmp_path):
+    cache = QueryCache(str(tmp_path))
+    fetch = FakeFetch()
+
+    chunks = cache.iter_days(
+        table="jobs", query=QUERY, days=days("2022-02-01", "2022-02-03"), fetch=fetch, day_column="updated_at"
+    )
+    first = next(chunks)
+    # another query evicts the second day between its write and its read
+    next(tmp_path.glob("jobs/*/2022-02-02.parquet")).unlink()
+
+    assert [len(first), *map(len, chunks)] == [2, 2, 2]
+    assert fetch.calls == [("2022-02-01", "2022-02-03"), ("2022-02-02", "2022-02-02")]
+    assert benchmark.counters["query_cache.jobs.misses"] == 4
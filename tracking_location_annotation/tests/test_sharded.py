@@ -0,0 +1,61 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from tracking_location_annotation import app, sharded
+from tracking_location_annotation.benchmarks.synthetic import SyntheticProvider
+from tracking_location_annotation.data.csv_consumer import CSVConsumer
+from tracking_location_annotation.db import StateStore
+from tracking_location_annotation.sink.memory_sink import MemorySink
+
+folders = list(map(str, Path("tracking_location_annotation/tests/fixtures").glob("sample*")))
+
+
+def annotate(data_provider, workers=None):
+    "returns the annotated records of a single process run, or of a sharded run with workers"
+    sink = MemorySink().connect()
+    if workers:
+        sharded.run_sharded(data_provider, sink, workers)
+    else:
+        app.run(data_provider, sink, StateStore())
+    records = sink.records()
+    return records.assign(mission_state=records.mission_state.astype(str))[["uuid", "mission_state", "waypoint_id"]]
+
+
+@pytest.mark.parametrize("scenario_dir", folders)
+@pytest.mark.parametrize("workers", [1, 3])
+def test_sharded_run_annotates_like_run(scenario_dir, workers):
+    def consumer():
+        return CSVConsumer(start_date=np.datetime64("2022-02-02"), batch_size_in_days=1, data_path=scenario_dir)
+
+    expected = annotate(consumer())
+
+    assert annotate(consumer(), workers).equals(expected)
+    assert expected.uuid.to_list() == pd.read_csv(f"{scenario_dir}/results.csv").uuid.to_list()
+
+
+def test_sharded_run_annotates_synthetic_days_like_run():
+    provider = SyntheticProvider(np.datetime64("2022-02-01"), 2, couriers=20, tls_per_courier_per_day=200)
+
+    expected = annotate(provider)
+
+    assert len(expected) > 0
+    assert annotate(provider, workers=2).equals(expected)
+
+
+def test_components_join_the_couriers_of_a_job_changing_missions():
+    missions = pd.DataFrame({"id": [1, 2, 3], "courier_id": [10, 20, 30], "timestamp": [0, 0, 0]})
+    jobs = pd.DataFrame({"id": [5, 5, 6], "mission_id": [1, 2, 0], "timestamp": [0, 1, 0]})
+    waypoints = pd.DataFrame({"job_id": [5, 6, 7], "timestamp": [0, 0, 0]})
+    tls = pd.DataFrame({"user_id": pd.array([10, 20, 30, 40, None], dtype="Int64"), "timestamp": [0] * 5})
+
+    mission_roots, waypoint_roots, job_roots, tl_roots = sharded.components(missions, waypoints, jobs, tls)
+
+    assert mission_roots[0] == mission_roots[1] == job_roots[0] == job_roots[1] == waypoint_roots[0]
+    assert mission_roots[0] == tl_roots[0] == tl_roots[1]
+    assert len({mission_roots[0], mission_roots[2], job_roots[2]}) == 3
+    assert tl_roots[2] == mission_roots[2]
+    # unknown jobs and couriers without missions are never annotated
+    assert waypoint_roots[2] == tl_roots[3] == tl_roots[4] == -1
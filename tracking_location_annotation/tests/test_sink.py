@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+from tracking_location_annotation.models import TLBucket, mission_state_code
+from tracking_location_annotation.sink.memory_sink import MemorySink
+
+
+def test_records_keep_the_annotation_order_across_chunks():
+    chunk_a = pd.DataFrame({"uuid": ["a0", "a1", "a2"]})
+    chunk_b = pd.DataFrame({"uuid": ["b0", "b1"]})
+    states = np.array([mission_state_code("in_progress")] * 2, dtype=np.int16)
+    sink = MemorySink().connect()
+
+    sink.append_rows(chunk_a, np.array([2, 0]), states, 1)
+    sink.append_rows(chunk_b, np.array([1]), states[:1], 2)
+    sink.append_rows(chunk_a, np.array([1]), states[:1], 3)
+    records = sink.records()
+
+    assert records.uuid.to_list() == ["a2", "a0", "b1", "a1"]
+    assert records.waypoint_id.to_list() == [1, 1, 2, 3]
+    assert records.mission_state.to_list() == ["in_progress"] * 4
+
+    sink.flush()
+    assert sink.get_dataframe().empty
+
+
+def test_append_many_takes_the_bucket_arrays_without_copies():
+    chunk_a = pd.DataFrame({"uuid": ["a0", "a1", "a2"]})
+    chunk_b = pd.DataFrame({"uuid": ["b0", "b1"]})
+    bucket = TLBucket()
+    for chunk, row in [(chunk_a, 2), (chunk_a, 0), (chunk_b, 1)]:
+        bucket.append(chunk, row, "in_progress")
+    rows = bucket.rows[0]
+    sink = MemorySink().connect()
+
+    sink.append_many(bucket, 7)
+
+    assert not bucket and len(bucket) == 0
+    assert np.shares_memory(sink.annotated[0][1], np.frombuffer(rows, dtype=np.int64))
+    records = sink.records()
+    assert records.uuid.to_list() == ["a2", "a0", "b1"]
+    assert records.waypoint_id.to_list() == [7, 7, 7]
+    assert records.mission_state.to_list() == ["in_progress"] * 3
+
+    # the bucket starts new arrays, the ones handed over are left as they are
+    bucket.append(chunk_a, 1, "pending")
+    assert sink.records().uuid.to_list() == ["a2", "a0", "b1"]
@@ -0,0 +1,77 @@
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from tracking_location_annotation import app
+from tracking_location_annotation.common import benchmark
+from tracking_location_annotation.data.csv_consumer import CSVConsumer
+from tracking_location_annotation.models import Mission
+from tracking_location_annotation.sink.memory_sink import MemorySink
+from tracking_location_annotation.spill_store import SpillDict, SpillStateStore
+
+folders = sorted(Path("tracking_location_annotation/tests/fixtures").glob("sample*"))
+
+
+@pytest.fixture(autouse=True)
+def reset_counters():
+    benchmark.reset()
+    yield
+    benchmark.reset()
+
+
+def mission(mission_id: int) -> Mission:
+    return Mission(mission_id, 1, "in_progress", 0, 0, 0, "mission")
+
+
+def test_least_recently_used_records_are_spilled_and_reloaded():
+    records = SpillDict(sqlite3.connect(":memory:"), "missions", max_hot=2)
+    records[1], records[2] = mission(1), mission(2)
+    records[1].tls_bucket.append(pd.DataFrame({"uuid": ["a0", "a1"]}), 1, "in_progress")
+    records[3] = mission(3)
+
+    assert list(records.hot) == [1, 3] and records.cold == {2}
+    assert records.peek(2).id == 2 and 2 in records.cold
+    # loading a record back spills the least recently used one
+    assert records[2].id == 2
+    assert list(records.hot) == [3, 2] and records.cold == {1}
+    records[4] = mission(4)
+
+    # mission 1 was spilled with its bucket, as the rows it points to
+    assert records.cold == {1, 3}
+    (chunk, rows, _), *_ = records[1].tls_bucket.segments()
+    assert chunk.uuid.iloc[rows].to_list() == ["a1"]
+    del records[3]
+    assert sorted(records) == [1, 2, 4] and len(records) == 3
+    assert benchmark.counters["state.missions.spilled"] == 4
+    assert benchmark.counters["state.missions.reloaded"] == 2
+
+
+def test_reloaded_records_spill_the_others_past_max_hot():
+    records = SpillDict(sqlite3.connect(":memory:"), "missions", max_hot=10)
+    for mission_id in range(100):
+        records[mission_id] = mission(mission_id)
+    assert len(records.hot) <= 10
+
+    for mission_id in sorted(records.cold):
+        assert records[mission_id].id == mission_id
+        assert len(records.hot) <= 10
+    records[100] = mission(100)
+
+    assert len(records.hot) <= 10 and len(records) == 101
+    assert records[99].id == 99
+
+
+@pytest.mark.parametrize("scenario_dir", list(map(str, folders)))
+def test_scenario_with_one_record_in_memory(scenario_dir, tmp_path):
+    consumer = CSVConsumer(start_date=np.datetime64("2022-02-02"), batch_size_in_days=1, data_path=scenario_dir)
+    sink = MemorySink().connect()
+    store = SpillStateStore(str(tmp_path), max_hot=1)
+
+    app.run(data_provider=consumer, data_sink=sink, store=store)
+    store.close()
+
+    assert sink.get_dataframe().equals(pd.read_csv(f"{scenario_dir}/results.csv"))
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,135 @@
+import json
+import os
+import random
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from tracking_location_annotation import app, streaming
+from tracking_location_annotation.common import benchmark
+from tracking_location_annotation.data.csv_consumer import CSVConsumer
+from tracking_location_annotation.db import StateStore
+from tracking_location_annotation.sink.memory_sink import MemorySink
+
+folders = [
+    *map(str, Path("tracking_location_annotation/tests/fixtures").glob("sample*")),
+    *map(str, Path("tracking_location_annotation/tests/business_scenarios").glob("*")),
+]
+SECOND = 10**9
+
+
+def json_lines(data_provider, disorder_seconds=0, seed=0):
+    "the records of the data provider as json lines, every timestamp arriving up to disorder_seconds late"
+    generator = random.Random(seed)
+    delays = {}
+    arrivals = []
+    for position, record in enumerate(streaming.replay(data_provider)):
+        # records with the same timestamp stay together
+        delay = delays.setdefault(record["timestamp"], generator.uniform(0, disorder_seconds) * SECOND)
+        arrivals.append((record["timestamp"] + delay, position, json.dumps(record)))
+    return [line for _, _, line in sorted(arrivals)]
+
+
+def annotations(sink):
+    records = sink.records()
+    return records.assign(mission_state=records.mission_state.astype(str))[["uuid", "mission_state", "waypoint_id"]]
+
+
+@pytest.mark.parametrize("scenario_dir", folders)
+@pytest.mark.parametrize("disorder_seconds", [0, 60])
+def test_streaming_annotates_like_run_once_in_order(scenario_dir, disorder_seconds):
+    def consumer():
+        return CSVConsumer(start_date=np.datetime64("2022-02-02"), batch_size_in_days=1, data_path=scenario_dir)
+
+    expected = MemorySink().connect()
+    app.run(consumer(), expected, StateStore())
+    sink = MemorySink().connect()
+
+    latencies = streaming.run_streaming(
+        streaming.json_records(json_lines(consumer(), disorder_seconds)),
+        sink,
+        StateStore(),
+        lag_seconds=disorder_seconds,
+        datetime_upper_limit=app.get_datetime_upper_limit(consumer()),
+        # the records arrive at once, the lag is only waited in event time
+        clock=lambda: 0,
+    )
+
+    assert annotations(sink).equals(annotations(expected))
+    assert latencies.loc["tl", "count"] > 0
+
+
+def test_reorder_buffer_releases_the_records_passed_by_the_watermark_in_order():
+    buffer = streaming.ReorderBuffer(lag=10 * SECOND, max_size=3)
+    benchmark.reset()
+
+    for seconds, record_type in [(5, "tl"), (0, "tl"), (5, "mission")]:
+        buffer.push({"record_type": record_type, "timestamp": seconds * SECOND}, arrival=0)
+    assert buffer.release(now=0) == []
+
+    buffer.push({"record_type": "waypoint", "timestamp": 15 * SECOND}, arrival=0)
+    released = buffer.release(now=0)
+    assert [(event.timestamp // SECOND, event.record_type) for event in released] == [
+        (0, "tl"),
+        (5, "mission"),
+        (5, "tl"),
+    ]
+
+    # late by more than the lag, released right away
+    buffer.push({"record_type": "job", "timestamp": 1 * SECOND}, arrival=0)
+    assert [event.record_type for event in buffer.release(now=0)] == ["job"]
+    assert benchmark.counters["streaming.late_records"] == 1
+
+
+def test_reorder_buffer_releases_the_records_waiting_for_the_lag_or_over_its_size():
+    buffer = streaming.ReorderBuffer(lag=10 * SECOND, max_size=2)
+
+    buffer.push({"record_type": "tl", "timestamp": 100 * SECOND}, arrival=0)
+    buffer.push({"record_type": "tl", "timestamp": 90 * SECOND}, arrival=5 * SECOND)
+    # quiet source, the first record waited for the lag and lets the one before it through
+    assert [event.timestamp // SECOND for event in buffer.release(now=10 * SECOND)] == [90, 100]
+
+    for seconds in (200, 201, 202):
+        buffer.push({"record_type": "tl", "timestamp": seconds * SECOND}, arrival=11 * SECOND)
+    assert [event.timestamp // SECOND for event in buffer.release(now=11 * SECOND)] == [200]
+    assert [event.timestamp // SECOND for event in buffer.drain()] == [201, 202]
+
+
+def test_tail_follows_the_lines_written_to_the_file(tmp_path):
+    path = tmp_path / "events.jsonl"
+    path.write_text('{"record_type": "tl"}\n{"record_type"')
+    lines = streaming.tail(str(path), poll_interval=0.01, idle_timeout=1)
+
+    assert next(lines) == '{"record_type": "tl"}\n'
+    # the second line is not complete yet
+    assert next(lines) is None
+    with open(path, "a", encoding="utf-8") as file:
+        file.write(': "job"}\n')
+    assert [line for line in lines if line is not None] == ['{"record_type": "job"}\n']
+
+
+def test_read_lines_yields_none_while_the_stream_is_quiet():
+    read_fd, write_fd = os.pipe()
+    with os.fdopen(read_fd, encoding="utf-8") as stream:
+        lines = streaming.read_lines(stream, poll_interval=0.01)
+        with os.fdopen(write_fd, "w", encoding="utf-8") as writer:
+            writer.write('{"record_type": "tl"}\n{"record_type"')
+            writer.flush()
+
+            assert next(lines) == '{"record_type": "tl"}\n'
+            # the second line is not complete yet, the stream doesn't block
+            assert next(lines) is None
+            writer.write(': "job"}\n')
+        assert [line for line in lines if line is not None] == ['{"record_type": "job"}\n']
+
+
+def test_reservoir_keeps_at_most_size_latencies():
+    reservoir = streaming.Reservoir(size=100)
+    for latency in range(10_000):
+        reservoir.add(latency)
+
+    assert len(reservoir.samples) == 100
+    assert (reservoir.count, reservoir.max) == (10_000, 9_999)
+    # a uniform sample, not the first latencies
+    assert 3_000 < np.median(reservoir.samples) < 7_000
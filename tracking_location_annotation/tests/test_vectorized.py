@@ -0,0 +1,64 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from tracking_location_annotation import app, vectorized
+from tracking_location_annotation.benchmarks.synthetic import SyntheticProvider
+from tracking_location_annotation.data.csv_consumer import CSVConsumer
+from tracking_location_annotation.db import StateStore
+from tracking_location_annotation.sink.memory_sink import MemorySink
+
+folders = [
+    *map(str, Path("tracking_location_annotation/tests/fixtures").glob("sample*")),
+    *map(str, Path("tracking_location_annotation/tests/business_scenarios").glob("*")),
+]
+
+
+def annotate(data_provider, engine):
+    "returns the annotated tracking locations of the engine, as written to the sink"
+    sink = MemorySink().connect()
+    if engine == "vectorized":
+        vectorized.run_vectorized(data_provider, sink)
+    else:
+        app.run(data_provider, sink, StateStore())
+    return sink.get_dataframe()
+
+
+@pytest.mark.parametrize("scenario_dir", folders)
+def test_vectorized_run_annotates_like_run(scenario_dir):
+    def consumer():
+        return CSVConsumer(start_date=np.datetime64("2022-02-02"), batch_size_in_days=1, data_path=scenario_dir)
+
+    expected = annotate(consumer(), "streaming")
+
+    assert annotate(consumer(), "vectorized").equals(expected)
+    assert expected.uuid.to_list() == pd.read_csv(f"{scenario_dir}/results.csv").uuid.to_list()
+
+
+@pytest.mark.parametrize("seed", range(4))
+@pytest.mark.parametrize("noise", [0, 0.2])
+def test_vectorized_run_annotates_noisy_synthetic_days_like_run(seed, noise):
+    # moved jobs, waypoints received again or out of order, evicted missions received again...
+    provider = SyntheticProvider(
+        np.datetime64("2022-02-01"), 3, couriers=10, tls_per_courier_per_day=300, noise=noise, seed=seed
+    )
+
+    expected = annotate(provider, "streaming")
+
+    assert len(expected) > 0
+    assert annotate(provider, "vectorized").equals(expected)
+
+
+def test_records_start_a_new_incarnation_after_the_eviction():
+    step = vectorized.STEP
+    delay = vectorized.EVICTION_DELAY
+    ids = np.array([2, 1, 1, 1, 2])
+    timestamps = np.array([0, 0, step - 1, 3 * step, step - 1])
+
+    table = vectorized.records(ids, np.arange(5), timestamps, 0, delay)
+
+    assert table.ids.tolist() == [1, 1, 1, 2, 2]
+    # the third record of mission 1 comes after the step its last record was evicted in
+    assert table.incarnations.tolist() == [0, 0, 1, 2, 2]
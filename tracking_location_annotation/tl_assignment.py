@@ -0,0 +1,93 @@
+"""
+module to assign the tracking locations of a step to their mission in bulk
+
+a tracking location goes to the mission of its courier (courier_id_to_mission_id)
+with the state of that mission when it arrives. within a step these only change
+when missions are processed, so the courier -> mission and mission -> state intervals
+are built from the mission records of the step and the state of the store at the start
+of the step, and joined with the tracking locations positions using searchsorted
+"""
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+from tracking_location_annotation.common.benchmark import measure
+from tracking_location_annotation.data.get_data_util import TLStep
+from tracking_location_annotation.db import StateStore
+from tracking_location_annotation.models import mission_state_code
+
+# mission states that don't put the courier in shift, see Mission.is_done
+DONE_STATES = ["complete", "cancelled"]
+# code of the missing mission state until it's registered
+MISSING_STATE = -2
+
+
+def last_before(keys: np.ndarray, positions: np.ndarray, tl_keys: np.ndarray, tl_positions: np.ndarray) -> np.ndarray:
+    """
+    returns, for every tracking location, the index of the last event with the same key
+    strictly before its position, or -1. the events are sorted by key then position
+    """
+    # a tracking location at position p comes after the events at positions < p
+    multiplier = max(int(positions.max(initial=0)), int(tl_positions.max(initial=0))) + 1
+    indexes = np.searchsorted(keys * multiplier + positions, tl_keys * multiplier + tl_positions, side="left") - 1
+    found = indexes >= 0
+    found[found] = keys[indexes[found]] == tl_keys[found]
+    return np.where(found, indexes, -1)
+
+
+def dense_ranks(*arrays: np.ndarray) -> Tuple[np.ndarray, ...]:
+    "returns the values replaced by their rank among all the values, so they can be combined with positions"
+    # hashing the values is faster than sorting them all, there are few distinct ones
+    values = np.sort(pd.unique(np.concatenate(arrays)))
+    return (values, *(values.searchsorted(array) for array in arrays))
+
+
+@measure("tl_assignment.assign_missions")
+def assign_missions(tl_step: TLStep, store: StateStore, datetime_upper_limit: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    returns the mission id (0 for none) and the mission state code of every tracking location
+    of the step, like process_tl would find them when the tracking location is processed.
+    the store must be in its state at the start of the step
+    """
+    missions = tl_step.missions
+    # missions created after the end date are not processed
+    processed = missions["created_at"].to_numpy() <= datetime_upper_limit
+    mission_ids = missions["id"].to_numpy()[processed]
+    couriers = missions["courier_id"].to_numpy()[processed]
+    # the states as mission state codes, the missing state is only registered if a tracking location gets it
+    categories = missions["state"].cat.categories
+    state_codes = np.array([*map(mission_state_code, categories), MISSING_STATE], dtype=np.int16)
+    category_codes = missions["state"].cat.codes.to_numpy()[processed]
+    states = state_codes[category_codes]
+    done = np.append(categories.isin(DONE_STATES), False)[category_codes]
+    positions = tl_step.mission_positions[processed]
+
+    # courier -> mission, set by the missions in progress with a courier
+    setters = (couriers != 0) & ~done
+    courier_values, setter_couriers, tl_couriers = dense_ranks(couriers[setters], tl_step.couriers)
+    order = np.lexsort((positions[setters], setter_couriers))
+    setter = last_before(setter_couriers[order], positions[setters][order], tl_couriers, tl_step.positions)
+    start_missions = np.array(
+        [store.courier_id_to_mission_id.get(courier, 0) for courier in courier_values.tolist()], dtype=np.int64
+    )
+    tl_missions = start_missions[tl_couriers]
+    tl_missions[setter >= 0] = mission_ids[setters][order][setter[setter >= 0]]
+
+    # mission -> state, set by every mission record
+    mission_values, event_missions, tl_mission_ranks = dense_ranks(mission_ids, tl_missions)
+    order = np.lexsort((positions, event_missions))
+    event = last_before(event_missions[order], positions[order], tl_mission_ranks, tl_step.positions)
+    # -1 for the missions not in the store yet, they don't get tracking locations
+    start_states = np.array(
+        [
+            mission_state_code(mission.state) if mission_id and (mission := store.missions.get(mission_id)) else -1
+            for mission_id in mission_values.tolist()
+        ],
+        dtype=np.int16,
+    )
+    codes = start_states[tl_mission_ranks]
+    codes[event >= 0] = states[order][event[event >= 0]]
+    if (missing := codes == MISSING_STATE).any():
+        codes[missing] = mission_state_code(np.nan)
+    return np.where(codes >= 0, tl_missions, 0), codes
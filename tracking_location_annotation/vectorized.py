@@ -0,0 +1,382 @@
+"""
+module to define the vectorized engine, annotating a whole batch at once with numpy
+instead of processing the records one at a time, for backfills
+
+the tracking locations of a mission wait in its bucket until a waypoint writes them
+or something clears the bucket, so every tracking location is annotated by the first
+bucket event of its mission after it, if that event is a write. the bucket events are
+found from the records with the rules of process_job, process_waypoint and the annotator:
+
+- a mission lives from a record until it's evicted (see get_data_util), a mission evicted
+  and received again is a new incarnation with a new bucket, and the same goes for jobs
+- a job changing missions clears the buckets of both missions, and until the new mission
+  is received again its intermediate bucket is its bucket (see process_job), so the next
+  waypoint changing state clears it before the annotation
+- a waypoint received again out of order clears the bucket (see process_waypoint)
+- a waypoint changing state writes or clears the bucket (see Annotator.annotate)
+
+records are positioned in the merged order of get_data, and a tracking location at position p
+comes before the p-th mission, job or waypoint. the orphans buffers are followed for their ttl
+but not their max size
+"""
+from typing import NamedTuple, Tuple
+
+import numpy as np
+import pandas as pd
+
+from tracking_location_annotation.app import get_datetime_upper_limit
+from tracking_location_annotation.common.benchmark import measure
+from tracking_location_annotation.common.log import get_logger
+from tracking_location_annotation.data.data_provider import DataProvider
+from tracking_location_annotation.data.get_data_util import EVICTION_DELAY, STEP, clean_data, merge_order
+from tracking_location_annotation.db import ORPHAN_TTL
+from tracking_location_annotation.models import mission_state_code
+from tracking_location_annotation.sink.sink import Sink
+from tracking_location_annotation.tl_assignment import DONE_STATES, dense_ranks, last_before
+
+logger = get_logger(__name__)
+
+ALLOWED_CHANGES = {("pending", "arrived"), ("pending", "finished"), ("arrived", "finished")}
+# a done mission only lets a waypoint arriving this close to its last update write its bucket
+TIME_LIMIT_MINUTES = 10
+NONE, CLEAR, WRITE = 0, 1, 2
+
+
+class Records(NamedTuple):
+    """
+    the processed records of one type sorted by id then position, with the incarnation
+    of every record: records of the same id stay in the same incarnation until evicted
+    """
+
+    ids: np.ndarray
+    positions: np.ndarray
+    timestamps: np.ndarray
+    incarnations: np.ndarray
+    rows: np.ndarray  # the rows of the records in the dataframe
+
+
+class Batch(NamedTuple):
+    "the cleaned records of the batch and the steps grid they would be processed with"
+
+    missions: pd.DataFrame
+    waypoints: pd.DataFrame
+    jobs: pd.DataFrame
+    tls: pd.DataFrame
+    mission_positions: np.ndarray
+    waypoint_positions: np.ndarray
+    job_positions: np.ndarray
+    tl_positions: np.ndarray
+    first_step: int
+
+
+def step_start(timestamps: np.ndarray, first_step: int) -> np.ndarray:
+    "returns the start of the step of every timestamp, the evictions happen there"
+    return first_step + (timestamps - first_step) // STEP * STEP
+
+
+@measure("vectorized.load")
+def load(data_provider: DataProvider) -> Batch:
+    """cleans the data of the provider and positions all the records in the merged order of get_data"""
+    df_missions, df_waypoints, df_jobs, tl_chunks = clean_data(data_provider)
+    chunks = list(tl_chunks)
+    df_tl = pd.concat(chunks, ignore_index=True) if len(chunks) != 1 else chunks[0]
+    frames = (df_missions, df_waypoints, df_jobs)
+    order = merge_order(*frames)
+    timestamps = np.sort(np.concatenate([df.timestamp.to_numpy(dtype=np.int64) for df in frames]))
+    first_timestamps = [df.timestamp.iloc[0] for df in (*frames, df_tl) if len(df)]
+    return Batch(
+        missions=df_missions,
+        waypoints=df_waypoints,
+        jobs=df_jobs,
+        tls=df_tl,
+        mission_positions=np.flatnonzero(order == 0),
+        waypoint_positions=np.flatnonzero(order == 1),
+        job_positions=np.flatnonzero(order == 2),
+        tl_positions=timestamps.searchsorted(df_tl.timestamp.to_numpy(dtype=np.int64), side="right"),
+        first_step=int(min(first_timestamps, default=0)),
+    )
+
+
+def records(ids: np.ndarray, positions: np.ndarray, timestamps: np.ndarray, first_step: int, delay: int) -> Records:
+    """
+    sorts the records by id and position and numbers their incarnations, a record starts a new one
+    when the previous record of the same id was evicted: it's older than delay at the start of a step
+    """
+    rows = np.lexsort((positions, ids))
+    ids, positions, timestamps = ids[rows], positions[rows], timestamps[rows]
+    new = np.ones(len(ids), dtype=bool)
+    new[1:] = (ids[1:] != ids[:-1]) | (step_start(timestamps[1:], first_step) > timestamps[:-1] + delay)
+    return Records(ids, positions, timestamps, np.cumsum(new) - 1, rows)
+
+
+def lookup(
+    table: Records, ids: np.ndarray, positions: np.ndarray, timestamps: np.ndarray, first_step: int, delay: int
+) -> np.ndarray:
+    """
+    returns the index in the table of the last record of every id before the position,
+    -1 when there is none or it was evicted before the timestamp
+    """
+    _, table_ranks, ranks = dense_ranks(table.ids, ids)
+    indexes = last_before(table_ranks, table.positions, ranks, positions)
+    found = indexes >= 0
+    found[found] = step_start(timestamps[found], first_step) <= table.timestamps[indexes[found]] + delay
+    return np.where(found, indexes, -1)
+
+
+def next_record(table: Records, ids: np.ndarray, positions: np.ndarray) -> np.ndarray:
+    "returns the index in the table of the first record of every id after the position, or -1"
+    _, table_ranks, ranks = dense_ranks(table.ids, ids)
+    multiplier = max(int(table.positions.max(initial=0)), int(positions.max(initial=0))) + 1
+    indexes = np.searchsorted(table_ranks * multiplier + table.positions, ranks * multiplier + positions, side="right")
+    found = indexes < len(table.ids)
+    found[found] = table_ranks[indexes[found]] == ranks[found]
+    return np.where(found, indexes, -1)
+
+
+def take(values: np.ndarray, indexes: np.ndarray, default) -> np.ndarray:
+    "returns the values at the indexes, default where the index is -1"
+    result = np.full(len(indexes), default, dtype=values.dtype)
+    result[indexes >= 0] = values[indexes[indexes >= 0]]
+    return result
+
+
+def processed(
+    dataframe: pd.DataFrame, positions: np.ndarray, datetime_upper_limit: int
+) -> Tuple[pd.DataFrame, np.ndarray]:
+    "returns the records created before the end date, the others are not processed, with their positions"
+    mask = dataframe["created_at"].to_numpy() <= datetime_upper_limit
+    return dataframe[mask].reset_index(drop=True), positions[mask]
+
+
+def states(dataframe: pd.DataFrame) -> np.ndarray:
+    "returns the states as an object array, the missing states are nan"
+    return dataframe["state"].to_numpy(dtype=object)
+
+
+class Events(NamedTuple):
+    "bucket events, by mission incarnation"
+
+    incarnations: np.ndarray
+    positions: np.ndarray
+    kinds: np.ndarray
+    waypoint_ids: np.ndarray
+
+
+# pylint: disable=too-many-locals, too-many-statements
+@measure("vectorized.bucket_events")
+def bucket_events(batch: Batch, missions: Records, mission_frame: pd.DataFrame, datetime_upper_limit: int) -> Events:
+    """
+    returns the writes and the clears of the buckets done by the jobs and the waypoints,
+    with the waypoint of the writes, sorted by mission incarnation and position
+    """
+    first_step = batch.first_step
+    mission_states = states(mission_frame)[missions.rows]
+
+    df_jobs, job_positions = processed(batch.jobs, batch.job_positions, datetime_upper_limit)
+    job_timestamps = df_jobs["timestamp"].to_numpy()
+    jobs = records(df_jobs["id"].to_numpy(), job_positions, job_timestamps, first_step, EVICTION_DELAY)
+    job_missions = df_jobs["mission_id"].to_numpy()
+
+    # a job changing missions clears both buckets and makes the bucket of the new mission its intermediate bucket
+    old_jobs = lookup(jobs, df_jobs["id"].to_numpy(), job_positions, job_timestamps, first_step, EVICTION_DELAY)
+    old_missions = take(job_missions[jobs.rows], old_jobs, 0)
+    changes = (old_jobs >= 0) & (old_missions != job_missions)
+    change_positions, change_timestamps = job_positions[changes], job_timestamps[changes]
+    old_mission_records = lookup(
+        missions, old_missions[changes], change_positions, change_timestamps, first_step, EVICTION_DELAY
+    )
+    new_mission_records = lookup(
+        missions, job_missions[changes], change_positions, change_timestamps, first_step, EVICTION_DELAY
+    )
+    job_clears = [
+        (missions.incarnations[records_[records_ >= 0]], change_positions[records_ >= 0])
+        for records_ in (old_mission_records, new_mission_records)
+    ]
+    alias_incarnations = missions.incarnations[new_mission_records[new_mission_records >= 0]]
+    alias_positions = change_positions[new_mission_records >= 0]
+    order = np.lexsort((alias_positions, alias_incarnations))
+    alias_incarnations, alias_positions = alias_incarnations[order], alias_positions[order]
+
+    # waypoints -> job -> mission
+    df_waypoints, positions = processed(batch.waypoints, batch.waypoint_positions, datetime_upper_limit)
+    waypoint_ids, timestamps = df_waypoints["id"].to_numpy(), df_waypoints["timestamp"].to_numpy()
+    waypoint_states = states(df_waypoints)
+    waypoint_jobs = df_waypoints["job_id"].to_numpy()
+    job_records = lookup(jobs, waypoint_jobs, positions, timestamps, first_step, EVICTION_DELAY)
+    job_incarnations = take(jobs.incarnations, job_records, -1)
+    mission_records = lookup(
+        missions, take(job_missions[jobs.rows], job_records, 0), positions, timestamps, first_step, EVICTION_DELAY
+    )
+    has_mission = mission_records >= 0
+    incarnations = take(missions.incarnations, mission_records, -1)
+
+    # out of order: a waypoint seen before in the mission while another one was seen last
+    # (the processing order only gets the first non pending record of every waypoint)
+    ordered = has_mission & (waypoint_states != "pending")
+    candidates = np.flatnonzero(ordered)
+    frame = pd.DataFrame({"incarnation": incarnations[candidates], "id": waypoint_ids[candidates]})
+    first = ~frame.duplicated(["incarnation", "id"]).to_numpy()
+    last_new = frame["id"].where(first).groupby(frame["incarnation"]).ffill().to_numpy()
+    out_of_order = np.zeros(len(df_waypoints), dtype=bool)
+    out_of_order[candidates] = ~first & (last_new != frame["id"].to_numpy())
+
+    # the old waypoint is the previous record of the waypoint in the job, if it reached the job:
+    # added while the job was alive, or buffered and taken by the job within the orphan ttl
+    group = np.lexsort((positions, waypoint_jobs, waypoint_ids))
+    previous = np.full(len(df_waypoints), -1)
+    same = (waypoint_ids[group][1:] == waypoint_ids[group][:-1]) & (
+        waypoint_jobs[group][1:] == waypoint_jobs[group][:-1]
+    )
+    previous[group[1:][same]] = group[:-1][same]
+    has_previous = previous >= 0
+    previous_incarnations = take(job_incarnations, previous, -2)
+    added = has_previous & (previous_incarnations >= 0) & (previous_incarnations == job_incarnations)
+    orphan = has_previous & (previous_incarnations == -1) & (job_incarnations >= 0)
+    taken_by = next_record(jobs, waypoint_jobs[previous[orphan]], positions[previous[orphan]])
+    taken = (taken_by >= 0) & (take(jobs.incarnations, taken_by, -2) == job_incarnations[orphan])
+    taken[taken] = (
+        step_start(jobs.timestamps[taken_by[taken]], first_step) <= timestamps[previous[orphan]][taken] + ORPHAN_TTL
+    )
+    added[orphan] = taken
+    old_states = waypoint_states[np.maximum(previous, 0)]
+    old_states[~added] = None
+    changed = added & (old_states != waypoint_states)
+
+    # until the mission is received again after a job moved to it, a change of state clears its bucket
+    alias = np.zeros(len(df_waypoints), dtype=bool)
+    _, alias_ranks, ranks = dense_ranks(alias_incarnations, incarnations[has_mission])
+    alias_indexes = last_before(alias_ranks, alias_positions, ranks, positions[has_mission])
+    alias[has_mission] = take(alias_positions, alias_indexes, -1) > missions.positions[mission_records[has_mission]]
+    cleared = out_of_order | (changed & alias)
+
+    # the annotator, done missions only write for waypoints arriving right after their last update
+    done = has_mission & np.isin(take(mission_states, mission_records, None), DONE_STATES)
+    mission_timestamps = take(missions.timestamps, mission_records, 0)
+    in_time = np.abs(timestamps - mission_timestamps) / 1e9 / 60 <= TIME_LIMIT_MINUTES
+    arrived = np.fromiter(
+        (isinstance(state, str) and state in "arrived" for state in waypoint_states),
+        dtype=bool,
+        count=len(waypoint_states),
+    )
+    allowed = np.fromiter(
+        ((old, new) in ALLOWED_CHANGES for old, new in zip(old_states.tolist(), waypoint_states.tolist())),
+        dtype=bool,
+        count=len(waypoint_states),
+    )
+    writes = changed & has_mission & np.where(done, in_time & arrived, allowed)
+    kinds = np.where(writes & ~cleared, WRITE, np.where(cleared | (changed & done), CLEAR, NONE))
+    waypoint_events = has_mission & (kinds != NONE)
+
+    events = pd.DataFrame(
+        {
+            "incarnation": np.concatenate([job_clears[0][0], job_clears[1][0], incarnations[waypoint_events]]),
+            "position": np.concatenate([job_clears[0][1], job_clears[1][1], positions[waypoint_events]]),
+            "kind": np.concatenate(
+                [np.full(len(job_clears[0][0]) + len(job_clears[1][0]), CLEAR), kinds[waypoint_events]]
+            ),
+            "waypoint_id": np.concatenate(
+                [np.zeros(len(job_clears[0][0]) + len(job_clears[1][0]), dtype=np.int64), waypoint_ids[waypoint_events]]
+            ),
+        }
+    ).sort_values(["incarnation", "position"], kind="mergesort")  # stable
+    return Events(*(events[column].to_numpy() for column in events))
+
+
+@measure("vectorized.assign_tls")
+def assign_tls(batch: Batch, missions: Records, mission_frame: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    returns the mission incarnation (-1 for none) and the mission state code of every tracking location,
+    the mission of the courier (see tl_assignment) if it's alive, with the state of its last record
+    """
+    first_step = batch.first_step
+    couriers = mission_frame["courier_id"].to_numpy()[missions.rows]
+    mission_states = states(mission_frame)[missions.rows]
+    setters = np.flatnonzero((couriers != 0) & ~np.isin(mission_states, DONE_STATES))
+    by_courier = np.lexsort((missions.positions[setters], couriers[setters]))
+    setters = setters[by_courier]
+    tl_couriers = batch.tls["user_id"].to_numpy(dtype=np.int64, na_value=0)
+    tl_timestamps = batch.tls["timestamp"].to_numpy(dtype=np.int64)
+
+    _, setter_ranks, tl_ranks = dense_ranks(couriers[setters], tl_couriers)
+    setter = last_before(setter_ranks, missions.positions[setters], tl_ranks, batch.tl_positions)
+    setter_records = take(setters, setter, -1)
+    assigned = np.flatnonzero(setter_records >= 0)
+    current = np.full(len(tl_couriers), -1)
+    current[assigned] = lookup(
+        missions,
+        missions.ids[setter_records[assigned]],
+        batch.tl_positions[assigned],
+        tl_timestamps[assigned],
+        first_step,
+        EVICTION_DELAY,
+    )
+    # the eviction removes the courier of the last record of the evicted mission
+    last_of_incarnation = np.flatnonzero(np.append(missions.incarnations[1:] != missions.incarnations[:-1], True))
+    evicted_courier = couriers[last_of_incarnation][missions.incarnations[np.maximum(setter_records, 0)]]
+    valid = (current >= 0) & (
+        (take(missions.incarnations, current, -1) == take(missions.incarnations, setter_records, -2))
+        | (evicted_courier != tl_couriers)
+    )
+    # only the states of the records that tracking locations get are registered, in the order of their names
+    used = np.zeros(len(missions.ids), dtype=bool)
+    used[current[valid]] = True
+    record_codes = np.zeros(len(missions.ids), dtype=np.int16)
+    names = pd.Series(mission_states[used], dtype=object)
+    by_name = {name: mission_state_code(name) for name in sorted(pd.unique(names), key=str)}
+    record_codes[used] = names.map(by_name).to_numpy(dtype=np.int16)
+    codes = np.where(valid, record_codes[np.maximum(current, 0)], 0).astype(np.int16)
+    return np.where(valid, take(missions.incarnations, current, -1), -1), codes
+
+
+@measure("vectorized.annotate")
+def annotate(batch: Batch, datetime_upper_limit: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    returns the annotated tracking locations (rows of batch.tls) in the order app.run writes them,
+    with their mission state codes, their waypoint ids and the position of the writes
+    """
+    mission_frame, mission_positions = processed(batch.missions, batch.mission_positions, datetime_upper_limit)
+    missions = records(
+        mission_frame["id"].to_numpy(),
+        mission_positions,
+        mission_frame["timestamp"].to_numpy(),
+        batch.first_step,
+        EVICTION_DELAY,
+    )
+    events = bucket_events(batch, missions, mission_frame, datetime_upper_limit)
+    tl_incarnations, codes = assign_tls(batch, missions, mission_frame)
+
+    # the first bucket event of the mission at or after the tracking location
+    tls = np.flatnonzero(tl_incarnations >= 0)
+    multiplier = max(int(events.positions.max(initial=0)), int(batch.tl_positions.max(initial=0))) + 1
+    indexes = np.searchsorted(
+        events.incarnations * multiplier + events.positions,
+        tl_incarnations[tls] * multiplier + batch.tl_positions[tls],
+        side="left",
+    )
+    found = indexes < len(events.incarnations)
+    found[found] = events.incarnations[indexes[found]] == tl_incarnations[tls][found]
+    found[found] = events.kinds[indexes[found]] == WRITE
+    tls, indexes = tls[found], indexes[found]
+
+    # in the order of the writes, then of the tracking locations
+    order = np.lexsort((tls, events.positions[indexes]))
+    tls, indexes = tls[order], indexes[order]
+    return tls, codes[tls], events.waypoint_ids[indexes], events.positions[indexes]
+
+
+def run_vectorized(data_provider: DataProvider, data_sink: Sink) -> None:
+    """
+    annotates the batch of the data provider at once, like app.run without checkpoints,
+    one append per write like the annotator
+    """
+    batch = load(data_provider)
+    if not len(batch.tls):
+        return
+    datetime_upper_limit = get_datetime_upper_limit(data_provider)
+    rows, codes, waypoint_ids, writes = annotate(batch, datetime_upper_limit)
+    logger.info("%d tracking locations annotated by %d writes", len(rows), len(np.unique(writes)))
+    bounds = [0, *(np.flatnonzero(np.diff(writes)) + 1).tolist(), len(writes)] if len(writes) else []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        data_sink.append_rows(batch.tls, rows[start:stop], codes[start:stop], int(waypoint_ids[start]))
+    if data_sink.name != "memory_sink":
+        data_sink.flush()